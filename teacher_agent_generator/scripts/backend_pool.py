@@ -0,0 +1,264 @@
+# teacher_agent_generator/scripts/backend_pool.py
+import json
+import logging
+import os
+import threading
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+import resilience
+
+# Pseudo-provider selected by --backend_pool: each request goes to one of the pool's backends
+POOL_PROVIDER = "pool"
+BACKEND_PROVIDERS = ("ollama", "deepseek", "qwen")
+
+# 'least_outstanding' - the backend with the fewest in-flight requests per unit of weight
+# 'latency'           - the backend with the lowest expected wait: (in-flight + 1) x observed seconds
+#                       per output token / weight, so faster hosts get proportionally more requests
+ROUTING_POLICIES = ("least_outstanding", "latency")
+
+# Smoothing of each backend's observed seconds per output token (weight of the newest call)
+LATENCY_SMOOTHING = 0.2
+
+# While every backend is busy, how often a waiting request re-checks open circuits whose reset timeout may have passed
+_WAIT_RECHECK_SECONDS = 1.0
+
+
+class Backend:
+    """One endpoint of a backend pool, with its routing state."""
+
+    def __init__(self, name, provider, model, alias=None, base_url=None, api_key_env=None, weight=1.0, max_concurrency=None):
+        if provider not in BACKEND_PROVIDERS:
+            raise ValueError(f"Backend '{name}': unsupported provider '{provider}'. Expected one of: {', '.join(BACKEND_PROVIDERS)}")
+        if not model:
+            raise ValueError(f"Backend '{name}': 'model' is required.")
+        if weight is None or weight <= 0:
+            raise ValueError(f"Backend '{name}': 'weight' must be positive.")
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"Backend '{name}': 'max_concurrency' must be at least 1 (or omitted for no limit).")
+        self.name = name
+        self.provider = provider
+        self.model = model
+        self.alias = alias or model # The model name the drivers ask for (--model)
+        self.base_url = base_url # None uses the provider's configured endpoint (OLLAMA_HOST, DEEPSEEK_BASE_URL)
+        self.api_key = os.getenv(api_key_env) if api_key_env else None # None uses the provider's configured key
+        self.weight = float(weight)
+        self.max_concurrency = max_concurrency
+        self.breaker = resilience.get_circuit_breaker(f"backend {name}")
+        self.outstanding = 0
+        self.calls = 0
+        self.failures = 0
+        self.seconds_per_token = None
+
+    def has_capacity(self) -> bool:
+        return self.max_concurrency is None or self.outstanding < self.max_concurrency
+
+
+class BackendPool:
+    """
+    Routes requests over several endpoints serving the same model, e.g. a few CPU Ollama hosts.
+
+    A request names a model alias; acquire() picks one of the backends serving it and reserves one of its
+    `max_concurrency` slots, waiting while all of them are full. Routing follows `routing` (see
+    ROUTING_POLICIES), with ties going to the backend listed first. Each backend has its own circuit breaker
+    (resilience.CircuitBreaker): a host that keeps failing is taken out of rotation, and after the reset
+    timeout a single trial request decides whether it comes back.
+
+    Thread-safe.
+    """
+
+    def __init__(self, backends, routing=None):
+        routing = routing or config.BACKEND_ROUTING
+        if routing not in ROUTING_POLICIES:
+            raise ValueError(f"Invalid backend routing '{routing}'. Expected one of: {', '.join(ROUTING_POLICIES)}")
+        if not backends:
+            raise ValueError("A backend pool needs at least one backend.")
+        names = [backend.name for backend in backends]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Duplicate backend names: {', '.join(duplicates)}")
+        self.routing = routing
+        self.backends = list(backends)
+        self._by_alias = {}
+        for backend in self.backends:
+            self._by_alias.setdefault(backend.alias, []).append(backend)
+        self.capacity_waits = 0
+        self._condition = threading.Condition()
+
+    @property
+    def aliases(self) -> list:
+        return sorted(self._by_alias)
+
+    def _score(self, backend, fallback_seconds_per_token):
+        """Lower is better. Caller holds the lock."""
+        load = (backend.outstanding + 1) / backend.weight
+        if self.routing == "latency":
+            # Backends without observations yet are assumed as fast as the fastest one, so they get tried
+            return load * (backend.seconds_per_token or fallback_seconds_per_token)
+        return load
+
+    def _candidates(self, alias):
+        candidates = self._by_alias.get(alias)
+        if not candidates:
+            raise resilience.FatalProviderError(f"No backend in the pool serves model '{alias}' (available: {', '.join(self.aliases)}).")
+        return candidates
+
+    def _reserve(self, candidates):
+        """Takes a slot on the best healthy backend with capacity among `candidates`, or returns None. Caller holds the lock."""
+        observed = [b.seconds_per_token for b in candidates if b.seconds_per_token is not None]
+        fallback = min(observed) if observed else 1.0
+        for backend in sorted((b for b in candidates if b.has_capacity()), key=lambda b: self._score(b, fallback)):
+            try:
+                backend.breaker.before_call()
+            except resilience.CircuitOpenError:
+                continue
+            backend.outstanding += 1
+            return backend
+        return None
+
+    def acquire(self, alias) -> Backend:
+        """
+        Reserves a slot on the best healthy backend serving `alias`, waiting while all of them are full.
+        Every acquire() must be followed by release().
+
+        Raises:
+            resilience.FatalProviderError: No backend serves `alias`.
+            resilience.CircuitOpenError: Every backend serving `alias` is out of rotation (open circuit).
+        """
+        candidates = self._candidates(alias)
+        with self._condition:
+            waited = False
+            while True:
+                backend = self._reserve(candidates)
+                if backend is not None:
+                    if waited:
+                        self.capacity_waits += 1
+                    return backend
+                if not any(b.outstanding for b in candidates):
+                    # Nothing in flight will free a slot: every backend was skipped for its circuit
+                    raise resilience.CircuitOpenError(f"All {len(candidates)} backends serving '{alias}' are out of rotation; failing fast.")
+                waited = True
+                self._condition.wait(_WAIT_RECHECK_SECONDS)
+
+    def try_acquire(self, alias, exclude=None):
+        """
+        Like acquire(), but never waits: returns None if no healthy backend serving `alias` other than
+        `exclude` has a free slot. Used for hedged requests, which must not queue behind the call they back up.
+        """
+        candidates = [b for b in self._candidates(alias) if b is not exclude]
+        with self._condition:
+            return self._reserve(candidates)
+
+    def release(self, backend, call_seconds=None, output_tokens=None, failed=None):
+        """
+        Frees the slot taken by acquire(). `call_seconds` and `output_tokens` of a successful call update
+        the backend's observed speed; pass neither after a failure. A call abandoned without an outcome
+        (a cancelled hedge race loser) is released with failed=False.
+        """
+        if failed is None:
+            failed = call_seconds is None
+        with self._condition:
+            backend.outstanding -= 1
+            backend.calls += 1
+            if failed:
+                backend.failures += 1
+            elif output_tokens:
+                rate = call_seconds / output_tokens
+                previous = backend.seconds_per_token
+                backend.seconds_per_token = rate if previous is None else previous + LATENCY_SMOOTHING * (rate - previous)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "routing": self.routing,
+                "capacity_waits": self.capacity_waits,
+                "backends": {b.name: {"calls": b.calls, "failures": b.failures, "circuit": b.breaker.state,
+                                      "seconds_per_token": round(b.seconds_per_token, 5) if b.seconds_per_token is not None else None}
+                             for b in self.backends},
+            }
+
+
+def load_backend_pool(path, routing=None) -> BackendPool:
+    """
+    Loads a backend pool from a JSON file: either a list of backends, or an object with a "backends" list and
+    an optional "routing" (overridden by `routing`, defaulting to config.BACKEND_ROUTING). Each backend is an
+    object with "name", "provider", "model" and optionally "alias", "base_url", "api_key_env", "weight" and
+    "max_concurrency" (see Backend).
+
+    Raises:
+        ValueError: The file is not a valid pool definition.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            definition = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Backend pool file {path} is not valid JSON: {e}") from e
+    if isinstance(definition, dict):
+        routing = routing or definition.get("routing")
+        definition = definition.get("backends")
+    if not isinstance(definition, list):
+        raise ValueError(f"Backend pool file {path} must hold a list of backends or an object with a 'backends' list.")
+    backends = []
+    for index, entry in enumerate(definition):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Backend #{index} in {path} is not an object.")
+        entry = dict(entry)
+        entry.setdefault("name", f"{entry.get('provider')}-{index}")
+        try:
+            backends.append(Backend(**entry))
+        except TypeError as e:
+            raise ValueError(f"Backend '{entry['name']}' in {path}: {e}") from e
+    pool = BackendPool(backends, routing)
+    logging.info(f"Loaded backend pool {path}: {len(backends)} backends, routing '{pool.routing}', models {pool.aliases}.")
+    return pool
+
+
+if __name__ == '__main__':
+    import concurrent.futures
+    import random
+    import time
+
+    print("Backend Pool Module - Test Run")
+    # Two hosts serving the same model; 'fast' decodes three times as fast as 'slow'.
+    speeds = {"fast": 0.003, "slow": 0.009}
+    for routing in ROUTING_POLICIES:
+        pool = BackendPool([Backend("fast", "ollama", "llama3:8b", alias="llama3", max_concurrency=3),
+                            Backend("slow", "ollama", "llama3:8b", alias="llama3", max_concurrency=3)], routing=routing)
+        served = {"fast": 0, "slow": 0}
+
+        def fake_request(_):
+            backend = pool.acquire("llama3")
+            try:
+                tokens = random.randint(5, 15)
+                time.sleep(tokens * speeds[backend.name])
+                served[backend.name] += 1
+            finally:
+                pool.release(backend, tokens * speeds[backend.name], tokens)
+
+        started = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(fake_request, range(200)))
+        print(f"{routing}: served {served} in {time.monotonic() - started:.2f}s; {pool.stats()['backends']}")
+
+    pool = BackendPool([Backend("down", "ollama", "m")], routing="least_outstanding")
+    for _ in range(config.CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+        backend = pool.acquire("m")
+        backend.breaker.record_failure(TimeoutError("connect timed out"))
+        pool.release(backend)
+    try:
+        pool.acquire("m")
+    except resilience.CircuitOpenError as e:
+        print(f"Unhealthy backend out of rotation: {e}")
+    pool = BackendPool([Backend("a", "ollama", "m", max_concurrency=1), Backend("b", "ollama", "m", max_concurrency=1)])
+    primary = pool.acquire("m")
+    hedge = pool.try_acquire("m", exclude=primary)
+    print(f"Hedge target besides '{primary.name}': {hedge.name}; with both busy: {pool.try_acquire('m', exclude=hedge)}")
+    print("Backend Pool Module - Test Run Finished")
@@ -0,0 +1,156 @@
+# teacher_agent_generator/scripts/batch_client.py
+import json
+import logging
+import os
+import time
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of local modules from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+import llm_interface
+
+# Providers reachable through an OpenAI-compatible Batch API (files + batches endpoints)
+BATCH_CAPABLE_PROVIDERS = ("deepseek",)
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def write_batch_request_file(requests, file_path, model_name, temperature, max_tokens):
+    """
+    Serializes chat-completion requests into a Batch API input file (one JSON request per line).
+
+    Args:
+        requests (iterable): (custom_id, system_prompt, user_prompt) tuples. custom_id must be unique.
+        file_path (str): Where to write the JSONL request file.
+        model_name (str), temperature (float), max_tokens (int): Generation settings for every request.
+
+    Returns:
+        int: The number of requests written.
+    """
+    count = 0
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for custom_id, system_prompt, user_prompt in requests:
+            body = {
+                "model": model_name,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "temperature": temperature,
+            }
+            if max_tokens > 0:
+                body["max_tokens"] = max_tokens
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body}) + '\n')
+            count += 1
+    return count
+
+def submit_batch(client, request_file_path, completion_window="24h"):
+    """Uploads the request file and creates a batch job. Returns the batch object."""
+    with open(request_file_path, 'rb') as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=BATCH_ENDPOINT,
+                                  completion_window=completion_window)
+    logging.info(f"Submitted batch {batch.id} (input file {input_file.id}).")
+    return batch
+
+def wait_for_batch(client, batch_id, poll_interval_seconds=None, timeout_seconds=None):
+    """
+    Polls a batch until it reaches a terminal status or `timeout_seconds` elapses.
+
+    Returns:
+        The final batch object (check .status).
+
+    Raises:
+        TimeoutError: If the batch is still running after `timeout_seconds`.
+    """
+    poll_interval_seconds = poll_interval_seconds or config.BATCH_POLL_INTERVAL_SECONDS
+    timeout_seconds = timeout_seconds or config.BATCH_TIMEOUT_SECONDS
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = getattr(batch, 'request_counts', None)
+        progress = f" ({counts.completed}/{counts.total} done, {counts.failed} failed)" if counts else ""
+        logging.info(f"Batch {batch_id} status: {batch.status}{progress}")
+        if batch.status in BATCH_TERMINAL_STATUSES:
+            return batch
+        if time.monotonic() >= deadline:
+            raise TimeoutError(f"Batch {batch_id} did not finish within {timeout_seconds}s (status: {batch.status}).")
+        time.sleep(poll_interval_seconds)
+
+def _read_file_lines(client, file_id):
+    content = client.files.content(file_id)
+    text = content.text if hasattr(content, 'text') else content.read().decode('utf-8')
+    for line in text.splitlines():
+        if line.strip():
+            yield json.loads(line)
+
+def download_batch_results(client, batch):
+    """
+    Maps a finished batch's output (and error) files back to per-request results.
+
+    Returns:
+        dict: custom_id -> {"content", "error", "attempts", "cache_hit", "batch_id"}, in the same
+              shape as llm_interface.generate_response_detailed() plus the batch id.
+    """
+    results = {}
+    for file_id in (getattr(batch, 'output_file_id', None), getattr(batch, 'error_file_id', None)):
+        if not file_id:
+            continue
+        for line in _read_file_lines(client, file_id):
+            result = {"content": None, "error": None, "attempts": 1, "cache_hit": False, "usage": None, "batch_id": batch.id}
+            response = line.get("response") or {}
+            body = response.get("body") or {}
+            if line.get("error"):
+                result["error"] = f"Batch request error: {line['error']}"
+            elif response.get("status_code") != 200:
+                result["error"] = f"Batch request failed with status {response.get('status_code')}: {body.get('error', body)}"
+            else:
+                try:
+                    result["content"] = body["choices"][0]["message"]["content"]
+                    result["usage"] = llm_interface.openai_style_usage(body.get("usage"))
+                except (KeyError, IndexError, TypeError):
+                    result["error"] = f"Unexpected batch response body: {str(body)[:200]}"
+            results[line.get("custom_id")] = result
+    return results
+
+def run_batch(requests, provider, model_name, temperature, max_tokens, request_file_path):
+    """
+    Runs a list of requests through the provider's Batch API end to end: serialize, upload,
+    submit, poll and download.
+
+    Args:
+        requests (list): (custom_id, system_prompt, user_prompt) tuples.
+        provider (str): Must be in BATCH_CAPABLE_PROVIDERS.
+        request_file_path (str): Where the batch input file is written (kept for inspection).
+
+    Returns:
+        dict: custom_id -> result dict (see download_batch_results). Requests missing from the
+              batch output map to a result with an error message.
+    """
+    if provider not in BATCH_CAPABLE_PROVIDERS:
+        raise ValueError(f"Batch mode is not supported for provider '{provider}'. Supported: {', '.join(BATCH_CAPABLE_PROVIDERS)}")
+    if not llm_interface.provider_sdk_available('deepseek'):
+        raise RuntimeError("OpenAI SDK is not installed. Cannot use batch mode.")
+
+    request_count = write_batch_request_file(requests, request_file_path, model_name, temperature, max_tokens)
+    logging.info(f"Wrote {request_count} batch requests to {request_file_path}.")
+
+    client = llm_interface.get_client(provider, base_url=config.DEEPSEEK_BASE_URL, api_key=config.OPENAI_API_KEY)
+    batch = submit_batch(client, request_file_path)
+    batch = wait_for_batch(client, batch.id)
+    if batch.status != "completed":
+        logging.error(f"Batch {batch.id} ended with status '{batch.status}'.")
+
+    results = download_batch_results(client, batch)
+    missing_error = f"No result for this request in batch {batch.id} (status: {batch.status})."
+    for custom_id, _, _ in requests:
+        if custom_id not in results:
+            results[custom_id] = {"content": None, "error": missing_error, "attempts": 1,
+                                  "cache_hit": False, "usage": None, "batch_id": batch.id}
+    return results
@@ -0,0 +1,335 @@
+# teacher_agent_generator/scripts/benchmark.py
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import mock_llm_server
+import prompt_store
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+DRIVERS = ("teacher", "mtpe")
+BENCHMARK_MODEL = "mock-model"
+
+# Modules that must not be imported just by importing the drivers (see --import_time)
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "ollama", "openai", "dashscope", "httpx")
+IMPORT_TIME_BUDGET_MS = 300.0
+
+# Fields compared by --baseline: (field, True if higher is better)
+REGRESSION_FIELDS = (("requests_per_second", True), ("p50_latency_seconds", False), ("p99_latency_seconds", False))
+
+
+def _parse_grid(spec):
+    """Parses a grid size like '10x20' into (personas, tasks)."""
+    try:
+        personas, tasks = (int(part) for part in spec.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid grid '{spec}'. Expected PERSONASxTASKS, e.g. 10x20.")
+    if personas < 1 or tasks < 1:
+        raise argparse.ArgumentTypeError(f"Invalid grid '{spec}'. Both sizes must be at least 1.")
+    return personas, tasks
+
+def _percentile(values, percentile):
+    """Nearest-rank percentile of a list of numbers (None for an empty list)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percentile // 100)) # ceil without floats
+    return ordered[int(rank) - 1]
+
+
+# --- Synthetic inputs ---
+
+def write_teacher_inputs(directory, persona_count, task_count):
+    """
+    Writes personas.csv, questions.txt and questionnaire.json for a persona x task grid.
+    Half the tasks (rounded up) are open-ended questions, the rest Likert items (packable with --pack_size).
+    """
+    personas_path = os.path.join(directory, "personas.csv")
+    with open(personas_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["name", "gender", "title", "teaching_experience_years", "professional_background", "teaching_plan"])
+        for i in range(persona_count):
+            writer.writerow([f"Teacher {i}", "female" if i % 2 else "male", "Lecturer", 1 + i % 30,
+                             f"Background of teacher {i}: studied education and taught for several years.",
+                             f"Teaching plan {i}: project-based units with weekly formative feedback."])
+    open_ended_count = (task_count + 1) // 2
+    questions_path = os.path.join(directory, "questions.txt")
+    with open(questions_path, 'w', encoding='utf-8') as f:
+        for i in range(open_ended_count):
+            f.write(f"Question {i}: how do you approach topic {i} with a mixed-ability class?\n")
+    questionnaire_path = os.path.join(directory, "questionnaire.json")
+    with open(questionnaire_path, 'w', encoding='utf-8') as f:
+        json.dump([{"id": f"q{i}", "type": "likert_scale", "text": f"I feel confident about aspect {i} of teaching (1-5)."}
+                   for i in range(task_count - open_ended_count)], f)
+    return ["--personas_file", personas_path, "--questions_file", questions_path, "--questionnaire_file", questionnaire_path]
+
+def write_mtpe_inputs(directory, persona_count, task_count):
+    """Writes a translator personas CSV and an MTPE tasks JSONL file for a persona x task grid."""
+    personas_path = os.path.join(directory, "personas_translator.csv")
+    with open(personas_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["persona_id", "persona_name", "native_language", "education_level", "major_subject", "gender",
+                         "english_proficiency_score", "has_translation_certification", "translation_experience_years_raw",
+                         "employment_type", "sample_source_text_ch", "sample_translation_en", "common_linguistic_traits",
+                         "cat_tool_familiarity"])
+        for i in range(persona_count):
+            writer.writerow([f"T{i:04d}", f"Translator {i}", "Chinese", "Master", "Translation", "female" if i % 2 else "male",
+                             80 + i % 20, "Yes" if i % 3 == 0 else "No", 1 + i % 10, "Freelancer",
+                             "今天天气很好。", "The weather is nice today.", "Occasional article omissions", "Trados"])
+    tasks_path = os.path.join(directory, "mtpe_tasks.jsonl")
+    with open(tasks_path, 'w', encoding='utf-8') as f:
+        for i in range(task_count):
+            f.write(json.dumps({"task_id": f"MTPE{i:04d}", "source_text_ch": f"这是第{i}个测试句子，用于评估译后编辑。",
+                                "machine_translation_en": f"This is test sentence {i}, for evaluate post-editing.",
+                                "domain": "general", "difficulty_level": "medium"}, ensure_ascii=False) + "\n")
+    return ["--translator_personas_file", personas_path, "--mtpe_tasks_file", tasks_path]
+
+
+# --- Running a scenario ---
+
+def write_backend_pool(path, server_urls, provider):
+    """Writes a backend pool file routing BENCHMARK_MODEL over the given mock servers."""
+    backends = [{"name": f"mock-{i}", "provider": provider, "model": BENCHMARK_MODEL,
+                 "base_url": f"{url}/v1" if provider == "deepseek" else url} for i, url in enumerate(server_urls)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"backends": backends}, f, indent=2)
+    return path
+
+def _driver_command(driver, input_args, output_dir, provider, concurrency, extra_args, backend_pool_path=None):
+    provider_args = ["--provider", provider] if backend_pool_path is None else ["--provider", "pool", "--backend_pool", backend_pool_path]
+    if driver == "teacher":
+        return [sys.executable, os.path.join(SCRIPTS_DIR, "main_generator.py"), *input_args, "--output_dir", output_dir,
+                *provider_args, "--model", BENCHMARK_MODEL, "--concurrency", str(concurrency),
+                "--log_level", "WARNING", *extra_args]
+    return [sys.executable, os.path.join(SCRIPTS_DIR, "main_translator_mtpe.py"), *input_args, "--output_dir", output_dir,
+            *provider_args, "--model_name", BENCHMARK_MODEL, "--workers", str(concurrency),
+            "--log_level", "WARNING", *extra_args]
+
+def _read_records(output_dir):
+    records = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "*.jsonl"))):
+        if path.endswith((".batch_input.jsonl", prompt_store.PERSONAS_SUFFIX, prompt_store.PROMPTS_SUFFIX)):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    for path in sorted(glob.glob(os.path.join(output_dir, "*.parquet"))): # --extra_args="--output_format parquet"
+        import pyarrow.parquet
+        records.extend(pyarrow.parquet.read_table(path).to_pylist())
+    return records
+
+def run_scenario(driver, grid, concurrency, provider, server_url, work_dir, extra_args=(), backend_pool_path=None, backends=1):
+    """
+    Runs one driver end to end against the mock server and measures it. With `backend_pool_path`, the
+    driver instead routes its requests over the `backends` mock servers listed in that pool file.
+
+    Returns:
+        dict: The scenario (driver, personas, tasks, concurrency) with requests, errors, wall time,
+              requests/s, p50/p99 of the records' generation_time_seconds, and the driver's peak RSS.
+    """
+    personas, tasks = grid
+    scenario_dir = tempfile.mkdtemp(prefix=f"{driver}_{personas}x{tasks}_c{concurrency}_", dir=work_dir)
+    output_dir = os.path.join(scenario_dir, "outputs")
+    writer = write_teacher_inputs if driver == "teacher" else write_mtpe_inputs
+    command = _driver_command(driver, writer(scenario_dir, personas, tasks), output_dir, provider, concurrency, list(extra_args),
+                              backend_pool_path)
+
+    env = dict(os.environ,
+               OLLAMA_HOST=server_url, DEEPSEEK_BASE_URL=f"{server_url}/v1", OPENAI_API_KEY="mock-key",
+               LOG_FILE=os.path.join(scenario_dir, "generation.log"), RESPONSE_CACHE_MODE="off")
+    log_path = os.path.join(scenario_dir, "driver_output.log")
+    with open(log_path, 'w', encoding='utf-8') as log_file:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=scenario_dir, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_seconds = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    records = _read_records(output_dir)
+    error_field = "error" if driver == "teacher" else "generation_error"
+    latencies = [r["generation_time_seconds"] for r in records if r.get("generation_time_seconds") is not None]
+    errors = sum(1 for r in records if r.get(error_field))
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss_mb = rusage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    if process.returncode != 0:
+        logging.warning(f"{driver} exited with status {process.returncode}; see {log_path}")
+    return {
+        "driver": driver, "personas": personas, "tasks": tasks, "concurrency": concurrency, "backends": backends,
+        "exit_code": process.returncode, "requests": len(records), "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "requests_per_second": round(len(records) / wall_seconds, 3) if wall_seconds > 0 else None,
+        "p50_latency_seconds": _percentile(latencies, 50), "p99_latency_seconds": _percentile(latencies, 99),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+def scenario_key(result):
+    key = f"{result['driver']}:{result['personas']}x{result['tasks']}:c{result['concurrency']}"
+    return key + (f":b{result['backends']}" if result.get("backends", 1) > 1 else "")
+
+
+# --- Reporting ---
+
+def format_table(results) -> str:
+    header = f"{'scenario':<28} {'reqs':>6} {'errors':>6} {'wall s':>8} {'req/s':>8} {'p50 s':>7} {'p99 s':>7} {'RSS MB':>7}"
+    lines = [header, "-" * len(header)]
+    fmt = lambda value, width, digits=2: f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+    for r in results:
+        lines.append(f"{scenario_key(r):<28} {r['requests']:>6} {r['errors']:>6} {fmt(r['wall_seconds'], 8)} "
+                     f"{fmt(r['requests_per_second'], 8)} {fmt(r['p50_latency_seconds'], 7)} "
+                     f"{fmt(r['p99_latency_seconds'], 7)} {fmt(r['peak_rss_mb'], 7, 1)}")
+    return "\n".join(lines)
+
+def find_regressions(results, baseline_results, tolerance) -> list:
+    """
+    Compares results with a baseline run (matched by scenario) and returns a description of every
+    metric that got worse by more than `tolerance` (a fraction, e.g. 0.15 for 15%).
+    """
+    baseline = {scenario_key(r): r for r in baseline_results}
+    regressions = []
+    for result in results:
+        previous = baseline.get(scenario_key(result))
+        if previous is None:
+            continue
+        for field, higher_is_better in REGRESSION_FIELDS:
+            old, new = previous.get(field), result.get(field)
+            if not old or new is None:
+                continue
+            change = (old - new) / old if higher_is_better else (new - old) / old
+            if change > tolerance:
+                regressions.append(f"{scenario_key(result)} {field}: {old} -> {new} ({change:+.0%} worse)")
+    return regressions
+
+
+# --- Import time ---
+
+_IMPORT_PROBE = """
+import json, sys, time
+sys.path.insert(0, {scripts_dir!r})
+started = time.perf_counter()
+import main_generator, main_translator_mtpe
+elapsed_ms = (time.perf_counter() - started) * 1000
+print(json.dumps({{"import_ms": elapsed_ms, "heavy_modules": sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+
+def measure_import_time(repeat=5):
+    """
+    Imports both drivers in `repeat` fresh interpreters.
+
+    Returns:
+        dict: median and max import time in milliseconds, and the HEAVY_MODULES that got imported.
+    """
+    probe = _IMPORT_PROBE.format(scripts_dir=SCRIPTS_DIR, heavy=HEAVY_MODULES)
+    env = dict(os.environ, LOG_FILE=os.devnull)
+    timings, heavy_modules = [], set()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True, text=True, check=True).stdout
+        measurement = json.loads(output.strip().splitlines()[-1])
+        timings.append(measurement["import_ms"])
+        heavy_modules.update(measurement["heavy_modules"])
+    return {"median_ms": _percentile(timings, 50), "max_ms": max(timings), "heavy_modules": sorted(heavy_modules)}
+
+def check_import_time(budget_ms, repeat=5) -> bool:
+    """Prints the drivers' import time and returns False if it exceeds `budget_ms` or imports a heavy module."""
+    result = measure_import_time(repeat)
+    print(f"Driver import time over {repeat} runs: median {result['median_ms']:.1f} ms, max {result['max_ms']:.1f} ms "
+          f"(budget {budget_ms:.0f} ms)")
+    within_budget = result["median_ms"] <= budget_ms
+    if not within_budget:
+        print(f"Import time exceeds the budget of {budget_ms:.0f} ms.")
+    if result["heavy_modules"]:
+        print(f"Importing the drivers also imported: {', '.join(result['heavy_modules'])}. "
+              "These should only be imported when used.")
+    return within_budget and not result["heavy_modules"]
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark the generation drivers end to end against a local mock LLM server.")
+    parser.add_argument("--drivers", nargs="+", choices=DRIVERS, default=list(DRIVERS), help="Drivers to benchmark.")
+    parser.add_argument("--grids", nargs="+", type=_parse_grid, default=[(5, 10)],
+                        help="Grid sizes as PERSONASxTASKS (e.g. 5x10 20x20).")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16],
+                        help="Concurrency levels (--concurrency for the teacher driver, --workers for MTPE).")
+    parser.add_argument("--provider", choices=["ollama", "deepseek"], default="ollama",
+                        help="Which provider API the drivers use to reach the mock (Ollama chat or OpenAI chat-completions).")
+    parser.add_argument("--backends", type=int, default=1,
+                        help="Start this many mock servers and route the drivers over all of them through a backend pool "
+                             "(--provider pool). Combine with --max_parallel to model hosts of limited capacity.")
+    parser.add_argument("--extra_args", type=str, default="",
+                        help="Extra arguments passed to every driver run, e.g. \"--stream --schedule prompt_group\".")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="Directory for generated inputs, outputs and driver logs (default: a temporary directory).")
+    parser.add_argument("--output_json", type=str, default=None, help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Results JSON of an earlier run; exit with status 1 if any scenario regressed beyond --tolerance.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression against --baseline.")
+    parser.add_argument("--import_time", action="store_true",
+                        help="Only check how long importing the drivers takes and that it imports no provider SDK or pandas; "
+                             "exit with status 1 if it does or exceeds --import_budget_ms.")
+    parser.add_argument("--import_budget_ms", type=float, default=IMPORT_TIME_BUDGET_MS,
+                        help="Median import-time budget for --import_time, in milliseconds.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of fresh interpreters measured by --import_time.")
+    mock_llm_server.add_mock_settings_arguments(parser)
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_arguments()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+    if args.import_time:
+        sys.exit(0 if check_import_time(args.import_budget_ms, args.repeat) else 1)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="teacher_agent_benchmark_")
+    os.makedirs(work_dir, exist_ok=True)
+    servers = []
+    for index in range(max(1, args.backends)):
+        settings = mock_llm_server.mock_settings_from_args(args)
+        if settings.seed is not None:
+            settings.seed += index # Independent latencies and failures per server
+        servers.append(mock_llm_server.start_mock_server(settings))
+    server = servers[0]
+    backend_pool_path = None
+    if len(servers) > 1:
+        backend_pool_path = write_backend_pool(os.path.join(work_dir, "backend_pool.json"), [s.url for s in servers], args.provider)
+    logging.info(f"Mock LLM server{'s' if len(servers) > 1 else ''} on {', '.join(s.url for s in servers)}; benchmark files in {work_dir}")
+
+    results = []
+    try:
+        for driver in args.drivers:
+            for grid in args.grids:
+                for concurrency in args.concurrency:
+                    result = run_scenario(driver, grid, concurrency, args.provider, server.url, work_dir, shlex.split(args.extra_args),
+                                          backend_pool_path, len(servers))
+                    logging.info(f"{scenario_key(result)}: {result['requests']} records, {result['requests_per_second']} req/s")
+                    results.append(result)
+    finally:
+        for running_server in servers:
+            running_server.shutdown()
+
+    print(format_table(results))
+    if args.output_json:
+        with open(args.output_json, 'w', encoding='utf-8') as f:
+            json.dump({"mock_settings": {k: v for k, v in vars(server.backend.settings).items()}, "results": results}, f, indent=2)
+        print(f"Results written to {args.output_json}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = find_regressions(results, json.load(f)["results"], args.tolerance)
+        if regressions:
+            print(f"Regressions beyond {args.tolerance:.0%} against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.baseline}.")
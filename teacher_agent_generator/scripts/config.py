@@ -15,6 +15,35 @@ DEFAULT_MODEL = "gpt-4-turbo" # Example, can be changed
 DEFAULT_TEMPERATURE = 0.7
 MAX_TOKENS = 1500
 
+# Provider endpoints (override for self-hosted or proxy deployments)
+OLLAMA_HOST = os.getenv("OLLAMA_HOST") # None lets the Ollama client use its default (http://localhost:11434)
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+
+# Stream responses by default (--stream), which records time-to-first-token per request
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() in ("1", "true", "yes")
+
+# Backend pool (--backend_pool): a JSON file of endpoints (e.g. several Ollama hosts) to spread requests over
+# instead of using a single provider; see backend_pool.py. BACKEND_ROUTING applies unless the file sets "routing":
+# 'least_outstanding' or 'latency'.
+BACKEND_POOL_FILE = os.getenv("BACKEND_POOL_FILE") or None
+BACKEND_ROUTING = os.getenv("BACKEND_ROUTING", "least_outstanding")
+
+# Hedged requests (--hedge): a call still running after HEDGE_PERCENTILE of recent latencies for its task type
+# gets a duplicate on another backend (or another connection); the first to finish wins; see hedging.py.
+# At most HEDGE_BUDGET_FRACTION of requests (plus a burst of HEDGE_BUDGET_BURST) are hedged, and only
+# once HEDGE_MIN_SAMPLES latencies (of the last HEDGE_LATENCY_WINDOW) are known.
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() in ("1", "true", "yes")
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_BUDGET_FRACTION = float(os.getenv("HEDGE_BUDGET_FRACTION", "0.05"))
+HEDGE_BUDGET_BURST = 3
+HEDGE_MIN_SAMPLES = 20
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_DELAY_SECONDS = 0.5 # Never hedge sooner than this, however fast recent calls were
+
+# HTTP connection pooling for provider clients.
+# One long-lived client is kept per (provider, base_url, api_key); this caps its pool of keep-alive connections.
+LLM_CONNECTION_POOL_SIZE = int(os.getenv("LLM_CONNECTION_POOL_SIZE", "16"))
+
 # File Paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
@@ -27,7 +56,97 @@ DEFAULT_TRANSLATOR_PERSONAS_CSV_PATH = os.path.join(DATA_DIR, "personas_translat
 DEFAULT_MTPE_TASKS_PATH = os.path.join(DATA_DIR, "mtpe_tasks.jsonl") # Path for MTPE tasks
 
 GENERATED_AGENTS_DIR = os.path.join(OUTPUT_DIR, "generated_agents")
-LOG_FILE = os.path.join(OUTPUT_DIR, "generation.log")
+LOG_FILE = os.getenv("LOG_FILE", os.path.join(OUTPUT_DIR, "generation.log"))
+
+# Streaming output: records are flushed as they complete and fsynced every N records or T seconds
+OUTPUT_FSYNC_EVERY_RECORDS = 50
+OUTPUT_FSYNC_INTERVAL_SECONDS = 10.0
+
+# Output format (--output_format): 'full' JSONL embeds persona details and system prompts in every record,
+# 'normalized' JSONL stores each once in side tables keyed by SHA-256 digest (see prompt_store.py),
+# 'parquet' writes full records to a compressed Parquet file in row groups of PARQUET_ROW_GROUP_SIZE records
+OUTPUT_FORMAT = os.getenv("OUTPUT_FORMAT", "full")
+PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "10000"))
+PARQUET_COMPRESSION = "zstd"
+
+# Per-provider throttling. Any limit can be None (unlimited).
+# - requests_per_minute / tokens_per_minute: token-bucket quotas (tokens = estimated prompt + max_tokens)
+# - max_concurrency: ceiling for the adaptive (AIMD) in-flight limit, which halves on 429/throttling
+#   errors and grows back by ~1 slot per `limit` successful calls.
+PROVIDER_RATE_LIMITS = {
+    "deepseek": {"requests_per_minute": None, "tokens_per_minute": None, "max_concurrency": 32},
+    "qwen": {"requests_per_minute": 300, "tokens_per_minute": 500000, "max_concurrency": 16},
+    "ollama": {"requests_per_minute": None, "tokens_per_minute": None, "max_concurrency": None},
+}
+
+# Retries and circuit breaking for provider calls
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3")) # Retries after the first attempt, for transient errors only
+LLM_RETRY_BASE_DELAY_SECONDS = 1.0 # Exponential backoff base; each delay is drawn uniformly from [0, base * 2^(n-1)]
+LLM_RETRY_MAX_DELAY_SECONDS = 30.0
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5 # Consecutive transient failures before a provider's circuit opens
+CIRCUIT_BREAKER_RESET_SECONDS = 30.0 # How long an open circuit fails fast before a trial call is allowed
+
+# Opt-in disk cache of LLM responses (modes: off, read, readwrite), keyed by a digest of the full request
+RESPONSE_CACHE_MODE = os.getenv("RESPONSE_CACHE_MODE", "off")
+RESPONSE_CACHE_PATH = os.path.join(OUTPUT_DIR, "cache", "llm_responses.sqlite3")
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024))) # 1 GiB of response text
+RESPONSE_CACHE_ACCESS_FLUSH_ENTRIES = 1000 # Cache hits' LRU refreshes are written in batches of up to this many
+
+# Request scheduling (--schedule): 'fifo', 'prompt_group' or 'longest_first' (see scheduling.py).
+# prompt_group pins each persona's system prompt to one of PROMPT_SCHEDULER_LANES client lanes
+# and warms its prefix cache with a single request before the rest of the group is sent.
+SCHEDULING_POLICY = os.getenv("SCHEDULING_POLICY", "fifo")
+PROMPT_SCHEDULER_LANES = int(os.getenv("PROMPT_SCHEDULER_LANES", "4"))
+
+# longest_first issues the most expensive jobs of each LONGEST_FIRST_WINDOW_JOBS-job window first.
+# A job's expected output tokens come from these tables and are scaled by the seconds per expected
+# token observed so far for its class (teacher task type, MTPE difficulty level).
+LONGEST_FIRST_WINDOW_JOBS = int(os.getenv("LONGEST_FIRST_WINDOW_JOBS", "10000"))
+EXPECTED_OUTPUT_TOKENS_BY_TASK_TYPE = {"open_ended": 400, "likert_scale": 10, "multiple_choice": 15}
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 200 # Other teacher task types
+MTPE_BASE_EXPECTED_OUTPUT_TOKENS = 250 # Think-aloud protocol and ratings, independent of the source length
+MTPE_EXPECTED_TOKENS_PER_SOURCE_TOKEN = 3.0 # Post-edited text plus the think-aloud discussion of it
+MTPE_DIFFICULTY_COST_FACTORS = {"easy": 0.75, "medium": 1.0, "hard": 1.5}
+
+# Token accounting and max_tokens sizing (--max_tokens_mode, --context_window; see token_budget.py).
+# Prompt tokens are counted with tiktoken's TOKENIZER_ENCODING when tiktoken is installed (approximate for
+# non-OpenAI models; empty to disable), else estimated from characters. 'adaptive' sizes each request's
+# max_tokens from the MAX_TOKENS_PERCENTILE of recent output lengths of its class (task type, difficulty level)
+# relative to the expected-token tables above, times MAX_TOKENS_HEADROOM; MAX_TOKENS (or --max_tokens) is the cap.
+MAX_TOKENS_MODE = os.getenv("MAX_TOKENS_MODE", "fixed")
+TOKENIZER_ENCODING = os.getenv("TOKENIZER_ENCODING", "cl100k_base")
+MAX_TOKENS_PERCENTILE = 99
+MAX_TOKENS_HEADROOM = 1.5
+MAX_TOKENS_MIN_SAMPLES = 20 # Outputs of a class observed before its requests are sized
+MAX_TOKENS_WINDOW = 500 # Recent outputs per class considered
+MAX_TOKENS_STEP = 32 # Sized limits are rounded up to a multiple of this
+MIN_MAX_TOKENS = 16
+# Context windows (prompt + output tokens) by provider for the pre-flight overflow check. Ollama's is its default
+# num_ctx, which a model's Modelfile may raise; --context_window overrides all of them.
+CONTEXT_WINDOW_TOKENS = {"ollama": 4096, "deepseek": 65536, "qwen": 131072}
+DEFAULT_CONTEXT_WINDOW_TOKENS = 8192
+CONTEXT_MARGIN_TOKENS = 64 # Chat template tokens and tokenizer differences
+
+# MTPE tasks are read in blocks of this many, each paired with every persona before the next block is read:
+# memory holds one block, and the task file is read once (plus a counting pass) whatever the persona count.
+MTPE_TASK_BLOCK_SIZE = int(os.getenv("MTPE_TASK_BLOCK_SIZE", "10000"))
+
+# Multi-item packing (--pack_size): questionnaire item types short enough to answer several per LLM call
+PACKABLE_TASK_TYPES = ("likert_scale", "multiple_choice")
+
+# MTPE response repair (--json_repair_attempts): follow-up calls that fix an unparseable MTPE JSON response.
+# Their max_tokens is the response's estimated length plus this margin, capped at the run's max_tokens.
+MTPE_JSON_REPAIR_ATTEMPTS = int(os.getenv("MTPE_JSON_REPAIR_ATTEMPTS", "1"))
+MTPE_REPAIR_TOKEN_MARGIN = 128
+
+# Batch API mode (--batch): how often to poll a submitted batch and how long to wait for it
+BATCH_POLL_INTERVAL_SECONDS = 30.0
+BATCH_TIMEOUT_SECONDS = 26 * 60 * 60 # The provider's 24h completion window plus margin
+
+# Metrics export (--metrics_file / --metrics_port): Prometheus text format, refreshed every N seconds
+METRICS_FILE = os.getenv("METRICS_FILE") # None disables the textfile export
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) or None # None disables the HTTP endpoint
+METRICS_EXPORT_INTERVAL_SECONDS = 15.0
 
 # Ensure output directories exist
 os.makedirs(GENERATED_AGENTS_DIR, exist_ok=True)
@@ -0,0 +1,201 @@
+# teacher_agent_generator/scripts/hedging.py
+import collections
+import math
+import os
+import queue
+import threading
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+
+# Which call of a hedged request finished first (the 'hedge_winner' record field)
+HEDGE_WINNERS = ("primary", "hedge")
+
+
+class HedgeCancelled(Exception):
+    """Raised inside a streamed call whose race was already won by the other call, to abort its stream."""
+
+
+class Hedger:
+    """
+    Decides when a slow provider call gets a duplicate (a hedge), and caps how many are sent.
+
+    - Delay: recent successful call latencies are kept per key (provider, model and a latency class such as
+      the task type, since a Likert answer and an essay are not comparably slow). A call still running after
+      the `percentile` of its key's window is hedged. No hedging before `min_samples` latencies are known.
+    - Budget: at most `budget_fraction` of requests, plus a burst of `budget_burst`, may be hedged, so a
+      provider-wide slowdown cannot double the load.
+
+    Thread-safe.
+    """
+
+    def __init__(self, percentile=None, budget_fraction=None, budget_burst=None, min_samples=None, window=None,
+                 min_delay_seconds=None):
+        self.percentile = percentile if percentile is not None else config.HEDGE_PERCENTILE
+        if not 0 < self.percentile < 100:
+            raise ValueError(f"Hedge percentile must be between 0 and 100, got {self.percentile}.")
+        self.budget_fraction = budget_fraction if budget_fraction is not None else config.HEDGE_BUDGET_FRACTION
+        self.budget_burst = budget_burst if budget_burst is not None else config.HEDGE_BUDGET_BURST
+        self.min_samples = min_samples or config.HEDGE_MIN_SAMPLES
+        self.window = window or config.HEDGE_LATENCY_WINDOW
+        self.min_delay_seconds = min_delay_seconds if min_delay_seconds is not None else config.HEDGE_MIN_DELAY_SECONDS
+        self.requests = 0
+        self.hedges_sent = 0
+        self.hedge_wins = 0
+        self.skipped_budget = 0
+        self.skipped_no_target = 0
+        self._latencies = {} # key -> deque of recent call seconds
+        self._lock = threading.Lock()
+
+    def observe(self, key, seconds):
+        """Records the latency of a successful call."""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = collections.deque(maxlen=self.window)
+            latencies.append(seconds)
+
+    def delay(self, key):
+        """Seconds after which a call for `key` should be hedged, or None while too few latencies are known."""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            ordered = sorted(latencies)
+        rank = max(1, math.ceil(len(ordered) * self.percentile / 100)) # Nearest rank
+        return max(self.min_delay_seconds, ordered[rank - 1])
+
+    def record_request(self):
+        """Counts a request towards the budget base (call once per primary call)."""
+        with self._lock:
+            self.requests += 1
+
+    def try_spend(self) -> bool:
+        """Takes one hedge from the budget; False (and counted as skipped) if it is spent."""
+        with self._lock:
+            if self.hedges_sent + 1 > self.budget_fraction * self.requests + self.budget_burst:
+                self.skipped_budget += 1
+                return False
+            self.hedges_sent += 1
+            return True
+
+    def refund(self):
+        """Returns a hedge taken with try_spend() that could not be sent for lack of a target."""
+        with self._lock:
+            self.hedges_sent -= 1
+            self.skipped_no_target += 1
+
+    def record_winner(self, winner):
+        if winner == "hedge":
+            with self._lock:
+                self.hedge_wins += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"requests": self.requests, "hedges_sent": self.hedges_sent, "hedge_wins": self.hedge_wins,
+                    "skipped_budget": self.skipped_budget, "skipped_no_target": self.skipped_no_target,
+                    "hedge_rate": self.hedges_sent / self.requests if self.requests else 0.0}
+
+
+class _RacingCall:
+    """One call of a race, running on its own daemon thread."""
+
+    def __init__(self, name, fn, finished):
+        self.name = name
+        self.cancelled = threading.Event()
+        self.value = None
+        self.error = None
+        self._fn = fn
+        self._finished = finished
+        threading.Thread(target=self._run, name=f"hedge-{name}", daemon=True).start()
+
+    def _run(self):
+        try:
+            self.value = self._fn(self.cancelled)
+        except BaseException as e: # Reported to race(), never raised on this thread
+            self.error = e
+        finally:
+            self._finished.put(self)
+
+def race(primary, delay_seconds, start_hedge):
+    """
+    Runs `primary(cancelled)` and, if it has not finished after `delay_seconds`, a hedge alongside it.
+
+    `start_hedge()` is called at that point and returns the hedge, a function like `primary`, or None if
+    no hedge may be sent. The first call to succeed wins; the other call's `cancelled` event is set, which
+    it should check to abort (a call that cannot be interrupted finishes in the background and its result
+    is discarded). If a call fails, the other one is still awaited.
+
+    Returns:
+        tuple: (winner, value), where winner is None if no hedge was sent, else 'primary' or 'hedge'.
+
+    Raises:
+        The primary call's exception, if no call succeeded.
+    """
+    finished = queue.Queue()
+    primary_call = _RacingCall("primary", primary, finished)
+    try:
+        done = finished.get(timeout=delay_seconds)
+    except queue.Empty:
+        done = None
+    hedge = start_hedge() if done is None else None
+    if hedge is None:
+        done = done or finished.get()
+        if done.error is not None:
+            raise done.error
+        return None, done.value
+
+    calls = [primary_call, _RacingCall("hedge", hedge, finished)]
+    for _ in calls:
+        done = finished.get()
+        if done.error is None:
+            for call in calls:
+                if call is not done:
+                    call.cancelled.set()
+            return done.name, done.value
+    raise primary_call.error
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    print("Hedging Module - Test Run")
+    hedger = Hedger(percentile=95, budget_fraction=0.15, budget_burst=2, min_samples=10, min_delay_seconds=0.0)
+    random.seed(7)
+
+    def fake_call(cancelled, seconds):
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline: # Like a streamed call checking for cancellation between chunks
+            if cancelled.is_set():
+                raise HedgeCancelled()
+            time.sleep(0.002)
+        return seconds
+
+    started = time.monotonic()
+    winners = collections.Counter()
+    slowest = 0.0
+    for i in range(200):
+        seconds = 0.5 if i % 25 == 24 else random.uniform(0.01, 0.03) # Every 25th call is stuck
+        hedger.record_request()
+        delay = hedger.delay("demo")
+        call_started = time.monotonic()
+        if delay is None:
+            winner, value = None, fake_call(threading.Event(), seconds)
+        else:
+            start_hedge = lambda: (lambda cancelled: fake_call(cancelled, random.uniform(0.01, 0.03))) if hedger.try_spend() else None
+            winner, value = race(lambda cancelled: fake_call(cancelled, seconds), delay, start_hedge)
+        hedger.observe("demo", value)
+        hedger.record_winner(winner)
+        winners[winner] += 1
+        slowest = max(slowest, time.monotonic() - call_started)
+    print(f"200 calls in {time.monotonic() - started:.2f}s, slowest {slowest:.3f}s; winners {dict(winners)}")
+    print(f"Stats: {hedger.stats()}")
+    print("Hedging Module - Test Run Finished")
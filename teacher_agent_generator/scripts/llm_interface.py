@@ -1,6 +1,11 @@
 # teacher_agent_generator/scripts/llm_interface.py
+import atexit
+import contextlib
+import importlib
 import logging
 import os
+import threading
+import time
 
 # If this script is run directly, add its directory to sys.path
 # to allow direct import of 'config' from the same directory.
@@ -10,7 +15,15 @@ if __name__ == '__main__':
     if _CURRENT_SCRIPT_DIR not in sys.path:
         sys.path.insert(0, _CURRENT_SCRIPT_DIR)
 
+import backend_pool
 import config
+import hedging
+import metrics
+import rate_limiter
+import resilience
+import response_cache
+import scheduling
+import token_budget
 
 # Configure basic logging
 logging.basicConfig(level=config.LOG_LEVEL.upper() if hasattr(config, 'LOG_LEVEL') else logging.INFO,
@@ -18,148 +31,709 @@ logging.basicConfig(level=config.LOG_LEVEL.upper() if hasattr(config, 'LOG_LEVEL
                     filename=config.LOG_FILE if hasattr(config, 'LOG_FILE') else None,
                     filemode='a')
 
-# Attempt to import provider-specific libraries
-try:
-    import ollama
-    OLLAMA_AVAILABLE = True
-except ImportError:
-    OLLAMA_AVAILABLE = False
-    logging.info("Ollama library not found. Ollama provider will not be available.")
-
-try:
-    import dashscope
-    DASHSCOPE_AVAILABLE = True
-except ImportError:
-    DASHSCOPE_AVAILABLE = False
-    logging.info("Dashscope (for Qwen) library not found. Qwen provider will not be available.")
-
-try:
-    from openai import OpenAI
-    OPENAI_SDK_AVAILABLE = True # For DeepSeek or other OpenAI-compatible APIs
-except ImportError:
-    OPENAI_SDK_AVAILABLE = False
-    logging.info("OpenAI SDK not found. DeepSeek or other OpenAI-compatible providers will not be available.")
-
-
-def _generate_with_ollama(model_name, system_prompt, user_prompt, temperature, max_tokens):
-    if not OLLAMA_AVAILABLE:
-        logging.error("Ollama library is not installed. Cannot use Ollama provider.")
-        return None
-    try:
-        client = ollama.Client() # Assumes default host, or configure as needed
-        messages = [
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': user_prompt}
-        ]
-        # Ollama's generate API options are slightly different.
-        # Temperature is 'temperature', max_tokens is 'num_predict'.
-        # It doesn't directly support 'max_tokens' in the same way as OpenAI.
-        # 'num_predict' controls the max number of tokens to generate.
-        # 'options' parameter takes these.
-        options = {
-            "temperature": temperature,
-            "num_predict": max_tokens if max_tokens > 0 else -1 # -1 for unlimited/model default
-        }
-        response = client.chat(model=model_name, messages=messages, options=options)
-        return response['message']['content']
-    except Exception as e:
-        logging.error(f"Error generating response with Ollama (model: {model_name}): {e}")
-        return None
+# Provider SDKs are imported on first use rather than with this module: each one pulls in a large
+# dependency tree, and a run only ever talks to the provider it was started with.
+_PROVIDER_SDK_MODULES = {
+    'ollama': 'ollama',
+    'qwen': 'dashscope',
+    'deepseek': 'openai', # For DeepSeek or other OpenAI-compatible APIs
+}
+_SDK_MODULES = {}
+_SDK_IMPORT_LOCK = threading.Lock()
 
-def _generate_with_qwen(api_key, model_name, system_prompt, user_prompt, temperature, max_tokens):
-    if not DASHSCOPE_AVAILABLE:
-        logging.error("Dashscope library is not installed. Cannot use Qwen provider.")
+def _import_sdk(module_name):
+    """Imports an optional SDK module once and returns it, or None if it is not installed."""
+    with _SDK_IMPORT_LOCK:
+        if module_name not in _SDK_MODULES:
+            try:
+                _SDK_MODULES[module_name] = importlib.import_module(module_name)
+            except ImportError:
+                _SDK_MODULES[module_name] = None
+                logging.info(f"{module_name} library not found. Providers using it will not be available.")
+        return _SDK_MODULES[module_name]
+
+def provider_sdk_available(provider) -> bool:
+    """True if the SDK for `provider` ('ollama', 'qwen' or 'deepseek') can be imported. Imports it if so."""
+    module_name = _PROVIDER_SDK_MODULES.get(provider)
+    return module_name is not None and _import_sdk(module_name) is not None
+
+
+# Provider clients are expensive to build (HTTP transport, connection pool, TLS handshake on
+# first use), so one long-lived client is kept per (provider, base_url, api_key, lane) and shared
+# across calls and threads. The underlying httpx clients are thread-safe and keep connections alive.
+# Lanes (see scheduling.PromptGroupScheduler) give each group of same-prompt requests its own
+# connection pool; callers that do not schedule by prompt all share lane None, and hedges of
+# single-provider calls use lane 'hedge' so they do not queue behind the connection of the call they back up.
+_CLIENT_REGISTRY = {}
+_CLIENT_REGISTRY_LOCK = threading.Lock()
+
+def _http_pool_limits():
+    """Returns httpx connection-pool limits sized from config.LLM_CONNECTION_POOL_SIZE, or None without httpx."""
+    httpx = _import_sdk('httpx') # Transport used by both the ollama and openai SDKs
+    if httpx is None:
         return None
-    if not api_key:
-        logging.error("Qwen API key not provided. Cannot use Qwen provider.")
+    pool_size = max(1, getattr(config, 'LLM_CONNECTION_POOL_SIZE', 16))
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+
+def _create_client(provider, base_url, api_key):
+    """Builds a new client for the given provider. Only called once per registry key."""
+    limits = _http_pool_limits()
+    if provider == 'ollama':
+        # ollama.Client forwards extra keyword arguments to its underlying httpx.Client.
+        ollama = _import_sdk('ollama')
+        if limits is not None:
+            return ollama.Client(host=base_url, limits=limits)
+        return ollama.Client(host=base_url)
+    elif provider == 'deepseek':
+        # The SDK's own retries are disabled; generate_response_detailed() retries with backoff instead.
+        openai = _import_sdk('openai')
+        if limits is not None:
+            return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=_import_sdk('httpx').Client(limits=limits))
+        return openai.OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+    raise ValueError(f"No pooled client available for provider: {provider}")
+
+def get_client(provider, base_url=None, api_key=None, lane=None):
+    """
+    Returns the shared client for (provider, base_url, api_key, lane), creating it on first use.
+
+    Args:
+        provider (str): The LLM provider ('ollama' or 'deepseek').
+        base_url (str, optional): Provider endpoint. None uses the SDK default.
+        api_key (str, optional): API key for providers that require one.
+        lane (int or str, optional): Scheduler lane (or 'hedge'); each lane gets its own client and connection pool.
+
+    Returns:
+        The provider SDK client instance.
+    """
+    registry_key = (provider, base_url, api_key, lane)
+    client = _CLIENT_REGISTRY.get(registry_key)
+    if client is None:
+        with _CLIENT_REGISTRY_LOCK:
+            client = _CLIENT_REGISTRY.get(registry_key) # Re-check: another thread may have created it
+            if client is None:
+                client = _create_client(provider, base_url, api_key)
+                _CLIENT_REGISTRY[registry_key] = client
+                lane_note = f" (lane {lane})" if lane is not None else ""
+                logging.info(f"Created pooled {provider} client for base_url={base_url or 'default'}{lane_note}.")
+    return client
+
+def close_clients():
+    """Closes all pooled provider clients and their HTTP connections. Safe to call more than once."""
+    with _CLIENT_REGISTRY_LOCK:
+        clients = list(_CLIENT_REGISTRY.items())
+        _CLIENT_REGISTRY.clear()
+    for (provider, base_url, _, _), client in clients:
+        try:
+            close = getattr(client, 'close', None)
+            if close is None:
+                # ollama.Client has no close() of its own; close its httpx transport directly.
+                close = getattr(getattr(client, '_client', None), 'close', None)
+            if close is not None:
+                close()
+        except Exception as e:
+            logging.warning(f"Error closing {provider} client (base_url={base_url or 'default'}): {e}")
+
+atexit.register(close_clients)
+
+
+# --- Provider Implementations ---
+# Each _generate_with_* function returns (generated text, usage dict), or raises on failure so that
+# generate_response_detailed() can classify the error and decide whether to retry.
+# When `on_chunk` is given, the response is streamed and on_chunk(text) is called for every
+# non-empty piece of text as it arrives; the full text is still returned at the end.
+
+def _field(obj, name):
+    """Reads `name` from an SDK response object or dict, returning None if absent."""
+    if obj is None:
         return None
+    if isinstance(obj, dict):
+        return obj.get(name)
     try:
-        dashscope.api_key = api_key
-        messages = [
-            {'role': 'system', 'content': system_prompt},
-            {'role': 'user', 'content': user_prompt}
-        ]
-        # Dashscope's call parameters might differ slightly.
-        # Assuming 'temperature' and 'max_tokens' are supported or have equivalents.
-        # For Qwen models, temperature (0-2, 0 for deterministic), max_tokens.
-        # Dashscope uses result_format='message' for chat-like interactions.
-        response = dashscope.Generation.call(
-            model=model_name,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens if max_tokens > 0 else None, # None might use model default
-            result_format='message'
-        )
-        if response.status_code == 200:
-            return response.output.choices[0].message.content
-        else:
-            logging.error(f"Error from Qwen API (model: {model_name}): {response.code} - {response.message}")
-            return None
-    except Exception as e:
-        logging.error(f"Error generating response with Qwen (model: {model_name}): {e}")
+        return getattr(obj, name, None)
+    except KeyError: # Dashscope response objects raise KeyError for missing attributes
         return None
 
-def _generate_with_deepseek(api_key, model_name, system_prompt, user_prompt, temperature, max_tokens):
-    if not OPENAI_SDK_AVAILABLE:
-        logging.error("OpenAI SDK is not installed. Cannot use DeepSeek provider.")
-        return None
+def _make_usage(prompt_tokens=None, completion_tokens=None, cached_prompt_tokens=None):
+    """Token usage as reported by the provider. Any count the provider does not report is None."""
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "cached_prompt_tokens": cached_prompt_tokens}
+
+def openai_style_usage(usage):
+    """
+    Usage from an OpenAI-compatible response body. Cached prefix tokens are reported as
+    prompt_cache_hit_tokens by DeepSeek and as prompt_tokens_details.cached_tokens by OpenAI and Qwen.
+    """
+    if usage is None:
+        return _make_usage()
+    cached = _field(usage, 'prompt_cache_hit_tokens')
+    if cached is None:
+        cached = _field(_field(usage, 'prompt_tokens_details'), 'cached_tokens')
+    prompt_tokens = _field(usage, 'prompt_tokens')
+    completion_tokens = _field(usage, 'completion_tokens')
+    return _make_usage(prompt_tokens if prompt_tokens is not None else _field(usage, 'input_tokens'),
+                       completion_tokens if completion_tokens is not None else _field(usage, 'output_tokens'),
+                       cached)
+
+def _generate_with_ollama(model_name, system_prompt, user_prompt, temperature, max_tokens, lane=None, on_chunk=None, base_url=None):
+    if not provider_sdk_available('ollama'):
+        raise resilience.FatalProviderError("Ollama library is not installed. Cannot use Ollama provider.")
+    client = get_client('ollama', base_url=base_url or config.OLLAMA_HOST, lane=lane)
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    # Ollama's generate API options are slightly different.
+    # Temperature is 'temperature', max_tokens is 'num_predict'.
+    # It doesn't directly support 'max_tokens' in the same way as OpenAI.
+    # 'num_predict' controls the max number of tokens to generate.
+    # 'options' parameter takes these.
+    options = {
+        "temperature": temperature,
+        "num_predict": max_tokens if max_tokens > 0 else -1 # -1 for unlimited/model default
+    }
+    if on_chunk is not None:
+        parts = []
+        response = None
+        for chunk in client.chat(model=model_name, messages=messages, options=options, stream=True):
+            piece = chunk['message']['content']
+            if piece:
+                parts.append(piece)
+                on_chunk(piece)
+            response = chunk # The final chunk (done=True) carries the token counts
+        return "".join(parts), _make_usage(_field(response, 'prompt_eval_count'), _field(response, 'eval_count'))
+    response = client.chat(model=model_name, messages=messages, options=options)
+    # Ollama reports only the prompt tokens it had to evaluate, so a reused prefix shows up as a
+    # smaller prompt_eval_count rather than as a separate cached count.
+    return response['message']['content'], _make_usage(_field(response, 'prompt_eval_count'), _field(response, 'eval_count'))
+
+def _generate_with_qwen(api_key, model_name, system_prompt, user_prompt, temperature, max_tokens, lane=None, on_chunk=None):
+    if not provider_sdk_available('qwen'):
+        raise resilience.FatalProviderError("Dashscope library is not installed. Cannot use Qwen provider.")
     if not api_key:
-        logging.error("DeepSeek API key not provided. Cannot use DeepSeek provider.")
-        return None
-    try:
-        client = OpenAI(api_key=api_key, base_url="https://api.deepseek.com/v1")
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-        response = client.chat.completions.create(
+        raise resilience.FatalProviderError("Qwen API key not provided. Cannot use Qwen provider.")
+    # The key is passed per call instead of set on the module-global dashscope.api_key,
+    # which would race between threads using different keys. Dashscope manages its own
+    # connections, so `lane` has no effect here.
+    messages = [
+        {'role': 'system', 'content': system_prompt},
+        {'role': 'user', 'content': user_prompt}
+    ]
+    # Dashscope's call parameters might differ slightly.
+    # Assuming 'temperature' and 'max_tokens' are supported or have equivalents.
+    # For Qwen models, temperature (0-2, 0 for deterministic), max_tokens.
+    # Dashscope uses result_format='message' for chat-like interactions.
+    call_kwargs = dict(
+        model=model_name,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens if max_tokens > 0 else None, # None might use model default
+        result_format='message',
+        api_key=api_key
+    )
+    if on_chunk is not None:
+        # incremental_output makes each streamed response carry only the new text.
+        parts = []
+        usage = None
+        dashscope = _import_sdk('dashscope')
+        for response in dashscope.Generation.call(stream=True, incremental_output=True, **call_kwargs):
+            if response.status_code != 200:
+                raise _qwen_error(response, model_name)
+            piece = response.output.choices[0].message.content
+            if piece:
+                parts.append(piece)
+                on_chunk(piece)
+            usage = _field(response, 'usage') or usage
+        return "".join(parts), openai_style_usage(usage)
+    response = _import_sdk('dashscope').Generation.call(**call_kwargs)
+    if response.status_code == 200:
+        return response.output.choices[0].message.content, openai_style_usage(_field(response, 'usage'))
+    raise _qwen_error(response, model_name)
+
+def _qwen_error(response, model_name):
+    # Dashscope reports errors in the response object rather than raising.
+    return resilience.ProviderError(f"Error from Qwen API (model: {model_name}): {response.code} - {response.message}",
+                                    status_code=response.status_code, code=response.code)
+
+def _generate_with_deepseek(api_key, model_name, system_prompt, user_prompt, temperature, max_tokens, lane=None, on_chunk=None,
+                            base_url=None):
+    if not provider_sdk_available('deepseek'):
+        raise resilience.FatalProviderError("OpenAI SDK is not installed. Cannot use DeepSeek provider.")
+    if not api_key:
+        raise resilience.FatalProviderError("DeepSeek API key not provided. Cannot use DeepSeek provider.")
+    client = get_client('deepseek', base_url=base_url or config.DEEPSEEK_BASE_URL, api_key=api_key, lane=lane)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    if on_chunk is not None:
+        parts = []
+        usage = None
+        stream = client.chat.completions.create(
             model=model_name,
             messages=messages,
             temperature=temperature,
-            max_tokens=max_tokens if max_tokens > 0 else None # None might use model default
+            max_tokens=max_tokens if max_tokens > 0 else None,
+            stream=True,
+            stream_options={"include_usage": True} # Usage arrives in a final chunk with no choices
         )
-        return response.choices[0].message.content
+        for chunk in stream:
+            if chunk.choices:
+                piece = chunk.choices[0].delta.content
+                if piece:
+                    parts.append(piece)
+                    on_chunk(piece)
+            usage = getattr(chunk, 'usage', None) or usage
+        return "".join(parts), openai_style_usage(usage)
+    response = client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tokens if max_tokens > 0 else None # None might use model default
+    )
+    return response.choices[0].message.content, openai_style_usage(response.usage)
+
+def _dispatch_to_provider(provider, model_name, system_prompt, user_prompt, temperature, max_tokens, lane=None, on_chunk=None,
+                         base_url=None, api_key=None):
+    """
+    Routes a generation request to the matching provider implementation. Returns (text, usage).
+    `base_url` and `api_key` override the provider's configured endpoint and key (set for backend pool members).
+    """
+    if provider == 'ollama':
+        return _generate_with_ollama(model_name, system_prompt, user_prompt, temperature, max_tokens, lane=lane, on_chunk=on_chunk,
+                                     base_url=base_url)
+    elif provider == 'qwen':
+        # Assuming Qwen uses ANTHROPIC_API_KEY for this example as no specific QWEN_API_KEY is in config
+        # This should be config.QWEN_API_KEY or similar in a real setup
+        return _generate_with_qwen(api_key or config.ANTHROPIC_API_KEY, model_name, system_prompt, user_prompt, temperature, max_tokens, lane=lane, on_chunk=on_chunk)
+    elif provider == 'deepseek':
+        return _generate_with_deepseek(api_key or config.OPENAI_API_KEY, model_name, system_prompt, user_prompt, temperature, max_tokens, lane=lane, on_chunk=on_chunk,
+                                       base_url=base_url)
+    # Add elif for 'openai' if a generic OpenAI provider is needed (using config.OPENAI_API_KEY)
+    # For now, 'openai' provider route is missing, but DeepSeek uses the OpenAI SDK.
+    # Let's assume default_model = "deepseek:deepseek-chat" or "qwen:qwen-turbo" or "ollama:llama2"
+    else:
+        raise resilience.FatalProviderError(f"Unsupported LLM provider: {provider}")
+
+# --- Response Cache ---
+# Disabled unless a driver calls configure_response_cache() (see the --cache option).
+_RESPONSE_CACHE = None
+
+def configure_response_cache(mode, path=None, max_bytes=None):
+    """
+    Enables (or disables, with mode 'off') the disk-backed response cache used by generate_response().
+
+    Args:
+        mode (str): 'off', 'read' or 'readwrite'.
+        path (str, optional): SQLite cache file. Defaults to config.RESPONSE_CACHE_PATH.
+        max_bytes (int, optional): Size limit for cached response text. Defaults to config.RESPONSE_CACHE_MAX_BYTES.
+
+    Returns:
+        ResponseCache: The active cache, or None when disabled.
+    """
+    global _RESPONSE_CACHE
+    if _RESPONSE_CACHE is not None:
+        _RESPONSE_CACHE.close()
+    _RESPONSE_CACHE = None if mode == "off" else response_cache.ResponseCache(path, mode=mode, max_bytes=max_bytes)
+    return _RESPONSE_CACHE
+
+def get_cache_stats():
+    """Returns the active response cache's per-run counters, or None if caching is off."""
+    return _RESPONSE_CACHE.stats() if _RESPONSE_CACHE is not None else None
+
+# --- Request Scheduling ---
+# 'fifo' unless a driver calls configure_scheduling() (see the --schedule option).
+_PROMPT_SCHEDULER = None
+
+def configure_scheduling(policy, lane_count=None):
+    """
+    Selects the request scheduling policy used by generate_response().
+
+    Args:
+        policy (str): One of scheduling.SCHEDULING_POLICIES. 'longest_first' only changes the order in which
+                      the drivers issue jobs; requests are then sent as under 'fifo'.
+        lane_count (int, optional): Client lanes for 'prompt_group'. Defaults to config.PROMPT_SCHEDULER_LANES.
+
+    Returns:
+        PromptGroupScheduler: The active scheduler, or None for 'fifo'.
+    """
+    global _PROMPT_SCHEDULER
+    if policy not in scheduling.SCHEDULING_POLICIES:
+        raise ValueError(f"Invalid scheduling policy '{policy}'. Expected one of: {', '.join(scheduling.SCHEDULING_POLICIES)}")
+    _PROMPT_SCHEDULER = scheduling.PromptGroupScheduler(lane_count) if policy == "prompt_group" else None
+    return _PROMPT_SCHEDULER
+
+def get_scheduling_stats():
+    """Returns the prompt-group scheduler's counters, or None under 'fifo'."""
+    return _PROMPT_SCHEDULER.stats() if _PROMPT_SCHEDULER is not None else None
+
+# --- Backend Pool ---
+# Requests for provider 'pool' are routed over the backends of the pool set by configure_backend_pool() (see --backend_pool).
+_BACKEND_POOL = None
+
+def configure_backend_pool(path, routing=None):
+    """
+    Loads the backend pool used for provider 'pool' (backend_pool.POOL_PROVIDER), or disables it with path None.
+
+    Args:
+        path (str): Backend pool JSON file (see backend_pool.load_backend_pool).
+        routing (str, optional): One of backend_pool.ROUTING_POLICIES; overrides the file's "routing".
+
+    Returns:
+        BackendPool: The active pool, or None.
+
+    Raises:
+        ValueError, OSError: The file cannot be read or is not a valid pool definition.
+    """
+    global _BACKEND_POOL
+    _BACKEND_POOL = backend_pool.load_backend_pool(path, routing) if path else None
+    return _BACKEND_POOL
+
+def get_backend_pool_stats():
+    """Returns the backend pool's routing and per-backend counters, or None without a pool."""
+    return _BACKEND_POOL.stats() if _BACKEND_POOL is not None else None
+
+# --- Hedged Requests ---
+# Off unless a driver calls configure_hedging() (see the --hedge option).
+_HEDGER = None
+
+def configure_hedging(enabled, percentile=None, budget_fraction=None):
+    """
+    Turns hedged requests on or off for generate_response_detailed().
+
+    Args:
+        enabled (bool): Hedge calls that run longer than recent calls of their kind.
+        percentile (float, optional): Latency percentile after which to hedge. Defaults to config.HEDGE_PERCENTILE.
+        budget_fraction (float, optional): Share of requests that may be hedged. Defaults to config.HEDGE_BUDGET_FRACTION.
+
+    Returns:
+        Hedger: The active hedger, or None.
+    """
+    global _HEDGER
+    _HEDGER = hedging.Hedger(percentile, budget_fraction) if enabled else None
+    return _HEDGER
+
+def get_hedging_stats():
+    """Returns the hedger's counters, or None with hedging off."""
+    return _HEDGER.stats() if _HEDGER is not None else None
+
+def generate_response_detailed(system_prompt, user_prompt,
+                               provider=config.DEFAULT_MODEL.split(':')[0] if ':' in config.DEFAULT_MODEL else 'openai',
+                               model_name=config.DEFAULT_MODEL.split(':')[-1] if ':' in config.DEFAULT_MODEL else config.DEFAULT_MODEL,
+                               temperature=config.DEFAULT_TEMPERATURE,
+                               max_tokens=config.MAX_TOKENS,
+                               stream=None,
+                               on_partial=None,
+                               latency_class=None,
+                               cache_max_tokens=None):
+    """
+    Generates a response like generate_response(), and also reports how it was obtained.
+
+    Transient failures (timeouts, connection errors, throttling, 5xx) are retried up to
+    config.LLM_MAX_RETRIES times with exponential backoff and full jitter. Fatal errors
+    (authentication, invalid requests, missing SDK or key) are not retried. Each provider has a
+    circuit breaker: after repeated transient failures, calls fail fast until the endpoint recovers.
+    Under the 'prompt_group' scheduling policy, the request waits for its system prompt's
+    warm-up request and is sent on that prompt's lane (see configure_scheduling).
+    For provider 'pool', `model_name` is a model alias, and each attempt goes to one of the backends
+    serving it (see configure_backend_pool); a retry may therefore reach a different host.
+
+    With `stream` (default: config.LLM_STREAMING) the response is streamed, which makes the
+    time to first token measurable. `on_partial`, if given, is called with each piece of text as
+    it arrives and implies streaming. If an attempt fails midway and is retried, the pieces it
+    already delivered are followed by those of the next attempt.
+
+    With hedging on (see configure_hedging), an attempt still running after the recent latency
+    percentile of its (provider, model, `latency_class`) - e.g. the task type - is duplicated on
+    another backend of the pool, or on a separate connection to the same provider; the first call to
+    finish wins and the other is aborted. Hedged calls are streamed so that the loser can be aborted
+    mid-response. Requests with `on_partial` are never hedged.
+
+    The response cache key uses `cache_max_tokens` in place of `max_tokens` if given. Callers that
+    size max_tokens per request (see token_budget.TokenBudget) pass the run's cap, so the key does
+    not depend on what the run has observed so far and reruns hit the same entries.
+
+    Returns:
+        dict: {
+            "content": str or None - the generated text,
+            "error": str or None - the last error message if no content was produced,
+            "attempts": int - provider calls made (0 for a cache hit or an open circuit),
+            "cache_hit": bool - True if the response was served from the response cache,
+            "usage": dict or None - provider-reported prompt_tokens, completion_tokens and
+                     cached_prompt_tokens (prefix tokens served from the provider's prompt cache),
+                     each None if not reported; None for cache hits and failures,
+            "timings": dict or None - for the successful provider call (see _call_timings):
+                     call_seconds, time_to_first_token_seconds (streaming only),
+                     output_tokens and tokens_per_second; None for cache hits and failures,
+            "backend": str or None - for provider 'pool', the backend of the last attempt
+                       (of the winning call, if hedged),
+            "hedge": str or None - 'primary' or 'hedge', whichever call won if the request was hedged,
+        }
+    """
+    result = {"content": None, "error": None, "attempts": 0, "cache_hit": False, "usage": None, "timings": None, "backend": None,
+              "hedge": None}
+    if stream is None:
+        stream = config.LLM_STREAMING
+    stream = stream or on_partial is not None
+
+    cache = _RESPONSE_CACHE
+    key = None
+    if cache is not None:
+        key = response_cache.cache_key(provider, model_name, system_prompt, user_prompt, temperature,
+                                       cache_max_tokens if cache_max_tokens is not None else max_tokens)
+        cached_response = cache.get(key)
+        if cached_response is not None:
+            logging.info(f"Response cache hit for provider: {provider}, model: {model_name}")
+            result["content"] = cached_response
+            result["cache_hit"] = True
+            metrics.LLM_REQUESTS.inc(provider=provider, model=model_name, outcome="cache_hit")
+            return result
+
+    request_started = time.monotonic()
+    scheduler = _PROMPT_SCHEDULER
+    with scheduler.slot(system_prompt) if scheduler is not None else contextlib.nullcontext() as lane:
+        _call_provider_with_retries(result, provider, model_name, system_prompt, user_prompt, temperature, max_tokens, lane,
+                                    stream, on_partial, latency_class)
+    _record_request_metrics(provider, model_name, result, time.monotonic() - request_started)
+
+    if cache is not None and result["content"] is not None:
+        cache.put(key, result["content"])
+    return result
+
+def _record_request_metrics(provider, model_name, result, request_seconds):
+    """Adds one finished (non-cached) request to the metrics registry."""
+    labels = {"provider": provider, "model": model_name}
+    metrics.LLM_REQUESTS.inc(outcome="success" if result["content"] is not None else "error", **labels)
+    metrics.LLM_REQUEST_SECONDS.observe(request_seconds, **labels)
+    metrics.record_usage(provider, model_name, result["usage"])
+    timings = result["timings"]
+    if timings:
+        metrics.LLM_CALL_SECONDS.observe(timings["call_seconds"], **labels)
+        if timings["time_to_first_token_seconds"] is not None:
+            metrics.LLM_TTFT_SECONDS.observe(timings["time_to_first_token_seconds"], **labels)
+
+def _call_timings(started, first_token_at, finished, content, usage):
+    """
+    Latency breakdown of one provider call, excluding time spent queueing for a rate-limit slot.
+
+    time_to_first_token_seconds covers the request and prompt prefill; the rest of the call is
+    decode, so tokens_per_second is measured over that remainder when the call was streamed,
+    and over the whole call otherwise. output_tokens comes from the provider's usage if
+    reported, else from token_budget.count_tokens().
+    """
+    output_tokens = (usage or {}).get("completion_tokens")
+    if output_tokens is None:
+        output_tokens = token_budget.count_tokens(content)
+    call_seconds = finished - started
+    time_to_first_token = first_token_at - started if first_token_at is not None else None
+    decode_seconds = call_seconds - time_to_first_token if time_to_first_token is not None else call_seconds
+    return {
+        "call_seconds": round(call_seconds, 4),
+        "time_to_first_token_seconds": round(time_to_first_token, 4) if time_to_first_token is not None else None,
+        "output_tokens": output_tokens,
+        "tokens_per_second": round(output_tokens / decode_seconds, 2) if decode_seconds > 0 and output_tokens else None,
+    }
+
+def _call_provider_with_retries(result, provider, model_name, system_prompt, user_prompt, temperature, max_tokens, lane,
+                                stream=False, on_partial=None, latency_class=None):
+    """
+    Calls the provider with rate limiting, circuit breaking and retries, filling in `result` in place.
+    For provider 'pool', every attempt acquires a backend from the pool and uses that backend's circuit
+    breaker and its provider's rate limiter. With hedging on, a slow attempt is raced against a hedge.
+    """
+    pool = _BACKEND_POOL if provider == backend_pool.POOL_PROVIDER else None
+    breaker = resilience.get_circuit_breaker(provider)
+    request = (system_prompt, user_prompt, temperature, max_tokens)
+    max_attempts = 1 + max(0, config.LLM_MAX_RETRIES)
+    hedger = _HEDGER if on_partial is None else None # Pieces already passed to on_partial cannot be taken back
+    hedge_key = (provider, model_name, latency_class)
+
+    for attempt in range(1, max_attempts + 1):
+        backend = None
+        try:
+            if pool is not None:
+                backend = pool.acquire(model_name) # Waits for a free slot on a healthy backend
+                breaker = backend.breaker
+            else:
+                breaker.before_call()
+        except resilience.ProviderError as e: # CircuitOpenError, or FatalProviderError for a model no backend serves
+            logging.error(f"{e} (provider: {provider}, model: {model_name})")
+            metrics.LLM_ERRORS.inc(provider=provider, model=model_name,
+                                   kind="circuit_open" if isinstance(e, resilience.CircuitOpenError) else "fatal")
+            result["error"] = str(e)
+            return
+
+        result["attempts"] = attempt
+        metrics.LLM_PROVIDER_CALLS.inc(provider=provider, model=model_name)
+        if attempt > 1:
+            metrics.LLM_RETRIES.inc(provider=provider, model=model_name)
+        backend_note = ""
+        if backend is not None:
+            result["backend"] = backend.name
+            backend_note = f", backend: {backend.name}"
+        logging.info(f"Requesting generation from provider: {provider}, model: {model_name}{backend_note} (attempt {attempt}/{max_attempts})")
+
+        def call(cancelled, backend=backend, breaker=breaker, lane=lane):
+            return _provider_call(provider, model_name, request, pool, backend, breaker, lane, stream or hedger is not None,
+                                  on_partial, cancelled, hedger, hedge_key)
+
+        try:
+            delay = None
+            if hedger is not None:
+                hedger.record_request()
+                delay = hedger.delay(hedge_key)
+            if delay is None:
+                winner, call_result = None, call(None)
+            else:
+                winner, call_result = hedging.race(call, delay, lambda: _start_hedge(hedger, pool, provider, model_name, backend, call))
+        except Exception as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+            retryable = resilience.is_retryable_error(e)
+            if not retryable or attempt == max_attempts:
+                logging.error(f"Error generating response with {provider} (model: {model_name}) after {attempt} attempt(s)"
+                              f"{'' if retryable else ' (not retryable)'}: {e}")
+                return
+            delay = resilience.backoff_delay(attempt)
+            logging.warning(f"Transient error from {provider} (model: {model_name}) on attempt {attempt}/{max_attempts}: {e}. "
+                            f"Retrying in {delay:.2f}s.")
+            time.sleep(delay)
+            continue
+
+        result["content"] = call_result["content"]
+        result["usage"] = call_result["usage"]
+        result["timings"] = call_result["timings"]
+        result["error"] = None
+        if call_result["backend"] is not None:
+            result["backend"] = call_result["backend"]
+        if winner is not None:
+            result["hedge"] = winner
+            hedger.record_winner(winner)
+            metrics.LLM_HEDGES.inc(provider=provider, model=model_name, winner=winner)
+        return
+
+def _provider_call(provider, model_name, request, pool, backend, breaker, lane, stream, on_partial=None, cancelled=None,
+                   hedger=None, hedge_key=None):
+    """
+    One provider call - an attempt, or a hedge racing it - that `breaker` (and `pool`, for `backend`) already
+    admitted. Takes a rate-limit slot, dispatches, and records the outcome on the breaker, the limiter, the
+    backend's pool slot, the error metrics and the hedger's latencies. Once `cancelled` is set, a streamed
+    call aborts at its next chunk with hedging.HedgeCancelled.
+
+    Returns:
+        dict: {"content", "usage", "timings" (see _call_timings), "backend": name or None}.
+    """
+    system_prompt, user_prompt, temperature, max_tokens = request
+    limiter = rate_limiter.get_provider_limiter(backend.provider if backend is not None else provider)
+    estimated_tokens = token_budget.count_tokens(system_prompt) + token_budget.count_tokens(user_prompt) + max(max_tokens, 0)
+    first_token_at = None
+
+    def on_chunk(piece):
+        nonlocal first_token_at
+        if cancelled is not None and cancelled.is_set():
+            raise hedging.HedgeCancelled("The other call of the hedged request finished first.")
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+        if on_partial is not None:
+            on_partial(piece)
+
+    called = time.monotonic()
+    try:
+        with limiter.slot(estimated_tokens):
+            metrics.LLM_IN_FLIGHT.inc(provider=provider)
+            try:
+                started = time.monotonic()
+                if backend is not None:
+                    response, usage = _dispatch_to_provider(backend.provider, backend.model, system_prompt, user_prompt, temperature,
+                                                            max_tokens, lane=lane, on_chunk=on_chunk if stream else None,
+                                                            base_url=backend.base_url, api_key=backend.api_key)
+                else:
+                    response, usage = _dispatch_to_provider(provider, model_name, system_prompt, user_prompt, temperature, max_tokens,
+                                                            lane=lane, on_chunk=on_chunk if stream else None)
+                finished = time.monotonic()
+            finally:
+                metrics.LLM_IN_FLIGHT.dec(provider=provider)
+    except hedging.HedgeCancelled:
+        breaker.record_success() # The endpoint was streaming a response, so it is up
+        if backend is not None:
+            pool.release(backend, failed=False)
+            metrics.LLM_BACKEND_CALLS.inc(backend=backend.name, outcome="cancelled")
+        raise
     except Exception as e:
-        logging.error(f"Error generating response with DeepSeek (model: {model_name}): {e}")
+        breaker.record_failure(e)
+        if backend is not None:
+            pool.release(backend)
+            metrics.LLM_BACKEND_CALLS.inc(backend=backend.name, outcome="error")
+        throttled = rate_limiter.is_throttling_error(e)
+        metrics.LLM_ERRORS.inc(provider=provider, model=model_name,
+                               kind="throttled" if throttled else ("retryable" if resilience.is_retryable_error(e) else "fatal"))
+        if throttled:
+            limiter.on_throttle()
+        raise
+
+    breaker.record_success()
+    limiter.on_success()
+    timings = _call_timings(started, first_token_at, finished, response, usage)
+    if backend is not None:
+        pool.release(backend, timings["call_seconds"], timings["output_tokens"])
+        metrics.LLM_BACKEND_CALLS.inc(backend=backend.name, outcome="success")
+    if hedger is not None:
+        hedger.observe(hedge_key, finished - called) # Includes the rate-limit wait, as the hedge delay does
+    return {"content": response, "usage": usage, "timings": timings, "backend": backend.name if backend is not None else None}
+
+def _start_hedge(hedger, pool, provider, model_name, primary_backend, call):
+    """
+    Reserves a target for the hedge of a slow call and returns the hedge for hedging.race(), or None if the
+    budget is spent or there is no target. In a backend pool the hedge goes to another backend with a free
+    slot; otherwise it goes to the same provider on a connection of its own (client lane 'hedge').
+    """
+    if not hedger.try_spend():
         return None
+    if pool is not None:
+        backend = pool.try_acquire(model_name, exclude=primary_backend)
+        if backend is None:
+            hedger.refund()
+            return None
+        breaker, lane = backend.breaker, None
+    else:
+        backend, breaker, lane = None, resilience.get_circuit_breaker(provider), "hedge"
+        try:
+            breaker.before_call()
+        except resilience.CircuitOpenError:
+            hedger.refund()
+            return None
+    metrics.LLM_PROVIDER_CALLS.inc(provider=provider, model=model_name)
+    backend_note = f", backend: {backend.name}" if backend is not None else ""
+    logging.info(f"Hedging slow request to provider: {provider}, model: {model_name}{backend_note}")
+    return lambda cancelled: call(cancelled, backend, breaker, lane)
 
 def generate_response(system_prompt, user_prompt,
                       provider=config.DEFAULT_MODEL.split(':')[0] if ':' in config.DEFAULT_MODEL else 'openai',
                       model_name=config.DEFAULT_MODEL.split(':')[-1] if ':' in config.DEFAULT_MODEL else config.DEFAULT_MODEL,
                       temperature=config.DEFAULT_TEMPERATURE,
-                      max_tokens=config.MAX_TOKENS):
+                      max_tokens=config.MAX_TOKENS,
+                      on_partial=None):
     """
     Generates a response from a specified LLM provider.
 
     Args:
         system_prompt (str): The system prompt.
         user_prompt (str): The user prompt.
-        provider (str): The LLM provider ('ollama', 'qwen', 'deepseek', 'openai').
+        provider (str): The LLM provider ('ollama', 'qwen', 'deepseek', 'openai'), or 'pool' for the backend pool.
                         Defaults based on config.DEFAULT_MODEL or 'openai'.
         model_name (str): The specific model name for the provider.
                           Defaults based on config.DEFAULT_MODEL.
         temperature (float): The generation temperature. Defaults to config.DEFAULT_TEMPERATURE.
         max_tokens (int): The maximum number of tokens to generate. Defaults to config.MAX_TOKENS.
+        on_partial (callable, optional): Called with each piece of text as it is streamed.
+                                         Implies streaming.
 
     Returns:
         str: The generated text response, or None if an error occurred.
+             When the response cache is enabled (configure_response_cache), identical requests
+             are served from disk instead of calling the provider. Transient errors are retried;
+             see generate_response_detailed() for the attempt count and error details.
     """
-    logging.info(f"Requesting generation from provider: {provider}, model: {model_name}")
-
-    if provider == 'ollama':
-        return _generate_with_ollama(model_name, system_prompt, user_prompt, temperature, max_tokens)
-    elif provider == 'qwen':
-        # Assuming Qwen uses ANTHROPIC_API_KEY for this example as no specific QWEN_API_KEY is in config
-        # This should be config.QWEN_API_KEY or similar in a real setup
-        return _generate_with_qwen(config.ANTHROPIC_API_KEY, model_name, system_prompt, user_prompt, temperature, max_tokens)
-    elif provider == 'deepseek':
-        return _generate_with_deepseek(config.OPENAI_API_KEY, model_name, system_prompt, user_prompt, temperature, max_tokens)
-    # Add elif for 'openai' if a generic OpenAI provider is needed (using config.OPENAI_API_KEY)
-    # For now, 'openai' provider route is missing, but DeepSeek uses the OpenAI SDK.
-    # Let's assume default_model = "deepseek:deepseek-chat" or "qwen:qwen-turbo" or "ollama:llama2"
-    else:
-        logging.error(f"Unsupported LLM provider: {provider}")
-        return None
+    return generate_response_detailed(system_prompt, user_prompt, provider=provider, model_name=model_name,
+                                      temperature=temperature, max_tokens=max_tokens, on_partial=on_partial)["content"]
 
 if __name__ == '__main__':
     print("LLM Interface Module - Test Run")
@@ -170,10 +744,10 @@ if __name__ == '__main__':
 
     # --- Ollama Test ---
     print("\n--- Testing Ollama ---")
-    if OLLAMA_AVAILABLE:
+    if provider_sdk_available('ollama'):
         # List available Ollama models (optional, requires ollama running)
         try:
-            ollama_client = ollama.Client()
+            ollama_client = get_client('ollama', base_url=config.OLLAMA_HOST)
             models = ollama_client.list()
             if models and models.get('models'):
                  print(f"Available Ollama models: {[m['name'] for m in models['models']]}")
@@ -195,7 +769,7 @@ if __name__ == '__main__':
 
     # --- Qwen (Dashscope) Test ---
     print("\n--- Testing Qwen (Dashscope) ---")
-    if DASHSCOPE_AVAILABLE:
+    if provider_sdk_available('qwen'):
         if config.ANTHROPIC_API_KEY and config.ANTHROPIC_API_KEY != "your_anthropic_api_key_here": # Placeholder for Qwen key
             # Replace with an actual Qwen model name like "qwen-turbo", "qwen-plus", etc.
             qwen_test_model = "qwen-turbo"
@@ -217,7 +791,7 @@ if __name__ == '__main__':
 
     # --- DeepSeek Test ---
     print("\n--- Testing DeepSeek ---")
-    if OPENAI_SDK_AVAILABLE:
+    if provider_sdk_available('deepseek'):
         if config.OPENAI_API_KEY and config.OPENAI_API_KEY != "your_openai_api_key_here":
             deepseek_test_model = "deepseek-chat" # Common model, or "deepseek-coder"
             print(f"Using DeepSeek model: {deepseek_test_model} for test.")
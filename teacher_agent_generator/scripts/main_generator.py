@@ -1,11 +1,13 @@
 # teacher_agent_generator/scripts/main_generator.py
 import argparse
+import asyncio
+import collections
+import concurrent.futures
 import datetime
-import json
 import logging
+import math
 import os
 import time
-import pandas as pd # Added for pd.isna()
 
 # If this script is run directly, add its directory to sys.path
 # to allow direct import of local modules.
@@ -20,9 +22,20 @@ if __name__ == '__main__' and __package__ is None: # __package__ check is more r
         sys.path.insert(0, _PROJECT_ROOT)
 
 # Now local modules can be imported
+import backend_pool
+import batch_client
 import config
 import persona_loader
 import llm_interface
+import metrics
+import packing
+import prompt_store
+import rate_limiter
+import response_cache
+import result_writer
+import scheduling
+import token_budget
+import sharding
 import task_loader
 
 # Global logger instance (will be configured in main)
@@ -33,12 +46,58 @@ def setup_arg_parser():
     parser = argparse.ArgumentParser(description="Generate teacher agent profiles and responses.")
     parser.add_argument("--provider", type=str, help="LLM provider (e.g., 'ollama', 'qwen', 'deepseek')", default=None)
     parser.add_argument("--model", type=str, help="LLM model name (e.g., 'llama2', 'qwen-turbo', 'deepseek-chat')", default=None)
+    parser.add_argument("--backend_pool", type=str, default=config.BACKEND_POOL_FILE,
+                        help="JSON file listing several backends (provider, base_url, model, alias, weight, max_concurrency) to spread "
+                             "requests over instead of a single provider; --model then names a backend alias (see backend_pool.py).")
     parser.add_argument("--temperature", type=float, help="Generation temperature", default=None)
     parser.add_argument("--max_tokens", type=int, help="Max tokens for generation", default=None)
+    parser.add_argument("--max_tokens_mode", type=str, choices=list(token_budget.MAX_TOKENS_MODES), default=config.MAX_TOKENS_MODE,
+                        help="'fixed' reserves --max_tokens for every request; 'adaptive' sizes each request's max_tokens from the "
+                             "output lengths observed for its task type, with --max_tokens as the cap.")
+    parser.add_argument("--context_window", type=int, default=None,
+                        help="Context window of the model in tokens, for the pre-flight overflow check "
+                             "(default: the provider's entry in config.CONTEXT_WINDOW_TOKENS).")
     parser.add_argument("--personas_file", type=str, help="Path to personas CSV file", default=config.PERSONAS_FILE)
     parser.add_argument("--questions_file", type=str, help="Path to open-ended questions text file", default=config.QUESTIONS_FILE)
     parser.add_argument("--questionnaire_file", type=str, help="Path to questionnaire JSON file", default=config.QUESTIONNAIRE_FILE)
     parser.add_argument("--output_dir", type=str, help="Directory to save generated agent data", default=config.GENERATED_AGENTS_DIR)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Maximum number of concurrent LLM requests (1 runs the grid sequentially)")
+    parser.add_argument("--pack_size", type=int, default=1,
+                        help="Answer up to K consecutive likert_scale/multiple_choice questionnaire items per LLM call "
+                             "(1 disables packing). Items missing from a packed answer fall back to a single call.")
+    parser.add_argument("--stream", action="store_true", default=config.LLM_STREAMING,
+                        help="Stream responses, recording time-to-first-token and decode tokens/sec for each record.")
+    parser.add_argument("--schedule", type=str, choices=list(scheduling.SCHEDULING_POLICIES), default=config.SCHEDULING_POLICY,
+                        help="Request scheduling: 'fifo'; 'prompt_group' to pin each persona's system prompt to one client lane "
+                             "and warm the provider's prefix cache with one request before sending the rest of that persona's tasks; "
+                             "or 'longest_first' to issue the jobs expected to take longest first (results are written in that order).")
+    parser.add_argument("--hedge", action="store_true", default=config.HEDGING_ENABLED,
+                        help="Hedge slow requests: a call still running after --hedge_percentile of recent latencies for its task type "
+                             "is duplicated on another backend (or connection) and the first response wins.")
+    parser.add_argument("--hedge_percentile", type=float, default=config.HEDGE_PERCENTILE,
+                        help="Latency percentile of recent calls after which a request is hedged (with --hedge).")
+    parser.add_argument("--hedge_budget", type=float, default=config.HEDGE_BUDGET_FRACTION,
+                        help="Maximum fraction of requests that may be hedged, capping the extra load (with --hedge).")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit the whole grid through the provider's Batch API (OpenAI-compatible providers only) "
+                             "and wait for the results, instead of making one request per task.")
+    parser.add_argument("--cache", type=str, choices=list(response_cache.CACHE_MODES), default=config.RESPONSE_CACHE_MODE,
+                        help="Disk-backed LLM response cache: 'off', 'read' (serve hits only) or 'readwrite' (serve and store).")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="Process only shard i of N ('i/N', 0-based), assigned by a stable hash of persona and task. "
+                             "Merge shard outputs with 'python scripts/sharding.py merge'.")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="Path to an earlier output JSONL or Parquet file (or its .partial file). Skips (persona, task, provider, model) "
+                             "combinations that already succeeded and appends new records to the same file.")
+    parser.add_argument("--output_format", type=str, choices=list(result_writer.OUTPUT_FORMATS), default=config.OUTPUT_FORMAT,
+                        help="'full' embeds persona details and the system prompt in every record; 'normalized' writes them once to "
+                             "<output>.personas.jsonl / <output>.prompts.jsonl and records reference them by persona_key / system_prompt_key; "
+                             "'parquet' writes full records to a zstd-compressed Parquet file (requires pyarrow).")
+    parser.add_argument("--metrics_file", type=str, default=config.METRICS_FILE,
+                        help="Write Prometheus-format metrics to this file during the run (refreshed periodically).")
+    parser.add_argument("--metrics_port", type=int, default=config.METRICS_PORT,
+                        help="Serve Prometheus-format metrics on http://127.0.0.1:<port>/metrics during the run.")
     parser.add_argument("--log_level", type=str, choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"], default=config.LOG_LEVEL)
     return parser.parse_args()
 
@@ -116,14 +175,14 @@ def construct_system_prompt(persona: dict) -> str:
     for key, format_string in optional_attributes_map.items():
         value = persona.get(key)
         # Check if value is not None, not NaN (if from pandas), and not an empty/whitespace string
-        if value is not None and not (isinstance(value, float) and pd.isna(value)) and str(value).strip():
+        if value is not None and not (isinstance(value, float) and math.isnan(value)) and str(value).strip():
             cleaned_value = str(value).strip()
             prompt_parts.append(format_string.format(cleaned_value))
 
     # Teaching plan (handle if missing or empty)
     teaching_plan_raw = persona.get('teaching_plan')
     teaching_plan = ''
-    if teaching_plan_raw is not None and not (isinstance(teaching_plan_raw, float) and pd.isna(teaching_plan_raw)):
+    if teaching_plan_raw is not None and not (isinstance(teaching_plan_raw, float) and math.isnan(teaching_plan_raw)):
         teaching_plan = str(teaching_plan_raw).strip()
 
     if teaching_plan:
@@ -157,7 +216,7 @@ def construct_translator_system_prompt(persona: dict) -> str:
     adj_exp = persona.get('translation_experience_years_adjusted', 0.0)
     skill_level = str(persona.get('translation_skill_level', 'Junior')).strip() # Default to Junior
     cat_tools_raw = persona.get('cat_tool_familiarity')
-    cat_tools = str(cat_tools_raw).strip() if cat_tools_raw and not (isinstance(cat_tools_raw, float) and pd.isna(cat_tools_raw)) else "not specified"
+    cat_tools = str(cat_tools_raw).strip() if cat_tools_raw and not (isinstance(cat_tools_raw, float) and math.isnan(cat_tools_raw)) else "not specified"
 
     prompt_parts.append(f"You have {adj_exp:.1f} years of adjusted professional translation experience, and your skill level is considered {skill_level}.")
     if cat_tools.lower() != 'not specified':
@@ -201,12 +260,12 @@ def construct_translator_system_prompt(persona: dict) -> str:
 
     # Linguistic Traits and Style
     common_traits_raw = persona.get('common_linguistic_traits')
-    common_traits = str(common_traits_raw).strip() if common_traits_raw and not (isinstance(common_traits_raw, float) and pd.isna(common_traits_raw)) else ""
+    common_traits = str(common_traits_raw).strip() if common_traits_raw and not (isinstance(common_traits_raw, float) and math.isnan(common_traits_raw)) else ""
     if common_traits:
         prompt_parts.append(f"Your known linguistic traits include: {common_traits}.")
 
-    sample_source_exists = persona.get('sample_source_text_ch') and not (isinstance(persona.get('sample_source_text_ch'), float) and pd.isna(persona.get('sample_source_text_ch'))) and "[Chinese Source Sample" not in str(persona.get('sample_source_text_ch'))
-    sample_translation_exists = persona.get('sample_translation_en') and not (isinstance(persona.get('sample_translation_en'), float) and pd.isna(persona.get('sample_translation_en'))) and "[English Translation Sample" not in str(persona.get('sample_translation_en'))
+    sample_source_exists = persona.get('sample_source_text_ch') and not (isinstance(persona.get('sample_source_text_ch'), float) and math.isnan(persona.get('sample_source_text_ch'))) and "[Chinese Source Sample" not in str(persona.get('sample_source_text_ch'))
+    sample_translation_exists = persona.get('sample_translation_en') and not (isinstance(persona.get('sample_translation_en'), float) and math.isnan(persona.get('sample_translation_en'))) and "[English Translation Sample" not in str(persona.get('sample_translation_en'))
 
     if sample_source_exists and sample_translation_exists:
         prompt_parts.append("Strive for consistency with the style demonstrated in your provided sample translation (details of which are not directly shown here but assume you know your style).")
@@ -249,6 +308,312 @@ def construct_translator_system_prompt(persona: dict) -> str:
 
     return "\n\n".join(prompt_parts) # Use double newline for better readability of the final prompt
 
+def _iter_generation_jobs(personas, all_task_items, store=None):
+    """
+    Yields one job dict per (persona, task) pair, in persona-major file order.
+    The system prompt is built once per persona and shared by all of its jobs.
+    With a prompt_store.PromptStore (normalized output), the persona and its system prompt are stored
+    once and the jobs carry their keys instead.
+    """
+    sequence_number = 0
+    for i, persona in enumerate(personas):
+        logger.info(f"Processing persona {i+1}/{len(personas)}: {persona.get('name', 'Unknown Persona')}")
+        system_prompt_for_persona = construct_system_prompt(persona)
+        stored_keys = {}
+        if store is not None:
+            stored_keys = {"persona_key": store.add_persona(persona), "system_prompt_key": store.add_prompt(system_prompt_for_persona)}
+
+        for j, task in enumerate(all_task_items):
+            sequence_number += 1
+            yield {
+                "sequence_number": sequence_number,
+                "persona_index": i,
+                "task_index": j,
+                "persona": persona,
+                "task": task,
+                "system_prompt": system_prompt_for_persona,
+                **stored_keys,
+            }
+
+# Record fields identifying one unit of work, used to skip completed work when resuming
+RESUME_KEY_FIELDS = result_writer.TEACHER_RECORD_KEY_FIELDS
+
+def _job_task_id(job: dict) -> str:
+    """Returns the task's 'id' if available (from questionnaire), else one generated from its position."""
+    return job["task"].get("id", f"task_{job['task_index']}")
+
+def _job_resume_key(job: dict, llm_settings: dict) -> tuple:
+    """Returns the RESUME_KEY_FIELDS values the job's output record will carry."""
+    return (job["persona"].get("name"), _job_task_id(job), llm_settings["provider"], llm_settings["model_name"])
+
+def _expected_output_tokens(task_type) -> int:
+    """The answer length expected for a teacher task type (config.EXPECTED_OUTPUT_TOKENS_BY_TASK_TYPE)."""
+    return config.EXPECTED_OUTPUT_TOKENS_BY_TASK_TYPE.get(task_type, config.DEFAULT_EXPECTED_OUTPUT_TOKENS)
+
+def _cost_features(task_type, task_text) -> tuple:
+    """(cost class, expected tokens) of a teacher task, for --schedule longest_first: the answer length expected
+    for its type plus the question itself."""
+    return task_type, _expected_output_tokens(task_type) + rate_limiter.estimate_tokens(task_text)
+
+def _job_cost_features(job: dict) -> tuple:
+    task = job["task"]
+    return _cost_features(task.get("type", "unknown_task_type"), task.get("text", "No task text provided."))
+
+def _job_user_prompt(job: dict) -> str:
+    # The user prompt is essentially the task text itself.
+    return job["task"].get("text", "No task text provided.")
+
+def _generate_record(job: dict, llm_settings: dict, total_generations: int) -> dict:
+    """
+    Runs a single LLM generation for one (persona, task) job and returns the output record.
+    Errors are captured in the record's 'error' field rather than raised.
+    """
+    persona = job["persona"]
+    task = job["task"]
+    j = job["task_index"]
+    system_prompt_for_persona = job["system_prompt"]
+    user_prompt_for_llm = _job_user_prompt(job)
+
+    logger.info(f"  Processing task {j+1} for persona {persona.get('name', 'Unknown Persona')} (Overall: {job['sequence_number']}/{total_generations})")
+    logger.debug(f"    Persona: {persona}")
+    logger.debug(f"    Task: {task}")
+    logger.debug(f"    System Prompt: {system_prompt_for_persona}")
+    logger.debug(f"    User Prompt (Task Text): {user_prompt_for_llm}")
+
+    budget = llm_settings["token_budget"]
+    task_type = task.get("type", "unknown_task_type")
+    expected_tokens = _expected_output_tokens(task_type)
+    request_plan = budget.plan(task_type, expected_tokens, system_prompt_for_persona, user_prompt_for_llm)
+    if request_plan["overflow"]:
+        logger.warning(f"    The prompt ({request_plan['prompt_tokens']} tokens) leaves no room for an answer in the "
+                       f"{budget.context_window_tokens}-token context window; sending it with max_tokens {request_plan['max_tokens']} "
+                       f"for the provider to accept or reject.")
+
+    start_time = time.time()
+    try:
+        generation = budget.generate(
+            lambda max_tokens: llm_interface.generate_response_detailed(
+                system_prompt=system_prompt_for_persona,
+                user_prompt=user_prompt_for_llm,
+                provider=llm_settings["provider"],
+                model_name=llm_settings["model_name"],
+                temperature=llm_settings["temperature"],
+                max_tokens=max_tokens,
+                stream=llm_settings["stream"],
+                latency_class=task_type,
+                cache_max_tokens=budget.max_tokens
+            ),
+            task_type, expected_tokens, request_plan)
+    except Exception as e:
+        logger.error(f"    Exception during LLM call for persona '{persona.get('name')}' and task '{user_prompt_for_llm[:50]}...': {e}", exc_info=True)
+        generation = {"content": None, "error": str(e), "attempts": 0, "cache_hit": False} # Capture str(e) from the exception
+    duration = time.time() - start_time # Captured for successful, no-content and failed calls alike
+
+    return _build_record(job, llm_settings, generation, duration)
+
+def _build_record(job: dict, llm_settings: dict, generation: dict, duration) -> dict:
+    """
+    Builds the output record for a job from a generation result (see llm_interface.generate_response_detailed).
+    `duration` is None when no per-request latency exists, e.g. for Batch API results.
+    """
+    persona = job["persona"]
+    task = job["task"]
+    task_text = task.get("text", "No task text provided.")
+    task_type = task.get("type", "unknown_task_type")
+    task_id = _job_task_id(job)
+    took = f"{duration:.2f} seconds" if duration is not None else "an unmeasured time (batch)"
+    usage = generation.get("usage") or {}
+    timings = generation.get("timings") or {}
+
+    response_content = None  # Initialize
+    llm_error_message = None # Initialize
+    if generation["content"]:
+        response_content = generation["content"]
+        logger.info(f"    LLM call successfully completed in {took} (received content).")
+        logger.debug(f"    Raw LLM Response: {response_content[:100]}...")
+    else:
+        # llm_interface returned no content (error details come from llm_interface)
+        llm_error_message = generation["error"] or "No content returned from LLM provider (see LLM interface logs for specific error)."
+        logger.warning(f"    {llm_error_message} for persona '{persona.get('name')}' and task '{task_text[:50]}...'. LLM call took {took}.")
+
+    # Common record shape for all outcomes (success, no content, exception)
+    record = {
+        "persona_name": persona.get("name"),
+        "persona_details": persona,
+        "task_id": task_id,
+        "task_type": task_type,
+        "task_text": task_text,
+        "system_prompt": job["system_prompt"],
+        "user_prompt": _job_user_prompt(job),
+        "llm_response": response_content, # Will be None if error or no content from LLM
+        "llm_provider": llm_settings["provider"],
+        "llm_model": llm_settings["model_name"],
+        "llm_max_tokens": generation.get("max_tokens") or llm_settings["max_tokens"], # The output limit requested for this generation
+        "generation_time_seconds": duration,
+        "llm_attempts": generation["attempts"], # Provider calls made, including retries (0 if served from cache)
+        "prompt_tokens": usage.get("prompt_tokens"), # As reported by the provider; None if not reported
+        "cached_prompt_tokens": usage.get("cached_prompt_tokens"), # Prompt prefix tokens served from the provider's prompt cache
+        "llm_call_seconds": timings.get("call_seconds"), # The successful provider call alone, without queueing or earlier attempts
+        "time_to_first_token_seconds": timings.get("time_to_first_token_seconds"), # Streaming only
+        "output_tokens": timings.get("output_tokens"),
+        "tokens_per_second": timings.get("tokens_per_second"), # Decode throughput
+        "grid_position": job["sequence_number"] - 1, # Position in the persona-major grid; orders merged shard outputs
+        "error": llm_error_message # Contains the provider error or the "no content from provider" message, or None if successful
+    }
+    if "persona_key" in job:
+        # Normalized output: the persona and system prompt live in the side tables (see prompt_store)
+        del record["persona_details"], record["system_prompt"]
+        record["persona_key"] = job["persona_key"]
+        record["system_prompt_key"] = job["system_prompt_key"]
+    if generation.get("batch_id"):
+        record["batch_id"] = generation["batch_id"]
+    if generation.get("backend"):
+        record["llm_backend"] = generation["backend"] # The backend pool member of the last attempt
+    if generation.get("hedge"):
+        record["hedge_winner"] = generation["hedge"] # 'primary' or 'hedge', for hedged requests only
+    return record
+
+def _generate_unit_records(unit: list, llm_settings: dict, total_generations: int) -> list:
+    """
+    Generates the records for one unit of work from packing.pack_jobs(): a single job, or a pack of
+    questionnaire items answered together in one LLM call. Returns the records in job order.
+
+    A packed call asks for a JSON object of answers keyed by item id. Each answered item becomes a
+    regular record; items missing from the response are generated with a single call each.
+    """
+    if len(unit) == 1:
+        return [_generate_record(unit[0], llm_settings, total_generations)]
+
+    persona = unit[0]["persona"]
+    item_ids = [job["task"]["id"] for job in unit]
+    logger.info(f"  Processing {len(unit)} packed questionnaire items ({', '.join(item_ids)}) for persona "
+                f"{persona.get('name', 'Unknown Persona')} (Overall: {unit[0]['sequence_number']}-{unit[-1]['sequence_number']}/{total_generations})")
+    user_prompt = packing.build_packed_user_prompt([job["task"] for job in unit])
+    logger.debug(f"    Packed User Prompt: {user_prompt}")
+
+    budget = llm_settings["token_budget"]
+    expected_tokens = sum(_expected_output_tokens(job["task"].get("type")) for job in unit)
+    request_plan = budget.plan("packed", expected_tokens, unit[0]["system_prompt"], user_prompt)
+    if request_plan["overflow"]:
+        logger.warning(f"    Packed prompt ({request_plan['prompt_tokens']} tokens) does not fit the {budget.context_window_tokens}-token "
+                       f"context window; splitting the pack of {len(unit)} items.")
+        budget.record_split()
+        half = len(unit) // 2
+        return (_generate_unit_records(unit[:half], llm_settings, total_generations)
+                + _generate_unit_records(unit[half:], llm_settings, total_generations))
+
+    start_time = time.time()
+    try:
+        generation = budget.generate(
+            lambda max_tokens: llm_interface.generate_response_detailed(
+                system_prompt=unit[0]["system_prompt"],
+                user_prompt=user_prompt,
+                provider=llm_settings["provider"],
+                model_name=llm_settings["model_name"],
+                temperature=llm_settings["temperature"],
+                max_tokens=max_tokens,
+                stream=llm_settings["stream"],
+                latency_class="packed",
+                cache_max_tokens=budget.max_tokens
+            ),
+            "packed", expected_tokens, request_plan)
+    except Exception as e:
+        logger.error(f"    Exception during packed LLM call for persona '{persona.get('name')}': {e}", exc_info=True)
+        generation = {"content": None, "error": str(e), "attempts": 0, "cache_hit": False}
+    duration = time.time() - start_time
+
+    answers = packing.parse_packed_response(generation["content"], item_ids)
+    missing_ids = [item_id for item_id in item_ids if item_id not in answers]
+    if missing_ids:
+        logger.warning(f"    Packed response is missing {len(missing_ids)} of {len(unit)} items ({', '.join(missing_ids)}); "
+                       f"falling back to single calls for them.")
+
+    records = []
+    usage_reported = False
+    for job in unit:
+        answer = answers.get(job["task"]["id"])
+        if answer is None:
+            records.append(_generate_record(job, llm_settings, total_generations))
+            continue
+        item_generation = {
+            "content": answer,
+            "error": None,
+            "attempts": generation["attempts"],
+            "cache_hit": generation["cache_hit"],
+            # The packed call's usage and timings are reported once, on the first answered item, so totals add up
+            "usage": None if usage_reported else generation.get("usage"),
+            "timings": None if usage_reported else generation.get("timings"),
+            "backend": generation.get("backend"),
+            "hedge": generation.get("hedge"),
+            "max_tokens": generation.get("max_tokens"),
+        }
+        usage_reported = True
+        record = _build_record(job, llm_settings, item_generation, duration) # duration is that of the shared call
+        record["pack_size"] = len(unit)
+        records.append(record)
+    return records
+
+def _generate_records_in_batch(generation_jobs, llm_settings: dict, request_file_path: str, on_record) -> int:
+    """
+    Generates all jobs through the provider's Batch API (see batch_client) instead of one call per job.
+    The whole grid is submitted as one batch; records are produced in job order once it finishes.
+
+    Returns:
+        int: The number of records produced.
+    """
+    jobs = list(generation_jobs)
+    requests = [(str(job["sequence_number"]), job["system_prompt"], _job_user_prompt(job)) for job in jobs]
+    results = batch_client.run_batch(requests, llm_settings["provider"], llm_settings["model_name"],
+                                     llm_settings["temperature"], llm_settings["max_tokens"], request_file_path)
+    for job in jobs:
+        on_record(_build_record(job, llm_settings, results[str(job["sequence_number"])], None))
+    return len(jobs)
+
+async def _generate_records_concurrently(work_units, llm_settings: dict, concurrency: int, total_generations: int, on_record) -> int:
+    """
+    Runs units of work (see packing.pack_jobs) with at most `concurrency` units in flight.
+
+    The provider SDKs are blocking, so each call runs in a dedicated thread pool
+    sized to the concurrency limit; an asyncio.Semaphore bounds the in-flight work.
+    Completed records are passed to `on_record` in job order, so output is deterministic
+    regardless of completion order. Only a bounded reorder window of units is scheduled
+    ahead of the oldest unfinished one, so memory stays flat however large the grid is.
+
+    Returns:
+        int: The number of records produced.
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    max_pending = concurrency * 4 # Reorder window: units scheduled ahead of the oldest unfinished one
+    records_produced = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm") as executor:
+        async def run_unit(unit):
+            async with semaphore:
+                return await loop.run_in_executor(executor, _generate_unit_records, unit, llm_settings, total_generations)
+
+        def deliver(records):
+            nonlocal records_produced
+            for record in records:
+                on_record(record)
+            records_produced += len(records)
+            metrics.GENERATOR_QUEUE_DEPTH.set(len(pending), driver="teacher")
+
+        pending = collections.deque()
+        try:
+            for unit in work_units:
+                pending.append(asyncio.ensure_future(run_unit(unit)))
+                metrics.GENERATOR_QUEUE_DEPTH.set(len(pending), driver="teacher")
+                if len(pending) >= max_pending:
+                    deliver(await pending.popleft())
+            while pending:
+                deliver(await pending.popleft())
+        finally:
+            for future in pending:
+                future.cancel()
+
+    return records_produced
+
 def main():
     args = setup_arg_parser()
 
@@ -265,6 +630,50 @@ def main():
 
     logger.info("Starting Teacher Agent Generation Process")
     logger.debug(f"CLI Arguments: {args}")
+    if args.shard and args.output_format == "parquet":
+        logger.error("--shard cannot be combined with --output_format parquet; 'sharding.py merge' reads JSONL shard outputs. Exiting.")
+        return
+    context_providers = None
+    if args.backend_pool or provider == backend_pool.POOL_PROVIDER:
+        if not args.backend_pool:
+            logger.error(f"Provider '{backend_pool.POOL_PROVIDER}' needs --backend_pool (or BACKEND_POOL_FILE). Exiting.")
+            return
+        if args.batch:
+            logger.error("--batch cannot be combined with a backend pool; the Batch API belongs to a single provider. Exiting.")
+            return
+        try:
+            pool = llm_interface.configure_backend_pool(args.backend_pool)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load backend pool {args.backend_pool}: {e}. Exiting.")
+            return
+        if provider != backend_pool.POOL_PROVIDER and args.provider:
+            logger.warning(f"--provider {args.provider} is ignored: requests go to the backends of {args.backend_pool}.")
+        provider = backend_pool.POOL_PROVIDER
+        if not args.model and len(pool.aliases) == 1:
+            model_name = pool.aliases[0]
+        if model_name not in pool.aliases:
+            logger.error(f"No backend in {args.backend_pool} serves model '{model_name}' (available: {', '.join(pool.aliases)}). Exiting.")
+            return
+        logger.info(f"Routing requests for '{model_name}' over {sum(b.alias == model_name for b in pool.backends)} backends "
+                    f"of {args.backend_pool} ({pool.routing} routing).")
+        context_providers = {b.provider for b in pool.backends if b.alias == model_name}
+    budget = token_budget.TokenBudget(max_tokens, min(token_budget.context_window(p, args.context_window) for p in context_providers or {provider}),
+                                      "fixed" if args.batch else args.max_tokens_mode)
+    if args.max_tokens_mode == "adaptive" and args.batch:
+        logger.warning("--max_tokens_mode adaptive is ignored in batch mode; every request reserves --max_tokens.")
+    logger.info(f"Token accounting: prompts counted with {token_budget.tokenizer_name()}, {budget.context_window_tokens}-token context window, "
+                f"max_tokens {'sized per request up to' if budget.mode == 'adaptive' else 'fixed at'} {max_tokens}.")
+    if args.hedge:
+        if args.batch:
+            logger.warning("--hedge is ignored in batch mode.")
+        else:
+            try:
+                llm_interface.configure_hedging(True, args.hedge_percentile, args.hedge_budget)
+            except ValueError as e:
+                logger.error(f"{e} Exiting.")
+                return
+            logger.info(f"Hedging requests still running after p{args.hedge_percentile:g} of recent latencies "
+                        f"(at most {args.hedge_budget:.0%} of requests).")
     logger.debug(f"Effective LLM settings: Provider={provider}, Model={model_name}, Temp={temperature}, MaxTokens={max_tokens}")
 
     # Load personas
@@ -284,117 +693,137 @@ def main():
 
     logger.info(f"Loaded {len(personas)} personas and {len(all_task_items)} total tasks.")
 
-    all_generated_data = []
     total_generations = len(personas) * len(all_task_items)
-    current_generation_count = 0
-
-    for i, persona in enumerate(personas):
-        logger.info(f"Processing persona {i+1}/{len(personas)}: {persona.get('name', 'Unknown Persona')}")
-        system_prompt_for_persona = construct_system_prompt(persona)
-
-        for j, task in enumerate(all_task_items):
-            current_generation_count += 1
-            task_text = task.get("text", "No task text provided.")
-            task_type = task.get("type", "unknown_task_type")
-            task_id = task.get("id", f"task_{j}") # Use 'id' if available (from questionnaire), else generate one
-
-            logger.info(f"  Processing task {j+1}/{len(all_task_items)} for persona {persona.get('name', 'Unknown Persona')} (Overall: {current_generation_count}/{total_generations})")
-            logger.debug(f"    Persona: {persona}")
-            logger.debug(f"    Task: {task}")
-            logger.debug(f"    System Prompt: {system_prompt_for_persona}")
-            logger.debug(f"    User Prompt (Task Text): {task_text}")
-
-            # The user prompt is essentially the task text itself.
-            user_prompt_for_llm = task_text
-
-            # The user prompt is essentially the task text itself.
-            user_prompt_for_llm = task_text
-
-            response_content = None  # Initialize
-            llm_error_message = None # Initialize
-            duration = 0.0
-
-            start_time = time.time()
-            try:
-                temp_response_content = llm_interface.generate_response(
-                    system_prompt=system_prompt_for_persona,
-                    user_prompt=user_prompt_for_llm,
-                    provider=provider,
-                    model_name=model_name,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                duration = time.time() - start_time # Capture duration for successful or no-content responses
-
-                if temp_response_content:
-                    response_content = temp_response_content
-                    logger.info(f"    LLM call successfully completed in {duration:.2f} seconds (received content).")
-                    logger.debug(f"    Raw LLM Response: {response_content[:100]}...")
-                else:
-                    # No exception in this script, but llm_interface returned None
-                    llm_error_message = "No content returned from LLM provider (see LLM interface logs for specific error)."
-                    logger.warning(f"    {llm_error_message} for persona '{persona.get('name')}' and task '{task_text[:50]}...'. LLM call took {duration:.2f}s.")
-
-            except Exception as e:
-                duration = time.time() - start_time # Capture duration even if exception occurs early
-                logger.error(f"    Exception during LLM call for persona '{persona.get('name')}' and task '{task_text[:50]}...': {e}", exc_info=True)
-                llm_error_message = str(e) # Capture str(e) from the exception
-
-            # Common append operation for all outcomes (success, no content, exception)
-            all_generated_data.append({
-                "persona_name": persona.get("name"),
-                "persona_details": persona,
-                "task_id": task_id,
-                "task_type": task_type,
-                "task_text": task_text,
-                "system_prompt": system_prompt_for_persona,
-                "user_prompt": user_prompt_for_llm,
-                "llm_response": response_content, # Will be None if error or no content from LLM
-                "llm_provider": provider,
-                "llm_model": model_name,
-                "generation_time_seconds": duration,
-                "error": llm_error_message # Contains str(e) or the "no content from provider" message, or None if successful
-            })
-
-            # Optional: Add a small delay to avoid hitting rate limits if any
-            # time.sleep(1)
-
-    # Save all generated data
-    if all_generated_data:
+    llm_settings = {
+        "provider": provider,
+        "model_name": model_name,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": args.stream,
+        "token_budget": budget,
+    }
+    shard = sharding.parse_shard_spec(args.shard) if args.shard else None
+    # Records are streamed to disk as they complete instead of being collected in memory.
+    if args.resume:
+        output_filepath = result_writer.final_output_path(args.resume)
+        if output_filepath.endswith(result_writer.PARQUET_EXTENSION) != (args.output_format == "parquet"):
+            logger.error(f"Cannot resume {args.resume} with --output_format {args.output_format}; use the format of the earlier run. Exiting.")
+            return
+    else:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"generated_teacher_agents_{timestamp}.jsonl"
+        output_filename = f"generated_teacher_agents_{timestamp}{sharding.shard_filename_suffix(shard)}{result_writer.output_file_extension(args.output_format)}"
         output_filepath = os.path.join(args.output_dir, output_filename)
 
-        try:
-            # Ensure output directory exists (config.py also tries, but good to double check here)
-            os.makedirs(args.output_dir, exist_ok=True)
-
-            with open(output_filepath, 'w', encoding='utf-8') as f_out:
-                for entry in all_generated_data:
-                    f_out.write(json.dumps(entry) + '\n')
-            logger.info(f"Successfully saved {len(all_generated_data)} generated entries to {output_filepath}")
-        except Exception as e:
-            logger.error(f"Failed to save generated data to {output_filepath}: {e}", exc_info=True)
-    else:
-        logger.warning("No data was generated to save.")
-
+    store = None
+    if args.output_format == "normalized":
+        store = prompt_store.PromptStore(output_filepath)
+        logger.info(f"Normalized output: personas and system prompts are stored once in {output_filepath}{prompt_store.PERSONAS_SUFFIX} "
+                    f"and {output_filepath}{prompt_store.PROMPTS_SUFFIX}.")
+    generation_jobs = _iter_generation_jobs(personas, all_task_items, store)
+    if shard:
+        logger.info(f"Processing shard {shard[0]} of {shard[1]} (0-based).")
+        generation_jobs = (job for job in generation_jobs
+                           if sharding.in_shard(job["persona"].get("name"), _job_task_id(job), shard))
+
+    if args.cache != "off":
+        llm_interface.configure_response_cache(args.cache)
+    if args.schedule != "fifo":
+        llm_interface.configure_scheduling(args.schedule)
+
+    if args.resume:
+        completed_keys = result_writer.load_completed_keys(args.resume, RESUME_KEY_FIELDS, error_field="error")
+        logger.info(f"Resuming into {output_filepath}: {len(completed_keys)} of {total_generations} generations already completed.")
+        generation_jobs = (job for job in generation_jobs if _job_resume_key(job, llm_settings) not in completed_keys)
+
+    exporter = None
+    if args.metrics_file or args.metrics_port:
+        exporter = metrics.MetricsExporter(textfile_path=args.metrics_file, port=args.metrics_port)
+
+    cost_model = scheduling.JobCostModel() if args.schedule == "longest_first" else None
+    try:
+        with result_writer.create_result_writer(output_filepath, args.output_format, result_writer.TEACHER_PARQUET_COLUMNS,
+                                                append=bool(args.resume)) as writer:
+            def write_record(record):
+                writer.write(record)
+                metrics.GENERATOR_RECORDS.inc(driver="teacher", status="error" if record.get("error") else "success")
+                # Packed records share one call's latency, and cached ones have none
+                if cost_model is not None and record.get("llm_attempts") and not record.get("pack_size"):
+                    cost_model.observe(*_cost_features(record["task_type"], record["task_text"]),
+                                       record.get("llm_call_seconds") or record.get("generation_time_seconds"))
+
+            if args.batch:
+                if args.pack_size > 1:
+                    logger.warning("--pack_size is ignored in batch mode; each item is submitted as its own batch request.")
+                logger.info("Submitting the generation grid through the provider's Batch API.")
+                _generate_records_in_batch(generation_jobs, llm_settings, output_filepath + ".batch_input.jsonl", write_record)
+            else:
+                work_units = packing.pack_jobs(generation_jobs, args.pack_size)
+                if args.pack_size > 1:
+                    logger.info(f"Packing up to {args.pack_size} consecutive {'/'.join(config.PACKABLE_TASK_TYPES)} items per LLM call.")
+                if cost_model is not None:
+                    logger.info("Issuing the units of work expected to take longest first; records are written in that order.")
+                    work_units = scheduling.order_longest_first(
+                        work_units, lambda unit: sum(cost_model.estimate(*_job_cost_features(job)) for job in unit))
+                if args.concurrency > 1:
+                    logger.info(f"Running {total_generations} generations concurrently (max {args.concurrency} in-flight requests).")
+                    asyncio.run(
+                        _generate_records_concurrently(work_units, llm_settings, args.concurrency, total_generations, write_record)
+                    )
+                else:
+                    for unit in work_units:
+                        for record in _generate_unit_records(unit, llm_settings, total_generations):
+                            write_record(record)
+
+        if writer.records_written:
+            logger.info(f"Successfully saved {writer.records_written} generated entries to {output_filepath}")
+        else:
+            logger.warning("No data was generated to save.")
+    except Exception as e:
+        logger.error(f"Generation run aborted; completed records (if any) remain in {output_filepath}{result_writer.PARTIAL_SUFFIX}: {e}", exc_info=True)
+    finally:
+        if store is not None:
+            store.close()
+            store_stats = store.stats()
+            logger.info(f"Prompt store: {store_stats['personas']} personas and {store_stats['prompts']} system prompts "
+                        f"({store_stats['personas_written']} and {store_stats['prompts_written']} newly written).")
+
+    cache_stats = llm_interface.get_cache_stats()
+    if cache_stats:
+        logger.info(f"Response cache ({cache_stats['mode']}): {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                    f"{cache_stats['writes']} writes, {cache_stats['evictions']} evictions.")
+        llm_interface.configure_response_cache("off") # Closes the cache database
+
+    scheduling_stats = llm_interface.get_scheduling_stats()
+    if scheduling_stats:
+        logger.info(f"Prompt-group scheduling: {scheduling_stats['prompt_groups']} prompt groups over {scheduling_stats['lanes']} lanes, "
+                    f"{scheduling_stats['warmup_waits']} requests waited for a prefix warm-up.")
+        llm_interface.configure_scheduling("fifo")
+    if cost_model is not None:
+        cost_stats = cost_model.stats()
+        logger.info(f"Longest-first scheduling: {cost_stats['observations']} latencies observed; "
+                    f"seconds per expected token by task type: {cost_stats['seconds_per_token']}")
+    pool_stats = llm_interface.get_backend_pool_stats()
+    if pool_stats:
+        backend_summary = "; ".join(f"{name}: {stats['calls']} calls, {stats['failures']} failed, circuit {stats['circuit']}"
+                                    for name, stats in pool_stats["backends"].items())
+        logger.info(f"Backend pool ({pool_stats['routing']} routing, {pool_stats['capacity_waits']} requests waited for a free backend): "
+                    f"{backend_summary}")
+    budget_stats = budget.stats()
+    logger.info(f"Token accounting ({budget_stats['mode']} max_tokens): {budget_stats['requests']} requests reserved "
+                f"{budget_stats['mean_reserved_tokens']} prompt + output tokens on average; {budget_stats['sized_requests']} sized, "
+                f"{budget_stats['escalations']} repeated with the full limit, {budget_stats['clamped']} limited by the context window, "
+                f"{budget_stats['overflows']} overflowed it ({budget_stats['splits']} split).")
+    hedging_stats = llm_interface.get_hedging_stats()
+    if hedging_stats:
+        logger.info(f"Hedging: {hedging_stats['hedges_sent']} of {hedging_stats['requests']} requests hedged "
+                    f"({hedging_stats['hedge_wins']} won by the hedge); {hedging_stats['skipped_budget']} skipped for budget, "
+                    f"{hedging_stats['skipped_no_target']} for lack of a free backend.")
+        llm_interface.configure_hedging(False)
+
+    if exporter is not None:
+        exporter.stop() # Writes the final metrics file
+    llm_interface.close_clients() # Release pooled provider connections
     logger.info("Teacher Agent Generation Process Finished.")
 
 if __name__ == '__main__':
-    # --- Pandas Check (Placeholder) ---
-    # The persona_loader.py currently uses the 'csv' module, not pandas.
-    # If pandas were a requirement for persona_loader or other parts, this check would be relevant.
-    try:
-        import pandas
-        PANDAS_AVAILABLE = True
-    except ImportError:
-        PANDAS_AVAILABLE = False
-        print("WARNING: Pandas library not found. If CSV processing relies on it, errors may occur.")
-        # Potentially log this warning too, if logging is configured before this point.
-        # However, logger is configured in main(). For a startup check, print is fine.
-
-    # if not PANDAS_AVAILABLE and "persona_loader_uses_pandas": # Example condition
-    #     print("Critical Error: Pandas is required for persona loading but not installed. Exiting.")
-    #     sys.exit(1)
-
     main()
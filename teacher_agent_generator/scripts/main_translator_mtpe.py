@@ -1,11 +1,12 @@
 # teacher_agent_generator/scripts/main_translator_mtpe.py
 import argparse
+import collections
+import concurrent.futures
 import datetime
-import json
+import itertools
 import logging
 import os
 import time
-import pandas as pd # For pd.isna() if used by imported modules
 
 # If this script is run directly, add its directory and project root to sys.path
 if __name__ == '__main__' and __package__ is None:
@@ -18,15 +19,29 @@ if __name__ == '__main__' and __package__ is None:
         sys.path.insert(0, _PROJECT_ROOT)
 
 # Custom module imports
+import backend_pool
+import batch_client
 import config
 import persona_loader
 import llm_interface
+import metrics
+import mtpe_response
+import prompt_store
+import rate_limiter
+import response_cache
+import result_writer
+import scheduling
+import sharding
 import task_loader
+import token_budget
 from main_generator import construct_translator_system_prompt # Import from existing main_generator
 
 # Global logger instance
 logger = logging.getLogger(__name__)
 
+# Run totals of response parsing and JSON repair calls, for the run summary
+_parse_stats = mtpe_response.ParseStats()
+
 def setup_translator_arg_parser():
     """Sets up the command-line argument parser for the MTPE translator agent generator."""
     parser = argparse.ArgumentParser(description="Generate MTPE agent responses based on translator personas.")
@@ -37,7 +52,7 @@ def setup_translator_arg_parser():
                         help="Path to translator personas CSV file.")
     parser.add_argument("--mtpe_tasks_file", type=str,
                         default=config.DEFAULT_MTPE_TASKS_PATH,
-                        help="Path to MTPE tasks JSONL file.")
+                        help="Path to MTPE tasks JSONL file (optionally gzip- or zstd-compressed).")
     parser.add_argument("--output_dir", type=str,
                         default=config.GENERATED_AGENTS_DIR, # Re-use existing output dir
                         help="Directory to save generated MTPE agent data.")
@@ -47,17 +62,64 @@ def setup_translator_arg_parser():
                         help="LLM provider (e.g., 'ollama', 'qwen', 'deepseek'). Overrides config.DEFAULT_MODEL's provider part.")
     parser.add_argument("--model_name", type=str,
                         help="LLM model name (e.g., 'llama3:8b-instruct', 'qwen-turbo'). Overrides config.DEFAULT_MODEL's model part.")
+    parser.add_argument("--backend_pool", type=str, default=config.BACKEND_POOL_FILE,
+                        help="JSON file listing several backends (provider, base_url, model, alias, weight, max_concurrency) to spread "
+                             "requests over instead of a single provider; --model_name then names a backend alias (see backend_pool.py).")
     parser.add_argument("--temperature", type=float,
                         help="Generation temperature. Overrides config.DEFAULT_TEMPERATURE.")
     parser.add_argument("--max_tokens", type=int,
                         help="Max tokens for generation. Overrides config.MAX_TOKENS.")
+    parser.add_argument("--max_tokens_mode", type=str, choices=list(token_budget.MAX_TOKENS_MODES), default=config.MAX_TOKENS_MODE,
+                        help="'fixed' reserves --max_tokens for every request; 'adaptive' sizes each request's max_tokens from the "
+                             "output lengths observed for its difficulty level and source length, with --max_tokens as the cap.")
+    parser.add_argument("--context_window", type=int, default=None,
+                        help="Context window of the model in tokens, for the pre-flight overflow check "
+                             "(default: the provider's entry in config.CONTEXT_WINDOW_TOKENS).")
 
     # Processing controls
     parser.add_argument("--limit_personas", type=int, default=0,
                         help="Limit the number of personas to process (0 for all).")
     parser.add_argument("--limit_tasks", type=int, default=0,
                         help="Limit the number of MTPE tasks per persona to process (0 for all).")
-
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker threads processing (persona, task) pairs in parallel (1 for sequential).")
+    parser.add_argument("--json_repair_attempts", type=int, default=config.MTPE_JSON_REPAIR_ATTEMPTS,
+                        help="Short follow-up calls asking the LLM to fix a response without a valid MTPE JSON object "
+                             "(0 to record such responses as errors right away).")
+
+    parser.add_argument("--stream", action="store_true", default=config.LLM_STREAMING,
+                        help="Stream responses, recording time-to-first-token and decode tokens/sec for each record.")
+    parser.add_argument("--schedule", type=str, choices=list(scheduling.SCHEDULING_POLICIES), default=config.SCHEDULING_POLICY,
+                        help="Request scheduling: 'fifo'; 'prompt_group' to pin each persona's system prompt to one client lane "
+                             "and warm the provider's prefix cache with one request before sending the rest of that persona's tasks; "
+                             "or 'longest_first' to issue the jobs expected to take longest first (results are written in that order).")
+    parser.add_argument("--hedge", action="store_true", default=config.HEDGING_ENABLED,
+                        help="Hedge slow requests: a call still running after --hedge_percentile of recent latencies for its difficulty "
+                             "level is duplicated on another backend (or connection) and the first response wins.")
+    parser.add_argument("--hedge_percentile", type=float, default=config.HEDGE_PERCENTILE,
+                        help="Latency percentile of recent calls after which a request is hedged (with --hedge).")
+    parser.add_argument("--hedge_budget", type=float, default=config.HEDGE_BUDGET_FRACTION,
+                        help="Maximum fraction of requests that may be hedged, capping the extra load (with --hedge).")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all MTPE tasks through the provider's Batch API (OpenAI-compatible providers only) "
+                             "and wait for the results, instead of making one request per task.")
+    parser.add_argument("--cache", type=str, choices=list(response_cache.CACHE_MODES), default=config.RESPONSE_CACHE_MODE,
+                        help="Disk-backed LLM response cache: 'off', 'read' (serve hits only) or 'readwrite' (serve and store).")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="Process only shard i of N ('i/N', 0-based), assigned by a stable hash of persona and task. "
+                             "Merge shard outputs with 'python scripts/sharding.py merge'.")
+    parser.add_argument("--resume", type=str, default=None,
+                        help="Path to an earlier MTPE output JSONL or Parquet file (or its .partial file). Skips (persona, task, provider, model) "
+                             "combinations that already succeeded and appends new results to the same file.")
+    parser.add_argument("--output_format", type=str, choices=list(result_writer.OUTPUT_FORMATS), default=config.OUTPUT_FORMAT,
+                        help="'normalized' also writes each persona and system prompt once to <output>.personas.jsonl / "
+                             "<output>.prompts.jsonl and adds persona_key / system_prompt_key to every result; 'parquet' writes the results, "
+                             "including the parsed MTPE fields, to a zstd-compressed Parquet file (requires pyarrow).")
+
+    parser.add_argument("--metrics_file", type=str, default=config.METRICS_FILE,
+                        help="Write Prometheus-format metrics to this file during the run (refreshed periodically).")
+    parser.add_argument("--metrics_port", type=int, default=config.METRICS_PORT,
+                        help="Serve Prometheus-format metrics on http://127.0.0.1:<port>/metrics during the run.")
     parser.add_argument("--log_level", type=str,
                         choices=["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"],
                         default=config.LOG_LEVEL,
@@ -99,6 +161,290 @@ def configure_translator_logging(log_level_str, log_file_path):
     logger.info(f"Translator MTPE logging configured. Level: {log_level_str}, File: {log_file_path}")
 
 
+def _iter_mtpe_jobs(translator_personas, mtpe_tasks_file, limit_tasks, tasks_per_persona, store=None, block_size=None):
+    """
+    Yields one job dict per (persona, MTPE task) pair.
+    Tasks are streamed from `mtpe_tasks_file` once, in blocks of `block_size` (default
+    config.MTPE_TASK_BLOCK_SIZE) tasks; each block is paired with every persona before the next is read,
+    so memory is bounded by the block and the file is read once however many personas there are.
+    Within a block, jobs are persona-major, so a persona's requests stay together (prompt_group scheduling).
+    `sequence_number` is the job's 1-based position in the persona-major grid (persona index x
+    `tasks_per_persona` + task index), whatever order the jobs are issued in.
+    `limit_tasks` (0 for all) caps the number of tasks processed for each persona.
+    With a prompt_store.PromptStore (normalized output), the persona and its system prompt are stored
+    once and the jobs carry their keys.
+    """
+    block_size = block_size or config.MTPE_TASK_BLOCK_SIZE
+    tasks = task_loader.iter_mtpe_tasks(mtpe_tasks_file, report=False)
+    if limit_tasks > 0:
+        tasks = itertools.islice(tasks, limit_tasks)
+        logger.info(f"Limiting tasks to {tasks_per_persona} per persona.")
+
+    block_start = 0
+    while True:
+        block = list(itertools.islice(tasks, block_size))
+        if not block:
+            break
+        logger.info(f"Processing MTPE tasks {block_start + 1}-{block_start + len(block)} of {tasks_per_persona} "
+                    f"for {len(translator_personas)} personas.")
+        for i, persona in enumerate(translator_personas):
+            persona_id = persona.get('persona_id', f"persona_index_{i}")
+            persona_name = persona.get('persona_name', 'Unknown Translator Persona')
+            logger.debug(f"Processing Persona ID: {persona_id} ({persona_name}) ({i+1}/{len(translator_personas)})")
+
+            system_prompt = construct_translator_system_prompt(persona)
+            stored_keys = {"system_prompt_hash": prompt_store.text_digest(system_prompt)}
+            if store is not None:
+                stored_keys.update(persona_key=store.add_persona(persona), system_prompt_key=store.add_prompt(system_prompt))
+
+            for j, task in enumerate(block, start=block_start):
+                yield {
+                    "sequence_number": i * tasks_per_persona + j + 1,
+                    "persona_index": i,
+                    "task_index": j,
+                    "tasks_for_persona": tasks_per_persona,
+                    "persona": persona,
+                    "persona_id": persona_id,
+                    "persona_name": persona_name,
+                    "task": task,
+                    "system_prompt": system_prompt,
+                    **stored_keys,
+                }
+        block_start += len(block)
+
+# Record fields identifying one unit of work, used to skip completed work when resuming
+RESUME_KEY_FIELDS = result_writer.MTPE_RECORD_KEY_FIELDS
+
+def _job_task_id(job: dict) -> str:
+    return job["task"].get('task_id', f"task_index_{job['task_index']}")
+
+def _cost_features(difficulty_level, source_text) -> tuple:
+    """(cost class, expected output tokens) of an MTPE task, for --schedule longest_first: a fixed part for the
+    think-aloud protocol and ratings plus a part growing with the source text, scaled by its difficulty."""
+    source_tokens = rate_limiter.estimate_tokens(source_text or "")
+    difficulty_factor = config.MTPE_DIFFICULTY_COST_FACTORS.get(difficulty_level, 1.0)
+    expected_tokens = config.MTPE_BASE_EXPECTED_OUTPUT_TOKENS + config.MTPE_EXPECTED_TOKENS_PER_SOURCE_TOKEN * source_tokens * difficulty_factor
+    return difficulty_level or "unknown", expected_tokens
+
+def _job_resume_key(job: dict, llm_settings: dict) -> tuple:
+    """Returns the RESUME_KEY_FIELDS values the job's result record will carry."""
+    return (job["persona_id"], _job_task_id(job), llm_settings["provider"], llm_settings["model_name"])
+
+def _build_user_prompt(task: dict) -> str:
+    return (
+        f"Chinese Source Text:\n{task.get('source_text_ch', '')}\n\n"
+        f"English Machine Translation (to be post-edited):\n{task.get('machine_translation_en', '')}"
+    )
+
+def _process_mtpe_job(job: dict, llm_settings: dict, total_expected_generations: int) -> dict:
+    """
+    Runs the LLM call and JSON parsing for one (persona, MTPE task) job and returns its result record.
+    Errors are captured in the record's 'generation_error' field rather than raised.
+    """
+    persona_id = job["persona_id"]
+    task_id = _job_task_id(job)
+
+    logger.info(f"  Processing MTPE Task ID: {task_id} ({job['task_index']+1}/{job['tasks_for_persona']}) for Persona ID: {persona_id} (Overall: {job['sequence_number']}/{total_expected_generations})")
+    logger.debug(f"    Persona Details: {job['persona']}")
+    logger.debug(f"    Task Details: {job['task']}")
+    # logger.debug(f"    System Prompt: {system_prompt}") # Can be very long
+
+    user_prompt = _build_user_prompt(job["task"])
+    logger.debug(f"    User Prompt (MTPE inputs):\n{user_prompt}")
+
+    # The output (JSON + TAP) grows with the source text; a limit that cuts it off leaves unparseable JSON
+    budget = llm_settings["token_budget"]
+    cost_class, expected_tokens = _cost_features(job["task"].get("difficulty_level"), job["task"].get("source_text_ch"))
+    request_plan = budget.plan(cost_class, expected_tokens, job["system_prompt"], user_prompt)
+    if request_plan["overflow"]:
+        logger.warning(f"    The prompt ({request_plan['prompt_tokens']} tokens) leaves no room for a response in the "
+                       f"{budget.context_window_tokens}-token context window; sending it with max_tokens {request_plan['max_tokens']} "
+                       f"for the provider to accept or reject.")
+
+    start_time = time.time()
+    try:
+        generation = budget.generate(
+            lambda max_tokens: llm_interface.generate_response_detailed(
+                system_prompt=job["system_prompt"],
+                user_prompt=user_prompt,
+                provider=llm_settings["provider"],
+                model_name=llm_settings["model_name"],
+                temperature=llm_settings["temperature"],
+                max_tokens=max_tokens,
+                stream=llm_settings["stream"],
+                latency_class=job["task"].get("difficulty_level"),
+                cache_max_tokens=budget.max_tokens
+            ),
+            cost_class, expected_tokens, request_plan)
+    except Exception as e:
+        logger.error(f"    Exception during LLM call for Persona ID: {persona_id}, Task ID: {task_id}: {e}", exc_info=True)
+        generation = {"content": None, "error": str(e), "attempts": 0, "cache_hit": False}
+    duration = time.time() - start_time
+
+    return _finish_mtpe_record(_build_mtpe_record(job, llm_settings, generation, duration), llm_settings)
+
+def _finish_mtpe_record(result_record: dict, llm_settings: dict) -> dict:
+    """Repairs an unparseable response if enabled and counts the record's parse outcome."""
+    if result_record["response_parse"] == "failed" and llm_settings["json_repair_attempts"] > 0:
+        _repair_mtpe_record(result_record, llm_settings)
+    if result_record["response_parse"]:
+        _parse_stats.record_outcome(result_record["response_parse"])
+        metrics.MTPE_RESPONSE_PARSES.inc(outcome=result_record["response_parse"])
+    return result_record
+
+def _build_mtpe_record(job: dict, llm_settings: dict, generation: dict, duration) -> dict:
+    """
+    Parses a generation result (see llm_interface.generate_response_detailed) and builds the job's result record.
+    `duration` is None when no per-request latency exists, e.g. for Batch API results.
+    """
+    persona_id = job["persona_id"]
+    task = job["task"]
+    task_id = _job_task_id(job)
+    took = f"{duration:.2f}s" if duration is not None else "an unmeasured time (batch)"
+    usage = generation.get("usage") or {}
+    timings = generation.get("timings") or {}
+
+    llm_response_raw = generation["content"]
+    llm_response_parsed = None
+    response_parse = None
+    generation_error = None
+
+    if llm_response_raw:
+        logger.info(f"    LLM call completed in {took}. Attempting to parse JSON response.")
+        logger.debug(f"    Raw LLM Response String: {llm_response_raw[:500]}...") # Log snippet
+        # The LLM is instructed to return a single JSON object, but models sometimes wrap it in
+        # markdown or prose, or run out of tokens mid-object; the first complete object is used.
+        llm_response_parsed, response_parse, problems = mtpe_response.parse_mtpe_response(llm_response_raw)
+        if problems:
+            logger.warning(f"    Unusable MTPE response for Persona ID: {persona_id}, Task ID: {task_id}: {'; '.join(problems)}")
+            logger.debug(f"    Full Raw LLM Response: {llm_response_raw}")
+            generation_error = f"ResponseParseError: {'; '.join(problems)}. Raw response kept in llm_response_raw_text."
+        else:
+            logger.info(f"    Successfully parsed LLM JSON response ({response_parse}).")
+    else:
+        generation_error = generation["error"] or "No content returned from LLM provider (see LLM interface logs for specific error)."
+        logger.warning(f"    {generation_error} for Persona ID: {persona_id}, Task ID: {task_id}. LLM call took {took}.")
+
+    result_record = {
+        "persona_id": persona_id,
+        "persona_name": job["persona_name"],
+        "task_id": task_id,
+        "source_text_ch": task.get('source_text_ch', ''),
+        "machine_translation_en": task.get('machine_translation_en', ''),
+        "domain": task.get("domain"),
+        "difficulty_level": task.get("difficulty_level"),
+        "llm_provider": llm_settings["provider"],
+        "llm_model": llm_settings["model_name"],
+        "llm_max_tokens": generation.get("max_tokens") or llm_settings["max_tokens"], # The output limit requested for this generation
+        "system_prompt_hash": job["system_prompt_hash"], # SHA-256 of the system prompt, stable across runs (the prompt itself is not stored)
+        "generation_timestamp_utc": datetime.datetime.utcnow().isoformat(),
+        "generation_time_seconds": round(duration, 2) if duration is not None else None,
+        "llm_attempts": generation["attempts"], # Provider calls made, including retries (0 if served from cache)
+        "prompt_tokens": usage.get("prompt_tokens"), # As reported by the provider; None if not reported
+        "cached_prompt_tokens": usage.get("cached_prompt_tokens"), # Prompt prefix tokens served from the provider's prompt cache
+        "llm_call_seconds": timings.get("call_seconds"), # The successful provider call alone, without queueing or earlier attempts
+        "time_to_first_token_seconds": timings.get("time_to_first_token_seconds"), # Streaming only
+        "output_tokens": timings.get("output_tokens"),
+        "tokens_per_second": timings.get("tokens_per_second"), # Decode throughput
+        "grid_position": job["sequence_number"] - 1, # Position in the persona-major grid; orders merged shard outputs
+        "generation_error": generation_error,
+        "llm_response_raw_text": llm_response_raw, # Store raw text
+        "response_parse": response_parse, # How the JSON object was obtained (see mtpe_response.PARSE_OUTCOMES); None without content
+        "json_repair_calls": 0,
+    }
+    if "persona_key" in job:
+        # Normalized output: the persona and system prompt live in the side tables (see prompt_store)
+        result_record["persona_key"] = job["persona_key"]
+        result_record["system_prompt_key"] = job["system_prompt_key"]
+    if generation.get("batch_id"):
+        result_record["batch_id"] = generation["batch_id"]
+    if generation.get("backend"):
+        result_record["llm_backend"] = generation["backend"] # The backend pool member of the last attempt
+    if generation.get("hedge"):
+        result_record["hedge_winner"] = generation["hedge"] # 'primary' or 'hedge', for hedged requests only
+    if llm_response_parsed: # Add parsed fields, also when incomplete, for inspection
+        result_record.update(llm_response_parsed)
+    return result_record
+
+def _repair_mtpe_record(result_record: dict, llm_settings: dict) -> dict:
+    """
+    Tries to fix a record whose response had no usable MTPE object with short follow-up calls
+    (see mtpe_response.REPAIR_SYSTEM_PROMPT) instead of regenerating it with the persona prompt.
+
+    A repair call sends only the broken response and its problems, at temperature 0, with max_tokens
+    sized to the response (at most the original max_tokens). Up to llm_settings["json_repair_attempts"]
+    calls are made. On success the parsed fields replace the broken ones and the error is cleared.
+    """
+    raw_text = result_record["llm_response_raw_text"]
+    _, _, problems = mtpe_response.parse_mtpe_response(raw_text)
+    repair_max_tokens = min(llm_settings["max_tokens"], token_budget.count_tokens(raw_text) + config.MTPE_REPAIR_TOKEN_MARGIN)
+    for _attempt in range(llm_settings["json_repair_attempts"]):
+        start_time = time.time()
+        try:
+            generation = llm_interface.generate_response_detailed(
+                system_prompt=mtpe_response.REPAIR_SYSTEM_PROMPT,
+                user_prompt=mtpe_response.build_repair_user_prompt(raw_text, problems),
+                provider=llm_settings["provider"],
+                model_name=llm_settings["model_name"],
+                temperature=0.0,
+                max_tokens=repair_max_tokens,
+                latency_class="json_repair",
+            )
+        except Exception as e:
+            logger.warning(f"    JSON repair call failed for Task ID: {result_record['task_id']}: {e}")
+            break
+        _parse_stats.record_repair_call(generation, time.time() - start_time)
+        result_record["json_repair_calls"] += 1
+        parsed, outcome, repair_problems = mtpe_response.parse_mtpe_response(generation["content"])
+        if outcome != "failed":
+            for field in mtpe_response.MTPE_RESPONSE_FIELDS:
+                result_record.pop(field, None) # Drop the broken response's partial fields
+            result_record.update(parsed)
+            result_record["response_parse"] = "repaired"
+            result_record["generation_error"] = None
+            logger.info(f"    Repaired the MTPE JSON for Task ID: {result_record['task_id']} with {result_record['json_repair_calls']} call(s).")
+            break
+        problems = repair_problems
+    return result_record
+
+def _process_mtpe_jobs_in_batch(mtpe_jobs, llm_settings: dict, request_file_path: str):
+    """
+    Runs all MTPE jobs through the provider's Batch API (see batch_client) as one batch and
+    yields their result records in job order once it finishes.
+    """
+    jobs = list(mtpe_jobs)
+    requests = [(str(job["sequence_number"]), job["system_prompt"], _build_user_prompt(job["task"])) for job in jobs]
+    results = batch_client.run_batch(requests, llm_settings["provider"], llm_settings["model_name"],
+                                     llm_settings["temperature"], llm_settings["max_tokens"], request_file_path)
+    for job in jobs:
+        # Repair calls, if any, go to the regular API: they are short, and waiting for another batch would take hours
+        yield _finish_mtpe_record(_build_mtpe_record(job, llm_settings, results[str(job["sequence_number"])], None), llm_settings)
+
+def _map_in_order(executor, fn, jobs, max_pending):
+    """
+    Like Executor.map, but submits jobs lazily: at most `max_pending` jobs are queued or running
+    ahead of the oldest unfinished one. Results are yielded in job order.
+    The number of pending jobs is reported as the generator_queue_depth metric.
+    """
+    pending = collections.deque()
+
+    def next_result():
+        result = pending.popleft().result()
+        metrics.GENERATOR_QUEUE_DEPTH.set(len(pending), driver="mtpe")
+        return result
+
+    try:
+        for job in jobs:
+            pending.append(executor.submit(fn, job))
+            metrics.GENERATOR_QUEUE_DEPTH.set(len(pending), driver="mtpe")
+            if len(pending) >= max_pending:
+                yield next_result()
+        while pending:
+            yield next_result()
+    finally:
+        for future in pending:
+            future.cancel()
+
 def main_translator():
     args = setup_translator_arg_parser()
 
@@ -124,20 +470,68 @@ def main_translator():
 
     logger.info("--- Starting Translator MTPE Agent Generation Process ---")
     logger.debug(f"CLI Arguments: {args}")
+    if args.shard and args.output_format == "parquet":
+        logger.error("--shard cannot be combined with --output_format parquet; 'sharding.py merge' reads JSONL shard outputs. Exiting.")
+        return
+    context_providers = None
+    if args.backend_pool or provider == backend_pool.POOL_PROVIDER:
+        if not args.backend_pool:
+            logger.error(f"Provider '{backend_pool.POOL_PROVIDER}' needs --backend_pool (or BACKEND_POOL_FILE). Exiting.")
+            return
+        if args.batch:
+            logger.error("--batch cannot be combined with a backend pool; the Batch API belongs to a single provider. Exiting.")
+            return
+        try:
+            pool = llm_interface.configure_backend_pool(args.backend_pool)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load backend pool {args.backend_pool}: {e}. Exiting.")
+            return
+        if provider != backend_pool.POOL_PROVIDER and args.provider:
+            logger.warning(f"--provider {args.provider} is ignored: requests go to the backends of {args.backend_pool}.")
+        provider = backend_pool.POOL_PROVIDER
+        if not args.model_name and len(pool.aliases) == 1:
+            model_name = pool.aliases[0]
+        if model_name not in pool.aliases:
+            logger.error(f"No backend in {args.backend_pool} serves model '{model_name}' (available: {', '.join(pool.aliases)}). Exiting.")
+            return
+        logger.info(f"Routing requests for '{model_name}' over {sum(b.alias == model_name for b in pool.backends)} backends "
+                    f"of {args.backend_pool} ({pool.routing} routing).")
+        context_providers = {b.provider for b in pool.backends if b.alias == model_name}
+    budget = token_budget.TokenBudget(max_tokens, min(token_budget.context_window(p, args.context_window) for p in context_providers or {provider}),
+                                      "fixed" if args.batch else args.max_tokens_mode)
+    if args.max_tokens_mode == "adaptive" and args.batch:
+        logger.warning("--max_tokens_mode adaptive is ignored in batch mode; every request reserves --max_tokens.")
+    logger.info(f"Token accounting: prompts counted with {token_budget.tokenizer_name()}, {budget.context_window_tokens}-token context window, "
+                f"max_tokens {'sized per request up to' if budget.mode == 'adaptive' else 'fixed at'} {max_tokens}.")
+    if args.hedge:
+        if args.batch:
+            logger.warning("--hedge is ignored in batch mode.")
+        else:
+            try:
+                llm_interface.configure_hedging(True, args.hedge_percentile, args.hedge_budget)
+            except ValueError as e:
+                logger.error(f"{e} Exiting.")
+                return
+            logger.info(f"Hedging requests still running after p{args.hedge_percentile:g} of recent latencies "
+                        f"(at most {args.hedge_budget:.0%} of requests).")
     logger.info(f"Effective LLM settings: Provider={provider}, Model={model_name}, Temp={temperature}, MaxTokens={max_tokens}")
 
     # Load translator personas
     logger.info(f"Loading translator personas from: {args.translator_personas_file}")
-    translator_personas = persona_loader.load_translator_personas(args.translator_personas_file)
+    translator_personas = persona_loader.load_translator_persona_table(args.translator_personas_file)
     if not translator_personas:
         logger.error("No translator personas loaded. Exiting.")
         return
 
-    # Load MTPE tasks
-    logger.info(f"Loading MTPE tasks from: {args.mtpe_tasks_file}")
-    tasks_data = task_loader.load_all_tasks(mtpe_tasks_path=args.mtpe_tasks_file, questions_path=None, questionnaire_path=None)
-    mtpe_tasks = tasks_data.get("mtpe_tasks", [])
-    if not mtpe_tasks:
+    # MTPE tasks are streamed from the file in blocks while jobs are generated. This first pass only validates
+    # the file and counts its tasks (up to --limit_tasks), for progress reporting and grid positions.
+    logger.info(f"Scanning MTPE tasks in: {args.mtpe_tasks_file}")
+    try:
+        task_count = sum(1 for _ in itertools.islice(task_loader.iter_mtpe_tasks(args.mtpe_tasks_file), args.limit_tasks or None))
+    except Exception as e:
+        logger.error(f"Error reading MTPE tasks from {args.mtpe_tasks_file}: {e}", exc_info=True)
+        return
+    if not task_count:
         logger.error("No MTPE tasks loaded. Exiting.")
         return
 
@@ -146,142 +540,145 @@ def main_translator():
         translator_personas = translator_personas[:args.limit_personas]
         logger.info(f"Limited processing to {len(translator_personas)} personas.")
 
-    logger.info(f"Loaded {len(translator_personas)} translator personas and {len(mtpe_tasks)} MTPE tasks.")
-
-    all_mtpe_results = []
-    total_expected_generations = len(translator_personas) * (len(mtpe_tasks) if args.limit_tasks == 0 else min(args.limit_tasks, len(mtpe_tasks)))
-    current_generation_count = 0
-
-    for i, persona in enumerate(translator_personas):
-        persona_id = persona.get('persona_id', f"persona_index_{i}")
-        persona_name = persona.get('persona_name', 'Unknown Translator Persona')
-        logger.info(f"Processing Persona ID: {persona_id} ({persona_name}) ({i+1}/{len(translator_personas)})")
-
-        system_prompt = construct_translator_system_prompt(persona)
-
-        tasks_for_this_persona = mtpe_tasks
-        if args.limit_tasks > 0:
-            tasks_for_this_persona = mtpe_tasks[:args.limit_tasks]
-            logger.info(f"  Limiting tasks to {len(tasks_for_this_persona)} for this persona.")
-
-        for j, task in enumerate(tasks_for_this_persona):
-            current_generation_count += 1
-            task_id = task.get('task_id', f"task_index_{j}")
-            source_text_ch = task.get('source_text_ch', '')
-            machine_translation_en = task.get('machine_translation_en', '')
-
-            logger.info(f"  Processing MTPE Task ID: {task_id} ({j+1}/{len(tasks_for_this_persona)}) for Persona ID: {persona_id} (Overall: {current_generation_count}/{total_expected_generations})")
-            logger.debug(f"    Persona Details: {persona}")
-            logger.debug(f"    Task Details: {task}")
-            # logger.debug(f"    System Prompt: {system_prompt}") # Can be very long
-
-            user_prompt = (
-                f"Chinese Source Text:\n{source_text_ch}\n\n"
-                f"English Machine Translation (to be post-edited):\n{machine_translation_en}"
-            )
-            logger.debug(f"    User Prompt (MTPE inputs):\n{user_prompt}")
-
-            llm_response_raw = None
-            llm_response_parsed = None
-            generation_error = None
-            duration = 0.0
-
-            start_time = time.time()
-            try:
-                llm_response_raw = llm_interface.generate_response(
-                    system_prompt=system_prompt,
-                    user_prompt=user_prompt,
-                    provider=provider,
-                    model_name=model_name,
-                    temperature=temperature,
-                    max_tokens=max_tokens # Ensure this is adequate for JSON + TAP
-                )
-                duration = time.time() - start_time
-
-                if llm_response_raw:
-                    logger.info(f"    LLM call completed in {duration:.2f}s. Attempting to parse JSON response.")
-                    logger.debug(f"    Raw LLM Response String: {llm_response_raw[:500]}...") # Log snippet
-                    try:
-                        # The LLM is instructed to return a single JSON string.
-                        # Sometimes, models might wrap it in backticks or add explanations.
-                        # Basic cleanup:
-                        cleaned_response_str = llm_response_raw.strip()
-                        if cleaned_response_str.startswith("```json"):
-                            cleaned_response_str = cleaned_response_str[7:]
-                        if cleaned_response_str.endswith("```"):
-                            cleaned_response_str = cleaned_response_str[:-3]
-                        cleaned_response_str = cleaned_response_str.strip()
-
-                        llm_response_parsed = json.loads(cleaned_response_str)
-                        logger.info("    Successfully parsed LLM JSON response.")
-                    except json.JSONDecodeError as jde:
-                        logger.error(f"    Failed to parse JSON from LLM response: {jde}")
-                        logger.debug(f"    Full Raw LLM Response causing JSON error: {llm_response_raw}")
-                        generation_error = f"JSONDecodeError: {jde}. Raw response logged."
-                        # Keep llm_response_raw for inspection
-                else:
-                    generation_error = "No content returned from LLM provider (see LLM interface logs for specific error)."
-                    logger.warning(f"    {generation_error} for Persona ID: {persona_id}, Task ID: {task_id}. LLM call took {duration:.2f}s.")
-
-            except Exception as e:
-                duration = time.time() - start_time
-                logger.error(f"    Exception during LLM call for Persona ID: {persona_id}, Task ID: {task_id}: {e}", exc_info=True)
-                generation_error = str(e)
-
-            result_record = {
-                "persona_id": persona_id,
-                "persona_name": persona_name,
-                "task_id": task_id,
-                "source_text_ch": source_text_ch,
-                "machine_translation_en": machine_translation_en,
-                "domain": task.get("domain"),
-                "difficulty_level": task.get("difficulty_level"),
-                "llm_provider": provider,
-                "llm_model": model_name,
-                "system_prompt_hash": hash(system_prompt), # To save space, log full prompt separately if needed
-                "generation_timestamp_utc": datetime.datetime.utcnow().isoformat(),
-                "generation_time_seconds": round(duration, 2),
-                "generation_error": generation_error,
-                "llm_response_raw_text": llm_response_raw, # Store raw text
-            }
-            if llm_response_parsed: # Add parsed fields if successful
-                result_record.update(llm_response_parsed)
-
-            all_mtpe_results.append(result_record)
-
-            # Optional delay
-            # time.sleep(1)
-
-    # Save all generated MTPE data
-    if all_mtpe_results:
+    logger.info(f"Loaded {len(translator_personas)} translator personas and {task_count} MTPE tasks per persona.")
+
+    total_expected_generations = len(translator_personas) * task_count
+    llm_settings = {
+        "provider": provider,
+        "model_name": model_name,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": args.stream,
+        "token_budget": budget,
+        "json_repair_attempts": args.json_repair_attempts,
+    }
+    shard = sharding.parse_shard_spec(args.shard) if args.shard else None
+    # Results are streamed to disk as they complete instead of being collected in memory.
+    if args.resume:
+        output_filepath = result_writer.final_output_path(args.resume)
+        if output_filepath.endswith(result_writer.PARQUET_EXTENSION) != (args.output_format == "parquet"):
+            logger.error(f"Cannot resume {args.resume} with --output_format {args.output_format}; use the format of the earlier run. Exiting.")
+            return
+    else:
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_filename = f"generated_translator_mtpe_results_{timestamp}.jsonl"
+        output_filename = f"generated_translator_mtpe_results_{timestamp}{sharding.shard_filename_suffix(shard)}{result_writer.output_file_extension(args.output_format)}"
         output_filepath = os.path.join(args.output_dir, output_filename)
 
-        try:
-            os.makedirs(args.output_dir, exist_ok=True)
-            with open(output_filepath, 'w', encoding='utf-8') as f_out:
-                for entry in all_mtpe_results:
-                    f_out.write(json.dumps(entry) + '\n')
-            logger.info(f"Successfully saved {len(all_mtpe_results)} MTPE results to {output_filepath}")
-        except Exception as e:
-            logger.error(f"Failed to save MTPE results to {output_filepath}: {e}", exc_info=True)
-    else:
-        logger.warning("No MTPE data was generated to save.")
+    store = None
+    if args.output_format == "normalized":
+        store = prompt_store.PromptStore(output_filepath)
+        logger.info(f"Normalized output: personas and system prompts are stored once in {output_filepath}{prompt_store.PERSONAS_SUFFIX} "
+                    f"and {output_filepath}{prompt_store.PROMPTS_SUFFIX}.")
+    mtpe_jobs = _iter_mtpe_jobs(translator_personas, args.mtpe_tasks_file, args.limit_tasks, task_count, store)
+    if shard:
+        logger.info(f"Processing shard {shard[0]} of {shard[1]} (0-based).")
+        mtpe_jobs = (job for job in mtpe_jobs if sharding.in_shard(job["persona_id"], _job_task_id(job), shard))
+
+    if args.cache != "off":
+        llm_interface.configure_response_cache(args.cache)
+    if args.schedule != "fifo":
+        llm_interface.configure_scheduling(args.schedule)
+
+    if args.resume:
+        completed_keys = result_writer.load_completed_keys(args.resume, RESUME_KEY_FIELDS, error_field="generation_error")
+        logger.info(f"Resuming into {output_filepath}: {len(completed_keys)} of {total_expected_generations} generations already completed.")
+        mtpe_jobs = (job for job in mtpe_jobs if _job_resume_key(job, llm_settings) not in completed_keys)
+
+    exporter = None
+    if args.metrics_file or args.metrics_port:
+        exporter = metrics.MetricsExporter(textfile_path=args.metrics_file, port=args.metrics_port)
+
+    cost_model = None
+    if args.schedule == "longest_first" and not args.batch:
+        cost_model = scheduling.JobCostModel()
+        logger.info("Issuing the MTPE jobs expected to take longest first; results are written in that order.")
+        mtpe_jobs = scheduling.order_longest_first(
+            mtpe_jobs, lambda job: cost_model.estimate(*_cost_features(job["task"].get("difficulty_level"), job["task"].get("source_text_ch"))))
 
+    try:
+        with result_writer.create_result_writer(output_filepath, args.output_format, result_writer.MTPE_PARQUET_COLUMNS,
+                                                append=bool(args.resume)) as writer:
+            def write_record(result_record):
+                writer.write(result_record)
+                metrics.GENERATOR_RECORDS.inc(driver="mtpe", status="error" if result_record.get("generation_error") else "success")
+                if cost_model is not None and result_record.get("llm_attempts"):
+                    cost_model.observe(*_cost_features(result_record["difficulty_level"], result_record["source_text_ch"]),
+                                       result_record.get("llm_call_seconds") or result_record.get("generation_time_seconds"))
+
+            if args.batch:
+                logger.info("Submitting the MTPE grid through the provider's Batch API.")
+                for result_record in _process_mtpe_jobs_in_batch(mtpe_jobs, llm_settings, output_filepath + ".batch_input.jsonl"):
+                    write_record(result_record)
+            elif args.workers > 1:
+                # Threads rather than processes: each job is dominated by waiting on the provider,
+                # and the JSON cleanup/parse step is cheap relative to the network call.
+                logger.info(f"Fanning out {total_expected_generations} MTPE generations across {args.workers} worker threads.")
+                with concurrent.futures.ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="mtpe") as executor:
+                    for result_record in _map_in_order(executor, lambda job: _process_mtpe_job(job, llm_settings, total_expected_generations),
+                                                       mtpe_jobs, max_pending=args.workers * 4):
+                        write_record(result_record)
+            else:
+                for job in mtpe_jobs:
+                    write_record(_process_mtpe_job(job, llm_settings, total_expected_generations))
+
+        if writer.records_written:
+            logger.info(f"Successfully saved {writer.records_written} MTPE results to {output_filepath}")
+        else:
+            logger.warning("No MTPE data was generated to save.")
+    except Exception as e:
+        logger.error(f"MTPE run aborted; completed results (if any) remain in {output_filepath}{result_writer.PARTIAL_SUFFIX}: {e}", exc_info=True)
+    finally:
+        if store is not None:
+            store.close()
+            store_stats = store.stats()
+            logger.info(f"Prompt store: {store_stats['personas']} personas and {store_stats['prompts']} system prompts "
+                        f"({store_stats['personas_written']} and {store_stats['prompts_written']} newly written).")
+
+    parse_stats = _parse_stats.summary()
+    if parse_stats["responses"]:
+        logger.info(f"MTPE responses: {parse_stats['json']} valid JSON, {parse_stats['extracted']} extracted from surrounding text, "
+                    f"{parse_stats['repaired']} repaired, {parse_stats['failed']} unusable "
+                    f"(first-pass failure rate {parse_stats['first_pass_failure_rate']:.1%}). "
+                    f"Repair cost: {parse_stats['repair_calls']} calls, {parse_stats['repair_prompt_tokens']} prompt + "
+                    f"{parse_stats['repair_output_tokens']} output tokens, {parse_stats['repair_seconds']}s.")
+
+    cache_stats = llm_interface.get_cache_stats()
+    if cache_stats:
+        logger.info(f"Response cache ({cache_stats['mode']}): {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                    f"{cache_stats['writes']} writes, {cache_stats['evictions']} evictions.")
+        llm_interface.configure_response_cache("off") # Closes the cache database
+
+    scheduling_stats = llm_interface.get_scheduling_stats()
+    if scheduling_stats:
+        logger.info(f"Prompt-group scheduling: {scheduling_stats['prompt_groups']} prompt groups over {scheduling_stats['lanes']} lanes, "
+                    f"{scheduling_stats['warmup_waits']} requests waited for a prefix warm-up.")
+        llm_interface.configure_scheduling("fifo")
+    if cost_model is not None:
+        cost_stats = cost_model.stats()
+        logger.info(f"Longest-first scheduling: {cost_stats['observations']} latencies observed; "
+                    f"seconds per expected token by difficulty: {cost_stats['seconds_per_token']}")
+    pool_stats = llm_interface.get_backend_pool_stats()
+    if pool_stats:
+        backend_summary = "; ".join(f"{name}: {stats['calls']} calls, {stats['failures']} failed, circuit {stats['circuit']}"
+                                    for name, stats in pool_stats["backends"].items())
+        logger.info(f"Backend pool ({pool_stats['routing']} routing, {pool_stats['capacity_waits']} requests waited for a free backend): "
+                    f"{backend_summary}")
+    budget_stats = budget.stats()
+    logger.info(f"Token accounting ({budget_stats['mode']} max_tokens): {budget_stats['requests']} requests reserved "
+                f"{budget_stats['mean_reserved_tokens']} prompt + output tokens on average; {budget_stats['sized_requests']} sized, "
+                f"{budget_stats['escalations']} repeated with the full limit, {budget_stats['clamped']} limited by the context window, "
+                f"{budget_stats['overflows']} overflowed it ({budget_stats['splits']} split).")
+    hedging_stats = llm_interface.get_hedging_stats()
+    if hedging_stats:
+        logger.info(f"Hedging: {hedging_stats['hedges_sent']} of {hedging_stats['requests']} requests hedged "
+                    f"({hedging_stats['hedge_wins']} won by the hedge); {hedging_stats['skipped_budget']} skipped for budget, "
+                    f"{hedging_stats['skipped_no_target']} for lack of a free backend.")
+        llm_interface.configure_hedging(False)
+
+    if exporter is not None:
+        exporter.stop() # Writes the final metrics file
+    llm_interface.close_clients() # Release pooled provider connections
     logger.info("--- Translator MTPE Agent Generation Process Finished ---")
 
 if __name__ == '__main__':
-    # Pandas check (mainly for pd.isna() in construct_translator_system_prompt)
-    try:
-        import pandas
-        logger.debug("Pandas library found.")
-    except ImportError:
-        # This is not a critical error if persona_loader doesn't use pandas for CSV reading
-        # and if NaN values are not expected in a way that breaks string conversion.
-        # construct_translator_system_prompt uses pd.isna, so it's a dependency.
-        print("CRITICAL ERROR: Pandas library not found, but it is required for this script (e.g., for pd.isna()). Please install it.")
-        logger.critical("Pandas library not found, but it is required. Exiting.")
-        sys.exit(1) # Exit if pandas is missing, as it's used in imported function
-
     main_translator()
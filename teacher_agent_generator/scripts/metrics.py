@@ -0,0 +1,266 @@
+# teacher_agent_generator/scripts/metrics.py
+import bisect
+import http.server
+import logging
+import os
+import threading
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+
+# Latency buckets (seconds) covering fast cache-warm calls up to multi-minute long generations
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, labelvalues, extra=None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.extend(f'{name}="{_escape_label_value(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base class for a labelled metric family. Label values are passed as keyword arguments."""
+
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, exported as <name>_bucket / <name>_sum / <name>_count series."""
+
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            state["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted((key, {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]})
+                           for key, s in self._values.items())
+        for labelvalues, state in items:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets + (float('inf'),), state["counts"]):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", _format_value(upper_bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """A set of metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# --- LLM calls (recorded by llm_interface) ---
+LLM_REQUESTS = REGISTRY.register(Counter(
+    "llm_requests_total", "Generation requests by outcome (success, error, cache_hit).", ("provider", "model", "outcome")))
+LLM_PROVIDER_CALLS = REGISTRY.register(Counter(
+    "llm_provider_calls_total", "Provider calls made, including retries.", ("provider", "model")))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries_total", "Provider calls that were retries of a failed attempt.", ("provider", "model")))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "llm_errors_total", "Failed provider calls by kind (retryable, fatal, throttled, circuit_open).", ("provider", "model", "kind")))
+LLM_TOKENS = REGISTRY.register(Counter(
+    "llm_tokens_total", "Tokens reported by the provider's usage fields (prompt, completion, cached_prompt).", ("provider", "model", "type")))
+LLM_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "llm_request_duration_seconds", "End-to-end generation request latency, including queueing and retries.", ("provider", "model")))
+LLM_CALL_SECONDS = REGISTRY.register(Histogram(
+    "llm_call_duration_seconds", "Latency of successful provider calls alone.", ("provider", "model")))
+LLM_TTFT_SECONDS = REGISTRY.register(Histogram(
+    "llm_time_to_first_token_seconds", "Time to first streamed token of successful provider calls.", ("provider", "model")))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "llm_in_flight_requests", "Provider calls currently in flight.", ("provider",)))
+LLM_BACKEND_CALLS = REGISTRY.register(Counter(
+    "llm_backend_calls_total", "Provider calls routed to each backend of a backend pool, by outcome (success, error, cancelled).",
+    ("backend", "outcome")))
+LLM_HEDGES = REGISTRY.register(Counter(
+    "llm_hedges_total", "Hedged requests, by which call won (primary, hedge).", ("provider", "model", "winner")))
+
+# --- Drivers (recorded by main_generator and main_translator_mtpe) ---
+GENERATOR_RECORDS = REGISTRY.register(Counter(
+    "generator_records_total", "Output records written, by status (success, error).", ("driver", "status")))
+GENERATOR_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "generator_queue_depth", "Units of work scheduled but not yet written (reorder window occupancy).", ("driver",)))
+MTPE_RESPONSE_PARSES = REGISTRY.register(Counter(
+    "mtpe_response_parses_total", "MTPE responses by how their JSON was obtained (json, extracted, repaired, failed).", ("outcome",)))
+
+
+def record_usage(provider, model, usage):
+    """Adds a provider usage dict (prompt_tokens, completion_tokens, cached_prompt_tokens) to llm_tokens_total."""
+    if not usage:
+        return
+    for token_type, field in (("prompt", "prompt_tokens"), ("completion", "completion_tokens"), ("cached_prompt", "cached_prompt_tokens")):
+        if usage.get(field):
+            LLM_TOKENS.inc(usage[field], provider=provider, model=model, type=token_type)
+
+def write_textfile(path, registry=REGISTRY):
+    """Writes the registry atomically to `path` (e.g. for node_exporter's textfile collector)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(registry.render())
+    os.replace(tmp_path, path)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes would otherwise be logged to stderr every few seconds
+
+
+class MetricsExporter:
+    """
+    Exports the registry while a run is in progress: serves /metrics over HTTP on `port`, and/or
+    rewrites `textfile_path` every `interval_seconds`. stop() writes the textfile one last time.
+    """
+
+    def __init__(self, textfile_path=None, port=None, interval_seconds=None, host="127.0.0.1", registry=REGISTRY):
+        self.textfile_path = textfile_path
+        self.interval_seconds = interval_seconds or config.METRICS_EXPORT_INTERVAL_SECONDS
+        self.registry = registry
+        self._stop_event = threading.Event()
+        self._server = None
+        self._threads = []
+        if port:
+            handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+            self._server = http.server.ThreadingHTTPServer((host, port), handler)
+            self._start_thread(self._server.serve_forever, "metrics-http")
+            logging.info(f"Serving metrics on http://{host}:{self._server.server_address[1]}/metrics")
+        if textfile_path:
+            self._start_thread(self._write_periodically, "metrics-textfile")
+            logging.info(f"Writing metrics to {textfile_path} every {self.interval_seconds}s")
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _write_periodically(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            try:
+                write_textfile(self.textfile_path, self.registry)
+            except OSError as e:
+                logging.warning(f"Could not write metrics file {self.textfile_path}: {e}")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        if self.textfile_path:
+            write_textfile(self.textfile_path, self.registry)
+
+
+if __name__ == '__main__':
+    print("Metrics Module - Test Run")
+    LLM_REQUESTS.inc(provider="ollama", model="llama3", outcome="success")
+    LLM_REQUEST_SECONDS.observe(0.7, provider="ollama", model="llama3")
+    LLM_REQUEST_SECONDS.observe(3.2, provider="ollama", model="llama3")
+    record_usage("ollama", "llama3", {"prompt_tokens": 412, "completion_tokens": 87, "cached_prompt_tokens": None})
+    GENERATOR_QUEUE_DEPTH.set(12, driver="teacher")
+    print(REGISTRY.render())
+    print("Metrics Module - Test Run Finished")
@@ -0,0 +1,504 @@
+# teacher_agent_generator/scripts/mock_llm_server.py
+import argparse
+import collections
+import contextlib
+import hashlib
+import http.server
+import json
+import logging
+import math
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+_FILLER_WORDS = ("students", "learning", "feedback", "practice", "classroom", "project", "discussion", "assessment",
+                 "engagement", "curiosity", "context", "example", "reflection", "skills", "progress", "support")
+
+
+class MockServerSettings:
+    """
+    Behaviour of the mock LLM server.
+
+    Latency is modelled as time to first token (prefill) plus decode time:
+    ttft_ms is drawn from `latency_distribution` ('fixed', 'uniform' over [0.5x, 1.5x], or
+    'lognormal' with `latency_sigma`), then each of the response's tokens takes 1/tokens_per_second.
+    A system prompt seen recently is treated as a prefix-cache hit: its prefill takes
+    `cached_ttft_factor` of the normal time and is reported as cached prompt tokens.
+    A `malformed_rate` fraction of MTPE JSON responses is wrapped in prose or cut off mid-object.
+    With `max_parallel`, at most that many chat requests are generated at once and the rest queue,
+    like an Ollama host with OLLAMA_NUM_PARALLEL; 0 means no limit.
+    A `stall_rate` fraction of chat requests stalls for `stall_seconds` before the first token, like a
+    request stuck behind a model reload or a slow host: the tail that hedged requests cut.
+    """
+
+    def __init__(self, ttft_ms=200.0, latency_distribution="lognormal", latency_sigma=0.5, tokens_per_second=80.0,
+                 response_tokens=(50, 200), error_rate=0.0, throttle_rate=0.0, cached_ttft_factor=0.3,
+                 prefix_cache_size=256, malformed_rate=0.0, max_parallel=0, stall_rate=0.0, stall_seconds=5.0, seed=None):
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution '{latency_distribution}'. Expected one of: {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.ttft_ms = ttft_ms
+        self.latency_distribution = latency_distribution
+        self.latency_sigma = latency_sigma
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = response_tokens
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.cached_ttft_factor = cached_ttft_factor
+        self.prefix_cache_size = prefix_cache_size
+        self.malformed_rate = malformed_rate
+        self.max_parallel = max_parallel
+        self.stall_rate = stall_rate
+        self.stall_seconds = stall_seconds
+        self.seed = seed
+
+
+class _MockBackend:
+    """Thread-safe state shared by all request handlers: random source, prefix cache, files and batches."""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._random = random.Random(settings.seed)
+        self._lock = threading.Lock()
+        self._prefix_cache = collections.OrderedDict()
+        self.files = {}
+        self.batches = {}
+        self.requests_served = 0
+        self._generation_slots = threading.Semaphore(settings.max_parallel) if settings.max_parallel > 0 else None
+
+    def generation_slot(self):
+        """Held while a chat response is generated; waits while `max_parallel` responses are in progress."""
+        return self._generation_slots if self._generation_slots is not None else contextlib.nullcontext()
+
+    def _uniform(self, low, high):
+        with self._lock:
+            return self._random.uniform(low, high)
+
+    def sample_failure(self):
+        """Returns (status, message) for an injected failure, or None."""
+        with self._lock:
+            roll = self._random.random()
+        if roll < self.settings.throttle_rate:
+            return 429, "Rate limit reached (mock throttling)."
+        if roll < self.settings.throttle_rate + self.settings.error_rate:
+            return 503, "Service unavailable (mock error)."
+        return None
+
+    def sample_malformation(self):
+        """Returns 'prose', 'truncated' or None, with `malformed_rate` split evenly between the two."""
+        with self._lock:
+            roll = self._random.random()
+        if roll >= self.settings.malformed_rate:
+            return None
+        return "prose" if roll < self.settings.malformed_rate / 2 else "truncated"
+
+    def sample_stall_seconds(self):
+        """Returns `stall_seconds` for a stalled request (with probability `stall_rate`), else 0."""
+        with self._lock:
+            roll = self._random.random()
+        return self.settings.stall_seconds if roll < self.settings.stall_rate else 0.0
+
+    def sample_ttft_seconds(self, cached):
+        settings = self.settings
+        mean = settings.ttft_ms / 1000.0
+        if settings.latency_distribution == "uniform":
+            ttft = self._uniform(0.5 * mean, 1.5 * mean)
+        elif settings.latency_distribution == "lognormal":
+            with self._lock:
+                # mu chosen so that the distribution's mean equals `mean`
+                ttft = self._random.lognormvariate(math.log(max(mean, 1e-6)) - settings.latency_sigma ** 2 / 2, settings.latency_sigma)
+        else:
+            ttft = mean
+        return ttft * (settings.cached_ttft_factor if cached else 1.0)
+
+    def sample_response_tokens(self):
+        low, high = self.settings.response_tokens
+        with self._lock:
+            return self._random.randint(low, high)
+
+    def check_prefix_cache(self, system_prompt):
+        """Records the system prompt as cached and returns True if it already was."""
+        digest = hashlib.sha256(system_prompt.encode('utf-8')).hexdigest()
+        with self._lock:
+            self.requests_served += 1
+            hit = digest in self._prefix_cache
+            self._prefix_cache[digest] = True
+            self._prefix_cache.move_to_end(digest)
+            while len(self._prefix_cache) > self.settings.prefix_cache_size:
+                self._prefix_cache.popitem(last=False)
+        return hit
+
+    def filler_text(self, token_count):
+        with self._lock:
+            return " ".join(self._random.choice(_FILLER_WORDS) for _ in range(max(1, token_count)))
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def _count_completion_tokens(content):
+    """Counts each generated word as one token, so decode time follows --response_tokens."""
+    return max(1, len(content.split()))
+
+def _build_content(backend, system_prompt, user_prompt, token_count):
+    """
+    Builds a response shaped like what the drivers expect: an answers object for packed questionnaire
+    prompts, the MTPE JSON object for translator prompts, and plain text otherwise.
+    """
+    item_ids = re.findall(r"^Item id: (\S+)$", user_prompt, flags=re.MULTILINE)
+    if item_ids:
+        return json.dumps({"answers": {item_id: str(1 + i % 5) for i, item_id in enumerate(item_ids)}})
+    if "mtpe_output_en" in system_prompt:
+        content = json.dumps({
+            "mtpe_output_en": backend.filler_text(max(5, token_count // 4)),
+            "think_aloud_protocol": backend.filler_text(max(5, token_count - token_count // 4)),
+            "estimated_time_minutes": 10,
+            "perceived_mt_quality_rating": 3,
+            "confidence_rating_of_mtpe_output": 4,
+            "simulated_edit_categories": ["Fluency", "Terminology"],
+            "linguistic_error_simulation_notes": "N/A",
+        }, ensure_ascii=False)
+        malformation = backend.sample_malformation()
+        if malformation == "prose":
+            return f"Sure! Here is my post-edit:\n```json\n{content}\n```\nLet me know if you need anything else."
+        if malformation == "truncated":
+            return content[:len(content) * 3 // 4] # As if max_tokens cut the response short
+        return content
+    return backend.filler_text(token_count)
+
+def _split_into_chunks(text, pieces):
+    """Splits `text` into about `pieces` consecutive chunks that join back to the original text."""
+    pieces = max(1, min(pieces, len(text)))
+    size = math.ceil(len(text) / pieces)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class _MockRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so client connection pooling behaves as with a real provider
+    backend = None # Set on the per-server subclass
+
+    def log_message(self, format, *args):
+        logging.debug("mock_llm_server: " + format % args)
+
+    # --- Plumbing ---
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_bytes(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        data = data.encode('utf-8') if isinstance(data, str) else data
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _send_error_for(self, api, status, message):
+        if api == "ollama":
+            self._send_json(status, {"error": message})
+        else:
+            error_type = "rate_limit_error" if status == 429 else "server_error"
+            self._send_json(status, {"error": {"message": message, "type": error_type, "code": error_type}})
+
+    # --- Routing ---
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "mock-model", "model": "mock-model", "size": 0}]})
+        elif path in ("/v1/models", "/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model", "owned_by": "mock"}]})
+        elif re.fullmatch(r"(/v1)?/batches/[\w-]+", path):
+            self._get_batch(path.rsplit('/', 1)[-1])
+        elif re.fullmatch(r"(/v1)?/files/[\w-]+/content", path):
+            self._get_file_content(path.split('/')[-2])
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+
+    def do_POST(self):
+        path = self.path.split('?')[0]
+        body = self._read_body()
+        if path == "/api/chat":
+            self._chat("ollama", json.loads(body or b"{}"))
+        elif path in ("/v1/chat/completions", "/chat/completions"):
+            self._chat("openai", json.loads(body or b"{}"))
+        elif path in ("/v1/files", "/files"):
+            self._create_file(body)
+        elif path in ("/v1/batches", "/batches"):
+            self._create_batch(json.loads(body or b"{}"))
+        else:
+            self._send_json(404, {"error": f"Unknown path {path}"})
+
+    # --- Chat ---
+
+    def _chat(self, api, request):
+        backend = self.backend
+        failure = backend.sample_failure()
+        if failure:
+            time.sleep(backend.sample_ttft_seconds(cached=False) * 0.1) # Failures come back quickly
+            self._send_error_for(api, *failure)
+            return
+
+        messages = request.get("messages") or []
+        system_prompt = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user_prompt = "".join(m.get("content", "") for m in messages if m.get("role") == "user")
+        cached = backend.check_prefix_cache(system_prompt) if system_prompt else False
+        prompt_tokens = _estimate_tokens(system_prompt) + _estimate_tokens(user_prompt)
+        cached_tokens = _estimate_tokens(system_prompt) if cached else 0
+
+        token_count = backend.sample_response_tokens()
+        max_tokens = request.get("max_tokens") or (request.get("options") or {}).get("num_predict")
+        if max_tokens and max_tokens > 0:
+            token_count = min(token_count, max_tokens)
+        content = _build_content(backend, system_prompt, user_prompt, token_count)
+        completion_tokens = _count_completion_tokens(content)
+        ttft = backend.sample_ttft_seconds(cached) + backend.sample_stall_seconds()
+        decode_seconds = completion_tokens / backend.settings.tokens_per_second if backend.settings.tokens_per_second > 0 else 0.0
+        model = request.get("model", "mock-model")
+
+        with backend.generation_slot():
+            if api == "ollama":
+                self._ollama_chat(request, model, content, ttft, decode_seconds, prompt_tokens - cached_tokens, completion_tokens)
+            else:
+                self._openai_chat(request, model, content, ttft, decode_seconds, prompt_tokens, completion_tokens, cached_tokens)
+
+    def _ollama_chat(self, request, model, content, ttft, decode_seconds, prompt_eval_count, eval_count):
+        final = {
+            "model": model, "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": ""}, "done": True, "done_reason": "stop",
+            "total_duration": int((ttft + decode_seconds) * 1e9), "load_duration": 0,
+            "prompt_eval_count": prompt_eval_count, "prompt_eval_duration": int(ttft * 1e9),
+            "eval_count": eval_count, "eval_duration": int(decode_seconds * 1e9),
+        }
+        if request.get("stream", True) is False:
+            time.sleep(ttft + decode_seconds)
+            final["message"]["content"] = content
+            self._send_json(200, final)
+            return
+        time.sleep(ttft)
+        self._start_chunked("application/x-ndjson")
+        chunks = _split_into_chunks(content, max(1, eval_count // 8))
+        for piece in chunks:
+            time.sleep(decode_seconds / len(chunks))
+            self._write_chunk(json.dumps({"model": model, "created_at": final["created_at"],
+                                          "message": {"role": "assistant", "content": piece}, "done": False}) + "\n")
+        self._write_chunk(json.dumps(final) + "\n")
+        self._end_chunked()
+
+    def _openai_chat(self, request, model, content, ttft, decode_seconds, prompt_tokens, completion_tokens, cached_tokens):
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_cache_hit_tokens": cached_tokens, "prompt_cache_miss_tokens": prompt_tokens - cached_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        if not request.get("stream"):
+            time.sleep(ttft + decode_seconds)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+        time.sleep(ttft)
+        self._start_chunked("text/event-stream")
+
+        def event(choices, extra=None):
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": choices}
+            payload.update(extra or {})
+            self._write_chunk(f"data: {json.dumps(payload)}\n\n")
+
+        chunks = _split_into_chunks(content, max(1, completion_tokens // 8))
+        for piece in chunks:
+            time.sleep(decode_seconds / len(chunks))
+            event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event([], {"usage": usage})
+        self._write_chunk("data: [DONE]\n\n")
+        self._end_chunked()
+
+    # --- Files and batches (OpenAI Batch API) ---
+
+    def _create_file(self, body):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode('utf-8') + body)
+        fields = {}
+        for part in message.iter_parts():
+            fields[part.get_param('name', header='content-disposition')] = (part.get_filename(), part.get_payload(decode=True))
+        filename, content = fields.get("file", (None, b""))
+        purpose = (fields.get("purpose", (None, b"batch"))[1] or b"").decode('utf-8')
+        file_object = {"id": f"file-{uuid.uuid4().hex[:24]}", "object": "file", "bytes": len(content),
+                       "created_at": int(time.time()), "filename": filename or "upload.jsonl", "purpose": purpose,
+                       "status": "processed"}
+        self.backend.files[file_object["id"]] = (file_object, content)
+        self._send_json(200, file_object)
+
+    def _create_batch(self, request):
+        input_file = self.backend.files.get(request.get("input_file_id"))
+        if input_file is None:
+            self._send_json(404, {"error": {"message": "Input file not found.", "type": "invalid_request_error"}})
+            return
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex[:24]}", "object": "batch", "endpoint": request.get("endpoint"),
+            "errors": None, "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"), "status": "in_progress",
+            "output_file_id": None, "error_file_id": None, "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self.backend.batches[batch["id"]] = batch
+        threading.Thread(target=self._run_batch, args=(batch, input_file[1]), daemon=True).start()
+        self._send_json(200, batch)
+
+    def _run_batch(self, batch, input_content):
+        """Answers every request of a batch without latency, then marks the batch completed."""
+        backend = self.backend
+        output_lines = []
+        error_lines = []
+        for line in input_content.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            batch["request_counts"]["total"] += 1
+            body = request.get("body") or {}
+            failure = backend.sample_failure()
+            if failure:
+                error_lines.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request.get("custom_id"),
+                                    "response": {"status_code": failure[0], "body": {"error": {"message": failure[1]}}}, "error": None})
+                batch["request_counts"]["failed"] += 1
+                continue
+            messages = body.get("messages") or []
+            system_prompt = "".join(m.get("content", "") for m in messages if m.get("role") == "system")
+            user_prompt = "".join(m.get("content", "") for m in messages if m.get("role") == "user")
+            content = _build_content(backend, system_prompt, user_prompt, backend.sample_response_tokens())
+            prompt_tokens = _estimate_tokens(system_prompt) + _estimate_tokens(user_prompt)
+            output_lines.append({"id": f"batch_req_{uuid.uuid4().hex[:12]}", "custom_id": request.get("custom_id"), "error": None,
+                                 "response": {"status_code": 200, "body": {
+                                     "object": "chat.completion", "model": body.get("model"),
+                                     "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                                     "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": _count_completion_tokens(content)}}}})
+            batch["request_counts"]["completed"] += 1
+        for lines, field in ((output_lines, "output_file_id"), (error_lines, "error_file_id")):
+            if lines:
+                content = "".join(json.dumps(line) + "\n" for line in lines).encode('utf-8')
+                file_id = f"file-{uuid.uuid4().hex[:24]}"
+                backend.files[file_id] = ({"id": file_id, "object": "file", "bytes": len(content), "purpose": "batch_output"}, content)
+                batch[field] = file_id
+        batch["status"] = "completed"
+
+    def _get_batch(self, batch_id):
+        batch = self.backend.batches.get(batch_id)
+        if batch is None:
+            self._send_json(404, {"error": {"message": "Batch not found.", "type": "invalid_request_error"}})
+        else:
+            self._send_json(200, batch)
+
+    def _get_file_content(self, file_id):
+        stored = self.backend.files.get(file_id)
+        if stored is None:
+            self._send_json(404, {"error": {"message": "File not found.", "type": "invalid_request_error"}})
+        else:
+            self._send_bytes(200, stored[1], "application/jsonl")
+
+
+class _MockHTTPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients close keep-alive connections (and abort hedged streams) at any time; not worth a traceback
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+def start_mock_server(settings=None, host="127.0.0.1", port=0):
+    """
+    Starts the mock server on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: The running server; `server.url` is its base URL (use it as OLLAMA_HOST,
+        and `server.url + "/v1"` as DEEPSEEK_BASE_URL). Call server.shutdown() to stop it.
+    """
+    backend = _MockBackend(settings or MockServerSettings())
+    handler = type("MockRequestHandler", (_MockRequestHandler,), {"backend": backend})
+    server = _MockHTTPServer((host, port), handler)
+    server.backend = backend
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, name="mock-llm-server", daemon=True).start()
+    return server
+
+def add_mock_settings_arguments(parser):
+    """Adds the MockServerSettings options to an argparse parser (shared with benchmark.py)."""
+    parser.add_argument("--ttft_ms", type=float, default=200.0, help="Mean time to first token in milliseconds.")
+    parser.add_argument("--latency_distribution", choices=LATENCY_DISTRIBUTIONS, default="lognormal",
+                        help="Distribution of time to first token around --ttft_ms.")
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="Sigma of the lognormal distribution.")
+    parser.add_argument("--tokens_per_second", type=float, default=80.0, help="Decode speed.")
+    parser.add_argument("--response_tokens", type=int, nargs=2, default=(50, 200), metavar=("MIN", "MAX"),
+                        help="Response length range in tokens (uniform).")
+    parser.add_argument("--error_rate", type=float, default=0.0, help="Fraction of requests failing with HTTP 503.")
+    parser.add_argument("--throttle_rate", type=float, default=0.0, help="Fraction of requests failing with HTTP 429.")
+    parser.add_argument("--malformed_rate", type=float, default=0.0,
+                        help="Fraction of MTPE JSON responses wrapped in prose or truncated.")
+    parser.add_argument("--max_parallel", type=int, default=0,
+                        help="Chat requests generated at once; more wait in a queue, as on a single Ollama host (0 for no limit).")
+    parser.add_argument("--stall_rate", type=float, default=0.0,
+                        help="Fraction of chat requests that stall for --stall_seconds before the first token.")
+    parser.add_argument("--stall_seconds", type=float, default=5.0, help="How long a stalled request stalls.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducible latencies and failures.")
+
+def mock_settings_from_args(args) -> MockServerSettings:
+    return MockServerSettings(ttft_ms=args.ttft_ms, latency_distribution=args.latency_distribution,
+                              latency_sigma=args.latency_sigma, tokens_per_second=args.tokens_per_second,
+                              response_tokens=tuple(args.response_tokens), error_rate=args.error_rate,
+                              throttle_rate=args.throttle_rate, malformed_rate=args.malformed_rate, max_parallel=args.max_parallel,
+                              stall_rate=args.stall_rate, stall_seconds=args.stall_seconds, seed=args.seed)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local mock LLM server speaking the Ollama chat API and the OpenAI chat-completions and Batch APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    add_mock_settings_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+
+    mock_server = start_mock_server(mock_settings_from_args(args), host=args.host, port=args.port)
+    print(f"Mock LLM server listening on {mock_server.url}")
+    print(f"  Ollama:            OLLAMA_HOST={mock_server.url}")
+    print(f"  OpenAI-compatible: DEEPSEEK_BASE_URL={mock_server.url}/v1 OPENAI_API_KEY=mock")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock_server.shutdown()
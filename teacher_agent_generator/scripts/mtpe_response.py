@@ -0,0 +1,182 @@
+# teacher_agent_generator/scripts/mtpe_response.py
+import json
+import math
+import threading
+
+# Fields of the MTPE JSON object the translator system prompt asks for, and what each must hold:
+# 'text' a non-empty string, 'number' a non-negative number, 'rating' an integer 1-5, 'list' a list of strings
+MTPE_RESPONSE_FIELDS = {
+    "mtpe_output_en": "text",
+    "think_aloud_protocol": "text",
+    "estimated_time_minutes": "number",
+    "perceived_mt_quality_rating": "rating",
+    "confidence_rating_of_mtpe_output": "rating",
+    "simulated_edit_categories": "list",
+    "linguistic_error_simulation_notes": "text",
+}
+# Fields a response must have to be usable; the others are checked only when present
+REQUIRED_MTPE_RESPONSE_FIELDS = ("mtpe_output_en", "think_aloud_protocol", "estimated_time_minutes",
+                                 "perceived_mt_quality_rating", "confidence_rating_of_mtpe_output")
+
+# How a response's JSON object was obtained (the 'response_parse' record field)
+PARSE_OUTCOMES = ("json", "extracted", "repaired", "failed")
+
+# '{' positions tried when looking for an embedded object, so a long response without one is scanned a bounded number of times
+MAX_OBJECT_CANDIDATES = 20
+
+REPAIR_SYSTEM_PROMPT = (
+    "You fix malformed JSON. Reply with a single valid JSON object and nothing else: no prose, no markdown. "
+    "Keep the original wording of every value. If the input is cut off, close it, completing the last value only as far "
+    "as needed. The object must have these fields: "
+    + ", ".join(f"`{field}`" for field in MTPE_RESPONSE_FIELDS)
+    + ". `estimated_time_minutes` is a number, the two ratings are integers from 1 to 5 and `simulated_edit_categories` is a list of strings."
+)
+
+_DECODER = json.JSONDecoder()
+
+
+def extract_json_object(text):
+    """
+    Finds the first JSON object in an LLM response, tolerating markdown fences, a preamble and trailing prose.
+
+    Returns:
+        tuple: (object, outcome) where outcome is 'json' if the whole response (without fences) is the
+               object, 'extracted' if it had to be found inside other text, or (None, None) if there is none.
+    """
+    if not text:
+        return None, None
+    stripped = text.strip()
+    if stripped.startswith("```"):
+        stripped = stripped.split("\n", 1)[1] if "\n" in stripped else ""
+        if stripped.rstrip().endswith("```"):
+            stripped = stripped.rstrip()[:-3]
+    try:
+        parsed = json.loads(stripped)
+        if isinstance(parsed, dict):
+            return parsed, "json"
+    except json.JSONDecodeError:
+        pass
+
+    # raw_decode parses one complete value at a position and ignores whatever follows it
+    position = text.find('{')
+    for _ in range(MAX_OBJECT_CANDIDATES):
+        if position == -1:
+            break
+        try:
+            parsed, _end = _DECODER.raw_decode(text, position)
+            if isinstance(parsed, dict):
+                return parsed, "extracted"
+        except json.JSONDecodeError:
+            pass
+        position = text.find('{', position + 1)
+    return None, None
+
+def validate_mtpe_response(parsed) -> list:
+    """Returns the problems that make a parsed MTPE object unusable (an empty list if it is valid)."""
+    problems = []
+    for field, kind in MTPE_RESPONSE_FIELDS.items():
+        value = parsed.get(field)
+        if value is None:
+            if field in REQUIRED_MTPE_RESPONSE_FIELDS:
+                problems.append(f"missing '{field}'")
+            continue
+        if kind == "text":
+            valid = isinstance(value, str) and bool(value.strip())
+        elif kind == "list":
+            valid = isinstance(value, list)
+        else:
+            number = _as_number(value)
+            valid = number is not None and number >= 0
+            if kind == "rating":
+                valid = valid and number == int(number) and 1 <= number <= 5
+        if not valid:
+            problems.append(f"invalid '{field}' ({str(value)[:40]!r})")
+    return problems
+
+def _as_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value if math.isfinite(value) else None
+    try:
+        number = float(str(value).strip())
+    except ValueError:
+        return None
+    return number if math.isfinite(number) else None
+
+def parse_mtpe_response(text):
+    """
+    Extracts and validates the MTPE object of a response.
+
+    Returns:
+        tuple: (object or None, outcome, problems). `outcome` is 'json' or 'extracted' when a valid
+               object was found and 'failed' otherwise; `problems` then describes what is wrong.
+    """
+    parsed, outcome = extract_json_object(text)
+    if parsed is None:
+        return None, "failed", ["no complete JSON object in the response (truncated or missing)"]
+    problems = validate_mtpe_response(parsed)
+    return parsed, ("failed" if problems else outcome), problems
+
+def build_repair_user_prompt(raw_text, problems) -> str:
+    """The user prompt of a repair call: what is wrong, followed by the response to fix."""
+    return (f"Problems: {'; '.join(problems)}.\n\n"
+            f"Fix this response and return only the corrected JSON object:\n{raw_text}")
+
+
+class ParseStats:
+    """Thread-safe run totals of MTPE response parsing and repair calls, for the run summary."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.outcomes = dict.fromkeys(PARSE_OUTCOMES, 0)
+        self.repair_calls = 0
+        self.repair_prompt_tokens = 0
+        self.repair_output_tokens = 0
+        self.repair_seconds = 0.0
+
+    def record_outcome(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+    def record_repair_call(self, generation, seconds):
+        usage = generation.get("usage") or {}
+        timings = generation.get("timings") or {}
+        with self._lock:
+            self.repair_calls += 1
+            self.repair_prompt_tokens += usage.get("prompt_tokens") or 0
+            self.repair_output_tokens += timings.get("output_tokens") or usage.get("completion_tokens") or 0
+            self.repair_seconds += seconds
+
+    def summary(self) -> dict:
+        with self._lock:
+            parsed = sum(self.outcomes.values())
+            first_pass_failures = self.outcomes["repaired"] + self.outcomes["failed"]
+            return {
+                **self.outcomes,
+                "responses": parsed,
+                "first_pass_failure_rate": first_pass_failures / parsed if parsed else 0.0,
+                "repair_calls": self.repair_calls,
+                "repair_prompt_tokens": self.repair_prompt_tokens,
+                "repair_output_tokens": self.repair_output_tokens,
+                "repair_seconds": round(self.repair_seconds, 2),
+            }
+
+
+if __name__ == '__main__':
+    print("MTPE Response Module - Test Run")
+    valid = {"mtpe_output_en": "Final text.", "think_aloud_protocol": "I fixed the verb.", "estimated_time_minutes": 5,
+             "perceived_mt_quality_rating": 3, "confidence_rating_of_mtpe_output": "4",
+             "simulated_edit_categories": ["Grammar"], "linguistic_error_simulation_notes": "N/A"}
+    samples = {
+        "plain": json.dumps(valid),
+        "fenced": "```json\n" + json.dumps(valid) + "\n```",
+        "prose": "Here is my answer:\n" + json.dumps(valid) + "\nThe {edits} were minor.",
+        "truncated": json.dumps(valid)[:60],
+        "invalid rating": json.dumps({**valid, "perceived_mt_quality_rating": 9}),
+    }
+    for name, text in samples.items():
+        _parsed, outcome, problems = parse_mtpe_response(text)
+        print(f"  {name}: {outcome} {problems}")
+    print(build_repair_user_prompt(samples["truncated"], parse_mtpe_response(samples["truncated"])[2]))
+    print("MTPE Response Module - Test Run Finished")
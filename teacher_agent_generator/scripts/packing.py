@@ -0,0 +1,101 @@
+# teacher_agent_generator/scripts/packing.py
+import json
+import logging
+import os
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+
+
+def is_packable(task: dict) -> bool:
+    """True if a task is a short questionnaire item that can share an LLM call with others."""
+    return task.get("type") in config.PACKABLE_TASK_TYPES and bool(task.get("id"))
+
+def pack_jobs(jobs, pack_size):
+    """
+    Groups a stream of generation jobs into units of work, preserving job order.
+
+    Consecutive packable jobs (see is_packable) of the same persona are grouped into units of up
+    to `pack_size` jobs; every other job becomes a unit of its own. Each unit is a list of jobs.
+    """
+    pack = []
+    for job in jobs:
+        if pack_size > 1 and is_packable(job["task"]):
+            if pack and (pack[0]["persona_index"] != job["persona_index"] or len(pack) >= pack_size):
+                yield pack
+                pack = []
+            pack.append(job)
+            continue
+        if pack:
+            yield pack
+            pack = []
+        yield [job]
+    if pack:
+        yield pack
+
+def build_packed_user_prompt(tasks) -> str:
+    """Builds one user prompt asking for answers to several questionnaire items as a JSON object keyed by item id."""
+    lines = [
+        "Answer each of the following questionnaire items from your perspective.",
+        'Respond with a single JSON object of the form {"answers": {"<item id>": "<your answer>", ...}} '
+        "with one entry for every item id listed below, and nothing else.",
+    ]
+    for task in tasks:
+        lines.append("")
+        lines.append(f"Item id: {task['id']}")
+        lines.append(f"Type: {task.get('type')}")
+        lines.append(f"Question: {task.get('text', '')}")
+        if task.get("options"):
+            lines.append(f"Options: {'; '.join(str(option) for option in task['options'])}")
+    return "\n".join(lines)
+
+def parse_packed_response(response_text, item_ids) -> dict:
+    """
+    Extracts per-item answers from a packed response.
+
+    Returns:
+        dict: item id -> answer text, for the requested ids that have a non-empty answer.
+              Missing or unparseable items are simply absent, so the caller can fall back to single calls.
+    """
+    if not response_text:
+        return {}
+    start, end = response_text.find('{'), response_text.rfind('}')
+    if start == -1 or end <= start:
+        return {}
+    try:
+        parsed = json.loads(response_text[start:end + 1])
+    except json.JSONDecodeError as e:
+        logging.warning(f"Could not parse packed questionnaire response as JSON: {e}")
+        return {}
+    answers = parsed.get("answers", parsed) if isinstance(parsed, dict) else {}
+    if not isinstance(answers, dict):
+        return {}
+    result = {}
+    for item_id in item_ids:
+        answer = answers.get(item_id)
+        if isinstance(answer, (dict, list)):
+            answer = json.dumps(answer, ensure_ascii=False)
+        if answer is not None and str(answer).strip():
+            result[item_id] = str(answer).strip()
+    return result
+
+
+if __name__ == '__main__':
+    print("Packing Module - Test Run")
+    tasks = [
+        {"id": "q1", "type": "multiple_choice", "text": "Preferred method?", "options": ["Lectures", "Projects"]},
+        {"id": "q2", "type": "likert_scale", "text": "Comfort with technology (1-5)?"},
+    ]
+    print(build_packed_user_prompt(tasks))
+    packed_response = '```json\n{"answers": {"q1": "Projects", "q2": 4}}\n```'
+    print(f"Parsed (q3 missing): {parse_packed_response(packed_response, ['q1', 'q2', 'q3'])}")
+    jobs = [{"persona_index": p, "task": t} for p in (0, 1) for t in [{"type": "open_ended", "text": "Why?"}] + tasks]
+    print(f"Unit sizes for pack_size=2: {[len(unit) for unit in pack_jobs(jobs, 2)]}")
+    print("Packing Module - Test Run Finished")
@@ -1,8 +1,12 @@
 # teacher_agent_generator/scripts/persona_loader.py
+import collections
 import csv
+import itertools
 import logging
+import math
 import os
 import sys
+from array import array
 
 # If this script is run directly, add its directory to sys.path
 # to allow direct import of 'config' from the same directory.
@@ -54,128 +58,297 @@ TRANSLATOR_OPTIONAL_COLUMNS = [
 ]
 
 
-# --- Helper Functions for Translator Personas ---
-def _calculate_adjusted_experience(raw_years_val, employment_type_val: str) -> float:
-    """Calculates adjusted translation experience based on employment type."""
-    try:
-        raw_years = float(raw_years_val)
-    except (ValueError, TypeError):
-        logging.warning(f"Invalid or missing raw experience years '{raw_years_val}'. Defaulting to 0.")
-        return 0.0
+# Computed columns added to every translator persona
+ADJUSTED_EXPERIENCE_COLUMN = "translation_experience_years_adjusted"
+SKILL_LEVEL_COLUMN = "translation_skill_level"
+
+# Skill levels are stored as small integer codes: base level * 2 + certified
+_BASE_SKILL_LEVELS = ("Junior", "Mid-level", "Senior", "Undefined")
+_SKILL_LEVEL_LABELS = tuple(
+    f"{level} (Certified)" if certified and level != "Undefined" else level
+    for level in _BASE_SKILL_LEVELS for certified in (False, True)
+)
+
+# Example rows/values listed per column in aggregated loading warnings
+MAX_REPORTED_EXAMPLES = 5
+# Rows read and transposed into columns at a time
+PERSONA_READ_CHUNK_ROWS = 10000
 
+
+# --- Helper Functions for Translator Personas ---
+def _employment_multiplier(employment_type_val):
+    """Experience multiplier for an employment type, or None if the type is not recognised."""
     employment_type_lower = str(employment_type_val).lower().strip()
-    multiplier = 0.0
     if 'full-time' in employment_type_lower or 'full time' in employment_type_lower: # Making it more robust
-        multiplier = 1.0
-    elif 'part-time' in employment_type_lower or 'part time' in employment_type_lower:
-        multiplier = 0.5
-    elif 'freelance' in employment_type_lower:
-        multiplier = 0.7
-    else:
-        logging.warning(f"Unknown or unmatched employment type '{employment_type_val}'. Assuming 0 multiplier for experience adjustment.")
-
-    return raw_years * multiplier
+        return 1.0
+    if 'part-time' in employment_type_lower or 'part time' in employment_type_lower:
+        return 0.5
+    if 'freelance' in employment_type_lower:
+        return 0.7
+    return None
+
+def _is_certified(has_certification_val) -> bool:
+    # Robust boolean interpretation for has_certification_val
+    return str(has_certification_val).strip().lower() in ('yes', 'true', '1')
 
-def _determine_skill_level(adjusted_years: float, has_certification_val) -> str:
-    """Determines skill level based on adjusted experience and certification."""
-    level = ""
+def _skill_level_code(adjusted_years: float, certified: bool) -> int:
+    """Skill level (an index into _SKILL_LEVEL_LABELS) from adjusted experience and certification."""
     if 0 <= adjusted_years <= 2:
-        level = "Junior"
+        base = 0 # Junior
     elif 2 < adjusted_years <= 5:
-        level = "Mid-level"
+        base = 1 # Mid-level
     elif adjusted_years > 5:
-        level = "Senior"
+        base = 2 # Senior
     else: # Should not happen if adjusted_years is always >= 0
-        level = "Undefined"
+        base = 3 # Undefined
+    return base * 2 + int(certified)
 
-    # Robust boolean interpretation for has_certification_val
-    has_cert_str = str(has_certification_val).strip().lower()
-    has_certification = has_cert_str == 'yes' or has_cert_str == 'true' or has_cert_str == '1'
+# --- Columnar Translator Persona Storage ---
+class TranslatorPersona:
+    """
+    Read-only view of one row of a TranslatorPersonaTable. Supports the dict-style access used by
+    the prompt builders (persona.get(key), persona[key]) without a dict per row.
+    """
+
+    __slots__ = ("_table", "_index")
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def get(self, key, default=None):
+        return self._table.value(key, self._index, default)
+
+    def __getitem__(self, key):
+        if key not in self._table.columns:
+            raise KeyError(key)
+        return self._table.value(key, self._index)
+
+    def __contains__(self, key):
+        return key in self._table.columns
+
+    def keys(self):
+        return list(self._table.columns)
 
-    if has_certification and level in ["Mid-level", "Senior"]:
-        level += " (Certified)"
-    elif has_certification and level == "Junior": # Or just add (Certified) to any level if they have it
-        level = "Junior (Certified)"
+    def to_dict(self) -> dict:
+        return {key: self._table.value(key, self._index) for key in self._table.columns}
 
-    return level
+    def __repr__(self):
+        return f"TranslatorPersona({self.to_dict()!r})"
+
+
+class TranslatorPersonaTable:
+    """
+    Translator personas stored column by column: one list per CSV column (repeated values share one
+    string object) plus array-backed computed columns for adjusted experience and skill level.
+    Behaves like a read-only sequence of TranslatorPersona rows, including len() and slicing.
+    """
+
+    def __init__(self, csv_columns=None, adjusted_experience=None, skill_level_codes=None):
+        self._csv_columns = csv_columns or {}
+        self._adjusted_experience = adjusted_experience if adjusted_experience is not None else array('d')
+        self._skill_level_codes = skill_level_codes if skill_level_codes is not None else array('B')
+        self.columns = tuple(self._csv_columns) + ((ADJUSTED_EXPERIENCE_COLUMN, SKILL_LEVEL_COLUMN) if self._csv_columns else ())
+
+    def __len__(self):
+        return len(self._adjusted_experience)
+
+    def __iter__(self):
+        return (TranslatorPersona(self, i) for i in range(len(self)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TranslatorPersonaTable({name: values[index] for name, values in self._csv_columns.items()},
+                                          self._adjusted_experience[index], self._skill_level_codes[index])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("translator persona index out of range")
+        return TranslatorPersona(self, index)
+
+    def value(self, key, index, default=None):
+        if key == ADJUSTED_EXPERIENCE_COLUMN:
+            return self._adjusted_experience[index]
+        if key == SKILL_LEVEL_COLUMN:
+            return _SKILL_LEVEL_LABELS[self._skill_level_codes[index]]
+        values = self._csv_columns.get(key)
+        if values is None:
+            return default
+        value = values[index]
+        return default if value is None else value
+
+    def to_dicts(self) -> list[dict]:
+        return [persona.to_dict() for persona in self]
+
+
+class _ColumnIssues:
+    """Collects per-column data problems while loading, for one aggregated warning per column."""
+
+    def __init__(self):
+        self._issues = collections.OrderedDict()
+
+    def add(self, column, problem, row_number, value):
+        issue = self._issues.get((column, problem))
+        if issue is None:
+            issue = self._issues[(column, problem)] = {"count": 0, "rows": [], "values": collections.Counter()}
+        issue["count"] += 1
+        if len(issue["rows"]) < MAX_REPORTED_EXAMPLES:
+            issue["rows"].append(row_number)
+        issue["values"][value] += 1
+
+    def log(self, file_path):
+        for (column, problem), issue in self._issues.items():
+            values = ", ".join(f"'{value}' x{count}" for value, count in issue["values"].most_common(MAX_REPORTED_EXAMPLES))
+            logging.warning(f"{file_path}: column '{column}': {issue['count']} rows {problem} "
+                            f"(e.g. data rows {', '.join(map(str, issue['rows']))}; values {values}).")
+
+
+def _compute_adjusted_experience(raw_years_column, employment_type_column, issues):
+    """
+    Adjusted experience for a whole column. Each distinct raw value and employment type is
+    parsed/classified only once; rows then only look the results up.
+    """
+    raw_years = {value: _parse_float(value) for value in set(raw_years_column)}
+    multipliers = {value: _employment_multiplier(value) for value in set(employment_type_column)}
+    adjusted = array('d', bytes(8 * len(raw_years_column)))
+    for i, (raw_years_val, employment_type_val) in enumerate(zip(raw_years_column, employment_type_column)):
+        years = raw_years[raw_years_val]
+        if years is None:
+            issues.add("translation_experience_years_raw", "have invalid or missing experience years, defaulted to 0", i + 1, raw_years_val)
+            continue
+        multiplier = multipliers[employment_type_val]
+        if multiplier is None:
+            issues.add("employment_type", "have an unknown employment type, experience multiplier 0", i + 1, employment_type_val)
+            continue
+        adjusted[i] = years * multiplier
+    return adjusted
+
+def _parse_float(value):
+    """The value as a finite float, else None ('nan' and 'inf' parse but are not usable numbers)."""
+    try:
+        number = float(value)
+    except (ValueError, TypeError):
+        return None
+    return number if math.isfinite(number) else None
+
+def _compute_skill_level_codes(adjusted_experience, certification_column):
+    """Skill level codes for a whole column. Each distinct certification value is interpreted only once."""
+    certified = {value: _is_certified(value) for value in set(certification_column)}
+    codes = {}
+    for years in set(adjusted_experience):
+        for value, is_certified in certified.items():
+            codes[(years, value)] = _skill_level_code(years, is_certified)
+    return array('B', map(codes.__getitem__, zip(adjusted_experience, certification_column)))
+
+def _is_valid_proficiency_score(score_val):
+    if score_val is None or score_val.lower() == 'n/a (native speaker)':
+        return True
+    return _parse_float(score_val) is not None
+
+def _check_translator_samples(csv_columns, issues):
+    """Records rows with missing/placeholder samples or invalid proficiency scores. Each distinct value is checked once."""
+    checks = [
+        ("sample_source_text_ch", "have a missing or placeholder sample", lambda value: bool(value) and "[Chinese Source Sample" not in value),
+        ("sample_translation_en", "have a missing or placeholder sample", lambda value: bool(value) and "[English Translation Sample" not in value),
+        ("english_proficiency_score", "are not a number or 'N/A (Native Speaker)'", _is_valid_proficiency_score),
+    ]
+    for column, problem, is_valid in checks:
+        values = csv_columns[column]
+        invalid = {value for value in set(values) if not is_valid(value)}
+        if invalid:
+            for i, value in enumerate(values):
+                if value in invalid:
+                    issues.add(column, problem, i + 1, value)
 
 
 # --- Main Persona Loading Functions ---
-def load_translator_personas(file_path=None) -> list[dict]:
+def load_translator_persona_table(file_path=None) -> TranslatorPersonaTable:
     """
-    Loads translator personas from a CSV file, calculates adjusted experience and skill level.
+    Loads translator personas from a CSV file into a columnar TranslatorPersonaTable, computing adjusted
+    experience and skill level column by column. Data problems are reported as one warning per column.
 
     Args:
         file_path (str, optional): Path to the translator personas CSV file.
                                    Defaults to config.DEFAULT_TRANSLATOR_PERSONAS_CSV_PATH.
 
     Returns:
-        list: A list of dictionaries, where each dictionary represents a translator persona
-              with added calculated fields. Returns an empty list on error or if file not found.
+        TranslatorPersonaTable: The personas. Empty on error or if the file is not found.
     """
     if file_path is None:
         file_path = config.DEFAULT_TRANSLATOR_PERSONAS_CSV_PATH
 
-    translator_personas = []
     try:
-        with open(file_path, mode='r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
+        with open(file_path, mode='r', encoding='utf-8', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            fieldnames = next(reader, None)
 
-            if not reader.fieldnames:
+            if not fieldnames:
                 logging.error(f"Translator personas file is empty or has no headers: {file_path}")
-                return []
+                return TranslatorPersonaTable()
 
             # Validate required columns
-            missing_required = [col for col in TRANSLATOR_REQUIRED_COLUMNS if col not in reader.fieldnames]
+            missing_required = [col for col in TRANSLATOR_REQUIRED_COLUMNS if col not in fieldnames]
             if missing_required:
                 logging.error(f"Translator personas file {file_path} is missing required columns: {', '.join(missing_required)}")
-                return []
+                return TranslatorPersonaTable()
 
             # Check for optional columns
-            detected_optional = [col for col in TRANSLATOR_OPTIONAL_COLUMNS if col in reader.fieldnames]
+            detected_optional = [col for col in TRANSLATOR_OPTIONAL_COLUMNS if col in fieldnames]
             if detected_optional:
                 logging.info(f"Detected optional translator persona columns: {', '.join(detected_optional)}")
             else:
                 logging.info("No optional translator persona columns detected.")
 
-            for row_num, row in enumerate(reader):
-                persona_id = row.get("persona_id", f"Row_{row_num+1}")
-
-                # Calculate adjusted experience and skill level
-                raw_exp = row.get("translation_experience_years_raw")
-                emp_type = row.get("employment_type")
-                has_cert = row.get("has_translation_certification")
-
-                row["translation_experience_years_adjusted"] = _calculate_adjusted_experience(raw_exp, emp_type)
-                row["translation_skill_level"] = _determine_skill_level(row["translation_experience_years_adjusted"], has_cert)
-
-                # Basic validation for crucial fields
-                if not row.get("sample_source_text_ch") or "[Chinese Source Sample" in str(row.get("sample_source_text_ch")):
-                    logging.warning(f"Persona ID '{persona_id}': Missing or placeholder 'sample_source_text_ch'.")
-                if not row.get("sample_translation_en") or "[English Translation Sample" in str(row.get("sample_translation_en")):
-                    logging.warning(f"Persona ID '{persona_id}': Missing or placeholder 'sample_translation_en'.")
+            # Rows are transposed into columns a chunk at a time. In low-cardinality columns
+            # (languages, employment types, ...) repeated values share one string object.
+            width = len(fieldnames)
+            column_values = [[] for _ in fieldnames]
+            shared_strings = [None] * width # Per column: dict of shared strings, or False if not worth it
+            while True:
+                # Padded like csv.DictReader; fields beyond the header (e.g. from a trailing comma) are dropped
+                chunk = [row[:width] if len(row) >= width else row + [None] * (width - len(row))
+                         for row in itertools.islice(reader, PERSONA_READ_CHUNK_ROWS) if row]
+                if not chunk:
+                    break
+                for col, chunk_column in enumerate(zip(*chunk)):
+                    if shared_strings[col] is None: # Decided on the first chunk
+                        shared_strings[col] = {} if len(set(chunk_column)) <= len(chunk_column) // 2 else False
+                    shared = shared_strings[col]
+                    column_values[col].extend(map(shared.setdefault, chunk_column, chunk_column) if shared is not False else chunk_column)
+            csv_columns = dict(zip(fieldnames, column_values))
+    except FileNotFoundError:
+        logging.error(f"Translator personas file not found: {file_path}")
+        return TranslatorPersonaTable()
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while loading translator personas from {file_path}: {e}", exc_info=True)
+        return TranslatorPersonaTable()
 
-                score_val = row.get("english_proficiency_score")
-                try:
-                    if score_val is not None and score_val.lower() != 'n/a (native speaker)':
-                        float(score_val)
-                except ValueError:
-                    logging.warning(f"Persona ID '{persona_id}': Invalid 'english_proficiency_score' ('{score_val}'). Should be float or 'N/A (Native Speaker)'.")
+    issues = _ColumnIssues()
+    adjusted_experience = _compute_adjusted_experience(csv_columns["translation_experience_years_raw"], csv_columns["employment_type"], issues)
+    skill_level_codes = _compute_skill_level_codes(adjusted_experience, csv_columns["has_translation_certification"])
+    _check_translator_samples(csv_columns, issues)
+    issues.log(file_path)
 
-                translator_personas.append(row)
+    table = TranslatorPersonaTable(csv_columns, adjusted_experience, skill_level_codes)
+    if not len(table):
+        logging.warning(f"Translator personas file {file_path} has headers but no data rows.")
+    logging.info(f"Successfully loaded and processed {len(table)} translator personas from {file_path}.")
+    return table
 
-            if not translator_personas and reader.fieldnames:
-                logging.warning(f"Translator personas file {file_path} has headers but no data rows.")
+def load_translator_personas(file_path=None) -> list[dict]:
+    """
+    Loads translator personas from a CSV file, calculates adjusted experience and skill level.
+    For large persona pools prefer load_translator_persona_table(), which avoids a dict per row.
 
-            logging.info(f"Successfully loaded and processed {len(translator_personas)} translator personas from {file_path}.")
-            return translator_personas
+    Args:
+        file_path (str, optional): Path to the translator personas CSV file.
+                                   Defaults to config.DEFAULT_TRANSLATOR_PERSONAS_CSV_PATH.
 
-    except FileNotFoundError:
-        logging.error(f"Translator personas file not found: {file_path}")
-        return []
-    except Exception as e:
-        logging.error(f"An unexpected error occurred while loading translator personas from {file_path}: {e}", exc_info=True)
-        return []
+    Returns:
+        list: A list of dictionaries, where each dictionary represents a translator persona
+              with added calculated fields. Returns an empty list on error or if file not found.
+    """
+    return load_translator_persona_table(file_path).to_dicts()
 
 def load_personas(file_path=config.PERSONAS_FILE):
     """
@@ -376,4 +549,45 @@ if __name__ == '__main__':
         logger.error(f"Test 7: ERROR - Loaded {len(translator_personas_non_existent)} translator personas from a non-existent file.")
     print("-" * 30)
 
+    # Test 8: Non-finite experience years are reported as invalid instead of breaking the load
+    logger.info("Test 8: Testing load_translator_personas with 'nan' and 'inf' experience years.")
+    dummy_nan_years_file = os.path.join(config.DATA_DIR, "dummy_translator_nan_years_test.csv")
+    try:
+        with open(dummy_nan_years_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(TRANSLATOR_REQUIRED_COLUMNS)
+            for persona_id, years in (("t_nan", "nan"), ("t_inf", "inf"), ("t_ok", "4")):
+                writer.writerow([persona_id, f"Persona {persona_id}", "Chinese", "MA", "Translation", "N/A (Native Speaker)",
+                                 "yes", years, "Full-time", "源文本", "Source text"])
+        translator_personas_nan = load_translator_personas(file_path=dummy_nan_years_file)
+        skill_levels = [p_data.get('translation_skill_level') for p_data in translator_personas_nan]
+        if len(translator_personas_nan) == 3 and skill_levels[2] == "Mid-level (Certified)":
+            logger.info(f"Test 8: Loaded all 3 personas; skill levels {skill_levels}.")
+        else:
+            logger.error(f"Test 8: ERROR - Expected 3 personas, got {len(translator_personas_nan)} (skill levels {skill_levels}).")
+    finally:
+        if os.path.exists(dummy_nan_years_file):
+            os.remove(dummy_nan_years_file)
+    print("-" * 30)
+
+    # Test 9: Data rows with more fields than the header (a trailing comma on every line)
+    logger.info("Test 9: Testing load_translator_personas with a trailing comma on every data row.")
+    dummy_trailing_comma_file = os.path.join(config.DATA_DIR, "dummy_translator_trailing_comma_test.csv")
+    try:
+        with open(dummy_trailing_comma_file, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(TRANSLATOR_REQUIRED_COLUMNS)
+            for persona_id in ("t_a", "t_b"):
+                writer.writerow([persona_id, f"Persona {persona_id}", "Chinese", "MA", "Translation", "N/A (Native Speaker)",
+                                 "no", "1", "Full-time", "源文本", "Source text", ""])
+        translator_personas_long_rows = load_translator_personas(file_path=dummy_trailing_comma_file)
+        if [p_data.get('persona_id') for p_data in translator_personas_long_rows] == ["t_a", "t_b"]:
+            logger.info("Test 9: Loaded both personas; the extra fields were dropped.")
+        else:
+            logger.error(f"Test 9: ERROR - Expected personas t_a and t_b, got {len(translator_personas_long_rows)} personas.")
+    finally:
+        if os.path.exists(dummy_trailing_comma_file):
+            os.remove(dummy_trailing_comma_file)
+    print("-" * 30)
+
     logger.info("--- Persona Loader Self-Test Finished ---")
@@ -0,0 +1,186 @@
+# teacher_agent_generator/scripts/prompt_store.py
+import collections
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Side tables of a normalized output '<name>.jsonl': '<name>.jsonl.personas.jsonl' and '<name>.jsonl.prompts.jsonl'
+PERSONAS_SUFFIX = ".personas.jsonl"
+PROMPTS_SUFFIX = ".prompts.jsonl"
+
+# Recently keyed persona/prompt objects remembered by identity, so the jobs of one persona hash its details only once
+_IDENTITY_CACHE_SIZE = 1024
+
+
+def text_digest(text) -> str:
+    """
+    Stable SHA-256 hex digest of a prompt (the same digest as scheduling.prompt_digest).
+    Unlike hash(), it is the same in every process and run.
+    """
+    return hashlib.sha256((text or "").encode('utf-8')).hexdigest()
+
+def persona_digest(persona) -> str:
+    """Stable SHA-256 hex digest of a persona's details (canonical JSON: sorted keys, no whitespace)."""
+    canonical = json.dumps(_persona_dict(persona), sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def _persona_dict(persona) -> dict:
+    # Translator personas are persona_loader.TranslatorPersona row views rather than dicts
+    return persona.to_dict() if hasattr(persona, 'to_dict') else dict(persona)
+
+def side_table_paths(output_path):
+    """Returns (personas_path, prompts_path) for a normalized output file (finalized or .partial path)."""
+    base = output_path[:-len(".partial")] if output_path.endswith(".partial") else output_path
+    return base + PERSONAS_SUFFIX, base + PROMPTS_SUFFIX
+
+
+class _SideTable:
+    """An append-only JSONL table of {"key": ..., <field>: ...} entries, each key written once."""
+
+    def __init__(self, path, field):
+        self.path = path
+        self.field = field
+        self.keys = set()
+        self.entries_written = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.keys.add(json.loads(line)["key"])
+                    except (json.JSONDecodeError, KeyError):
+                        continue # A line cut short by a crash; its entry is written again when next needed
+        self._file = None
+
+    def add(self, key, value):
+        if key in self.keys:
+            return
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps({"key": key, self.field: value}, ensure_ascii=False) + '\n')
+        self._file.flush() # Written before any record referencing it
+        self.keys.add(key)
+        self.entries_written += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+
+class PromptStore:
+    """
+    Content-addressed side tables for a normalized output file.
+
+    Each distinct persona and system prompt is written once, keyed by its SHA-256 digest, to
+    '<output>.personas.jsonl' ({"key", "persona"}) and '<output>.prompts.jsonl' ({"key", "system_prompt"}).
+    Output records then carry only 'persona_key' and 'system_prompt_key'. Keys are stable across runs
+    and machines, so records from different runs or shards can be joined on them.
+
+    Existing side tables are appended to (e.g. when resuming); keys already present are not rewritten.
+    Thread-safe.
+    """
+
+    def __init__(self, output_path):
+        personas_path, prompts_path = side_table_paths(output_path)
+        self._personas = _SideTable(personas_path, "persona")
+        self._prompts = _SideTable(prompts_path, "system_prompt")
+        self._identity_keys = collections.OrderedDict() # id(obj) -> (obj, key), most recently used last
+        self._lock = threading.Lock()
+
+    def _cached_key(self, obj, digest_fn):
+        entry = self._identity_keys.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            self._identity_keys.move_to_end(id(obj))
+            return entry[1], True
+        key = digest_fn(obj)
+        self._identity_keys[id(obj)] = (obj, key) # Holding obj keeps its id from being reused
+        if len(self._identity_keys) > _IDENTITY_CACHE_SIZE:
+            self._identity_keys.popitem(last=False)
+        return key, False
+
+    def add_persona(self, persona) -> str:
+        """Stores a persona's details (once) and returns its key."""
+        with self._lock:
+            key, seen = self._cached_key(persona, persona_digest)
+            if not seen:
+                self._personas.add(key, _persona_dict(persona))
+            return key
+
+    def add_prompt(self, system_prompt) -> str:
+        """Stores a system prompt (once) and returns its key."""
+        with self._lock:
+            key, seen = self._cached_key(system_prompt, text_digest)
+            if not seen:
+                self._prompts.add(key, system_prompt)
+            return key
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"personas": len(self._personas.keys), "prompts": len(self._prompts.keys),
+                    "personas_written": self._personas.entries_written, "prompts_written": self._prompts.entries_written}
+
+    def close(self):
+        with self._lock:
+            self._personas.close()
+            self._prompts.close()
+
+
+def merge_side_tables(input_paths, output_path) -> int:
+    """
+    Unions the side tables of several normalized outputs (e.g. shards) into the side tables of
+    `output_path`. Inputs without side tables are skipped. Returns the number of entries written.
+    """
+    written = 0
+    for table_index, field in enumerate(("persona", "system_prompt")):
+        table = _SideTable(side_table_paths(output_path)[table_index], field)
+        for input_path in input_paths:
+            input_table_path = side_table_paths(input_path)[table_index]
+            if not os.path.exists(input_table_path):
+                continue
+            with open(input_table_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    table.add(entry["key"], entry[field])
+        table.close()
+        if table.entries_written:
+            logging.info(f"Merged {table.entries_written} side table entries into {table.path}")
+        written += table.entries_written
+    return written
+
+def load_side_table(path) -> dict:
+    """Loads a side table into a dict of key -> persona or system prompt, e.g. to expand normalized records."""
+    table = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                table[entry["key"]] = entry.get("persona", entry.get("system_prompt"))
+    return table
+
+
+if __name__ == '__main__':
+    import tempfile
+    print("Prompt Store Module - Test Run")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, "results.jsonl")
+        persona = {"name": "Dr. Reed", "title": "Professor"}
+        store = PromptStore(output_path)
+        keys = [(store.add_persona(persona), store.add_prompt("You are Dr. Reed.")) for _ in range(3)]
+        store.close()
+        print(f"Keys (identical for every job): {keys[0][0][:12]}..., {keys[0][1][:12]}...; {store.stats()}")
+        resumed = PromptStore(output_path)
+        resumed.add_persona(dict(persona)) # Equal content, different object: same key, not rewritten
+        resumed.close()
+        print(f"After resume: {resumed.stats()}")
+        print(f"Prompts table: {load_side_table(side_table_paths(output_path)[1])}")
+    print("Prompt Store Module - Test Run Finished")
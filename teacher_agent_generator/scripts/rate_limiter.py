@@ -0,0 +1,200 @@
+# teacher_agent_generator/scripts/rate_limiter.py
+import contextlib
+import logging
+import os
+import threading
+import time
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+
+
+def estimate_tokens(text) -> int:
+    """Rough token estimate used for tokens/min accounting (~4 characters per token, 1 per CJK character)."""
+    if not text:
+        return 0
+    cjk_chars = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk_chars + (len(text) - cjk_chars + 3) // 4
+
+def is_throttling_error(error) -> bool:
+    """
+    Returns True if a provider error (exception or response object) signals rate limiting,
+    i.e. an HTTP 429 / 'Throttling' status from the OpenAI SDK, Ollama or Dashscope.
+    """
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code == 429:
+        return True
+    code = str(getattr(error, 'code', '') or '')
+    if 'throttl' in code.lower() or 'ratelimit' in code.lower().replace('_', ''):
+        return True
+    return 'rate limit' in str(error).lower() or 'too many requests' in str(error).lower()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    acquire(amount) blocks until `amount` tokens are available. A request larger than the bucket
+    capacity is admitted once the bucket is full (leaving it in debt), so it cannot block forever.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self._tokens = self.capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.rate_per_second)
+        self._last_refill = now
+
+    def acquire(self, amount=1):
+        """Blocks until `amount` tokens can be taken from the bucket. Returns the seconds spent waiting."""
+        waited = 0.0
+        needed = min(float(amount), self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= amount
+                    return waited
+                wait_seconds = (needed - self._tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+            waited += wait_seconds
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD (additive-increase / multiplicative-decrease) limit on in-flight requests.
+
+    Each successful call grows the limit by roughly one slot per `limit` successes; a throttling
+    error multiplies it by `decrease_factor`. Decreases are applied at most once per
+    `decrease_cooldown_seconds`, so a burst of 429s from requests already in flight only
+    counts as one congestion signal.
+    """
+
+    def __init__(self, initial_limit, min_limit=1, max_limit=None, decrease_factor=0.5, decrease_cooldown_seconds=5.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max_limit if max_limit is not None else max(initial_limit, self.min_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown_seconds = decrease_cooldown_seconds
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            if self.limit < self.max_limit:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                self._condition.notify()
+
+    def on_throttle(self):
+        with self._condition:
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown_seconds:
+                return
+            self._last_decrease = now
+            previous_limit = self.limit
+            self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+            logging.warning(f"Throttling detected; reducing concurrency limit from {previous_limit:.1f} to {self.limit:.1f}.")
+
+
+class ProviderRateLimiter:
+    """
+    Combines a requests/min bucket, a tokens/min bucket and an AIMD concurrency limit for one provider.
+    Any of the three can be disabled by configuring it as None.
+    """
+
+    def __init__(self, provider, requests_per_minute=None, tokens_per_minute=None,
+                 initial_concurrency=None, max_concurrency=None):
+        self.provider = provider
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = None
+        if max_concurrency:
+            self.concurrency = AdaptiveConcurrencyLimiter(initial_concurrency or max_concurrency, max_limit=max_concurrency)
+
+    @contextlib.contextmanager
+    def slot(self, estimated_tokens=0):
+        """Waits for request, token and concurrency capacity, then holds a concurrency slot for the call."""
+        if self.request_bucket:
+            self.request_bucket.acquire(1)
+        if self.token_bucket and estimated_tokens:
+            self.token_bucket.acquire(estimated_tokens)
+        if self.concurrency:
+            self.concurrency.acquire()
+        try:
+            yield self
+        finally:
+            if self.concurrency:
+                self.concurrency.release()
+
+    def on_success(self):
+        if self.concurrency:
+            self.concurrency.on_success()
+
+    def on_throttle(self):
+        if self.concurrency:
+            self.concurrency.on_throttle()
+
+
+# --- Per-provider registry ---
+_PROVIDER_LIMITERS = {}
+_PROVIDER_LIMITERS_LOCK = threading.Lock()
+
+def get_provider_limiter(provider) -> ProviderRateLimiter:
+    """Returns the shared rate limiter for `provider`, built from config.PROVIDER_RATE_LIMITS on first use."""
+    limiter = _PROVIDER_LIMITERS.get(provider)
+    if limiter is None:
+        with _PROVIDER_LIMITERS_LOCK:
+            limiter = _PROVIDER_LIMITERS.get(provider)
+            if limiter is None:
+                limits = getattr(config, 'PROVIDER_RATE_LIMITS', {}).get(provider, {})
+                limiter = ProviderRateLimiter(provider, **limits)
+                _PROVIDER_LIMITERS[provider] = limiter
+                if limits:
+                    logging.info(f"Rate limiting provider '{provider}': {limits}")
+    return limiter
+
+
+if __name__ == '__main__':
+    print("Rate Limiter Module - Test Run")
+
+    bucket = TokenBucket(rate_per_minute=600, capacity=5) # 10 requests/second, bursts of 5
+    start = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    print(f"15 acquisitions at 10/s with burst 5 took {time.monotonic() - start:.2f}s (expected ~1.0s)")
+
+    aimd = AdaptiveConcurrencyLimiter(initial_limit=8, max_limit=16, decrease_cooldown_seconds=0)
+    aimd.on_throttle()
+    print(f"Limit after throttle: {aimd.limit:.1f} (expected 4.0)")
+    for _ in range(20):
+        aimd.on_success()
+    print(f"Limit after 20 successes: {aimd.limit:.1f}")
+
+    print(f"Throttling detection for 'Error code: 429 - rate limit': {is_throttling_error(Exception('Error code: 429 - Rate limit reached'))}")
+    print("Rate Limiter Module - Test Run Finished")
@@ -0,0 +1,173 @@
+# teacher_agent_generator/scripts/resilience.py
+import logging
+import os
+import random
+import threading
+import time
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+import rate_limiter
+
+
+class ProviderError(Exception):
+    """An error reported by an LLM provider. `status_code` is the HTTP-like status, if known."""
+
+    def __init__(self, message, status_code=None, code=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+class FatalProviderError(ProviderError):
+    """A provider error that retrying cannot fix (missing SDK, missing API key, invalid request...)."""
+
+class CircuitOpenError(ProviderError):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+# HTTP statuses worth retrying: request timeout, conflict, throttling and server-side failures
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+# Exception class-name fragments used by the SDKs (openai, httpx, requests, ollama) for transient network failures
+_RETRYABLE_EXCEPTION_NAME_FRAGMENTS = ("timeout", "connection", "connect", "transport", "network", "remoteprotocol")
+
+def is_retryable_error(error) -> bool:
+    """
+    Classifies a provider error as retryable (transient) or fatal.
+
+    Retryable: throttling, timeouts, connection failures and 5xx responses.
+    Fatal: everything else, e.g. authentication failures, invalid requests, unknown models
+    and FatalProviderError (missing SDK or API key).
+    """
+    if isinstance(error, FatalProviderError):
+        return False
+    if rate_limiter.is_throttling_error(error):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None:
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status_code is not None:
+        try:
+            return int(status_code) in RETRYABLE_STATUS_CODES
+        except (TypeError, ValueError):
+            return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    for cls in type(error).__mro__:
+        name = cls.__name__.lower()
+        if any(fragment in name for fragment in _RETRYABLE_EXCEPTION_NAME_FRAGMENTS):
+            return True
+    return False
+
+def backoff_delay(attempt, base_delay=None, max_delay=None) -> float:
+    """
+    Returns the delay before retry number `attempt` (1-based): exponential backoff with full jitter,
+    i.e. a uniform random value in [0, min(max_delay, base_delay * 2 ** (attempt - 1))].
+    """
+    base_delay = base_delay if base_delay is not None else config.LLM_RETRY_BASE_DELAY_SECONDS
+    max_delay = max_delay if max_delay is not None else config.LLM_RETRY_MAX_DELAY_SECONDS
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    closed    - calls pass through; `failure_threshold` consecutive retryable failures open the circuit.
+    open      - calls fail fast with CircuitOpenError until `reset_timeout_seconds` have passed.
+    half-open - a single trial call is let through; success closes the circuit, failure re-opens it.
+
+    Only transient failures (see is_retryable_error) count: a rejected request says nothing
+    about whether the endpoint is up.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=None, reset_timeout_seconds=None):
+        self.name = name
+        self.failure_threshold = failure_threshold if failure_threshold is not None else config.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout_seconds = (reset_timeout_seconds if reset_timeout_seconds is not None
+                                      else config.CIRCUIT_BREAKER_RESET_SECONDS)
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call must not be attempted right now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout_seconds:
+                    raise CircuitOpenError(f"Circuit breaker for '{self.name}' is open; failing fast.")
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._trial_in_flight:
+                    raise CircuitOpenError(f"Circuit breaker for '{self.name}' is half-open; trial call in progress.")
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info(f"Circuit breaker for '{self.name}' closed after a successful call.")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, error):
+        if not is_retryable_error(error):
+            with self._lock:
+                self._trial_in_flight = False # The endpoint answered, so it is reachable
+                if self.state == self.HALF_OPEN:
+                    self.state = self.CLOSED
+            return
+        with self._lock:
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logging.error(f"Circuit breaker for '{self.name}' opened after {self.consecutive_failures} consecutive failures.")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_CIRCUIT_BREAKERS = {}
+_CIRCUIT_BREAKERS_LOCK = threading.Lock()
+
+def get_circuit_breaker(name) -> CircuitBreaker:
+    """Returns the shared circuit breaker for an endpoint name (e.g. a provider), creating it on first use."""
+    breaker = _CIRCUIT_BREAKERS.get(name)
+    if breaker is None:
+        with _CIRCUIT_BREAKERS_LOCK:
+            breaker = _CIRCUIT_BREAKERS.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+if __name__ == '__main__':
+    print("Resilience Module - Test Run")
+    print(f"Timeout retryable: {is_retryable_error(TimeoutError('read timed out'))}")
+    print(f"HTTP 503 retryable: {is_retryable_error(ProviderError('unavailable', status_code=503))}")
+    print(f"HTTP 401 retryable: {is_retryable_error(ProviderError('unauthorized', status_code=401))}")
+    print(f"Missing API key retryable: {is_retryable_error(FatalProviderError('no key'))}")
+    print(f"Backoff delays (attempts 1-5): {[round(backoff_delay(a, 1.0, 30.0), 2) for a in range(1, 6)]}")
+
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout_seconds=0.1)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure(TimeoutError())
+    try:
+        breaker.before_call()
+    except CircuitOpenError as e:
+        print(f"Open circuit fails fast: {e}")
+    time.sleep(0.15)
+    breaker.before_call() # Half-open trial
+    breaker.record_success()
+    print(f"State after successful trial: {breaker.state}")
+    print("Resilience Module - Test Run Finished")
@@ -0,0 +1,172 @@
+# teacher_agent_generator/scripts/response_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+
+CACHE_MODES = ("off", "read", "readwrite")
+
+
+def cache_key(provider, model_name, system_prompt, user_prompt, temperature, max_tokens) -> str:
+    """
+    Returns a stable SHA-256 digest identifying one generation request.
+    The digest is independent of process and PYTHONHASHSEED, so it can be reused across runs.
+    """
+    payload = json.dumps([provider, model_name, system_prompt, user_prompt, temperature, max_tokens],
+                         ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Content-addressed, disk-backed cache of LLM responses stored in a single SQLite file.
+
+    Entries are keyed by cache_key(). The cache is kept under `max_bytes` of stored response
+    text by evicting least-recently-used entries. The stored size is read once when the cache
+    opens and kept up to date on writes; hits only queue their LRU refresh, which is written
+    with the next put() (or on close). A single connection guarded by a lock is shared across
+    threads, so the cache can be used from the concurrent drivers.
+
+    Modes:
+        'off'       - lookups always miss and nothing is stored.
+        'read'      - serve hits, never store new responses.
+        'readwrite' - serve hits and store new responses.
+    """
+
+    def __init__(self, path=None, mode="readwrite", max_bytes=None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Invalid cache mode '{mode}'. Expected one of: {', '.join(CACHE_MODES)}")
+        self.path = path or config.RESPONSE_CACHE_PATH
+        self.mode = mode
+        self.max_bytes = max_bytes if max_bytes is not None else config.RESPONSE_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = 0
+        self._pending_access = {} # key -> last access time not yet written
+        if mode != "off":
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size_bytes INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            self._conn.commit()
+            self._total_bytes = self._stored_bytes()
+            logging.info(f"Response cache enabled (mode={mode}, path={self.path}, max_bytes={self.max_bytes}).")
+
+    def get(self, key):
+        """Returns the cached response for `key`, or None on a miss. Refreshes the entry's LRU position."""
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if self.mode == "readwrite":
+                self._pending_access[key] = time.time()
+                if len(self._pending_access) >= config.RESPONSE_CACHE_ACCESS_FLUSH_ENTRIES:
+                    self._flush_access_times()
+                    self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        """Stores `response` under `key` (readwrite mode only), evicting LRU entries if over the size limit."""
+        if self._conn is None or self.mode != "readwrite" or response is None:
+            return
+        size_bytes = len(response.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            replaced = self._conn.execute("SELECT size_bytes FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size_bytes, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size_bytes, now, now)
+            )
+            self._pending_access.pop(key, None)
+            self._total_bytes += size_bytes - (replaced[0] if replaced else 0)
+            self.writes += 1
+            self._flush_access_times()
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM responses").fetchone()[0]
+
+    def _flush_access_times(self):
+        """Writes the queued LRU refreshes of cache hits (without committing). Caller holds the lock."""
+        if self._pending_access:
+            self._conn.executemany("UPDATE responses SET last_access = ? WHERE key = ?",
+                                   [(accessed, key) for key, accessed in self._pending_access.items()])
+            self._pending_access.clear()
+
+    def _evict(self):
+        """Deletes least-recently-used entries until the stored size is within max_bytes. Caller holds the lock."""
+        total_bytes = self._total_bytes
+        cursor = self._conn.execute("SELECT key, size_bytes FROM responses ORDER BY last_access ASC")
+        keys_to_evict = []
+        for key, size_bytes in cursor:
+            if total_bytes <= self.max_bytes:
+                break
+            keys_to_evict.append((key,))
+            total_bytes -= size_bytes
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", keys_to_evict)
+        self._total_bytes = total_bytes
+        self.evictions += len(keys_to_evict)
+
+    def stats(self) -> dict:
+        """Returns this run's hit/miss/write/eviction counters."""
+        return {"mode": self.mode, "hits": self.hits, "misses": self.misses,
+                "writes": self.writes, "evictions": self.evictions}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._flush_access_times()
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    print("Response Cache Module - Test Run")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cache = ResponseCache(os.path.join(tmp_dir, "cache.sqlite3"), mode="readwrite", max_bytes=20)
+        key_a = cache_key("ollama", "llama3", "system", "question A", 0.0, 100)
+        key_b = cache_key("ollama", "llama3", "system", "question B", 0.0, 100)
+        print(f"Miss before store: {cache.get(key_a) is None}")
+        cache.put(key_a, "answer A (12b)")
+        print(f"Hit after store: {cache.get(key_a)}")
+        cache.put(key_b, "answer B (12b)") # Pushes the total over 20 bytes, evicting A
+        print(f"A evicted: {cache.get(key_a) is None}, B cached: {cache.get(key_b) is not None}")
+        print(f"Stats: {cache.stats()}")
+        cache.close()
+    print("Response Cache Module - Test Run Finished")
@@ -0,0 +1,221 @@
+# teacher_agent_generator/scripts/scheduling.py
+import collections
+import contextlib
+import hashlib
+import itertools
+import math
+import os
+import threading
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+
+# 'fifo'         - requests go out in grid order as soon as a slot is free.
+# 'prompt_group' - requests sharing a system prompt are pinned to one lane, and the first request
+#                  of each prompt runs alone so the rest find its prefix in the provider's cache.
+# 'longest_first' - the drivers issue the jobs expected to take longest first (see order_longest_first),
+#                  so the end of a concurrent run is not held up by a few long generations.
+SCHEDULING_POLICIES = ("fifo", "prompt_group", "longest_first")
+
+# Smoothing of the observed seconds per expected token in JobCostModel (weight of the newest observation)
+COST_MODEL_SMOOTHING = 0.1
+
+
+def prompt_digest(system_prompt) -> str:
+    """Returns a stable SHA-256 hex digest of a system prompt, used to group requests that share it."""
+    return hashlib.sha256((system_prompt or "").encode('utf-8')).hexdigest()
+
+
+class _PromptGroup:
+    __slots__ = ("lane", "warm", "leader_in_flight", "in_flight")
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.warm = False
+        self.leader_in_flight = False
+        self.in_flight = 0
+
+
+class PromptGroupScheduler:
+    """
+    Orders and routes in-flight requests by system-prompt digest to maximise provider prefix-cache reuse.
+
+    The personas' system prompts are long and fixed, so every request of a persona shares the same
+    prefix. Ollama keeps the last evaluated context per model slot, and DeepSeek/Qwen cache prompt
+    prefixes server-side (and bill cache hits at a lower rate). Both only help if requests for
+    the same prompt do not all prefill it at once, and if they reach the same connection or host.
+
+    - Lane pinning: each digest is assigned to one of `lane_count` lanes, the least busy one on first
+      sight (ties go to the lane with the fewest pinned prompts), and keeps that lane while it stays
+      in the recent-digest table. A lane selects a
+      dedicated client and connection pool (see llm_interface.get_client).
+    - Warm-up gating: the first request of a digest runs alone. Other requests for that digest wait
+      until it finishes (successfully or not), then proceed concurrently against a warm prefix.
+
+    Thread-safe. Requests for different digests never wait on each other here.
+    """
+
+    def __init__(self, lane_count=None, max_tracked_groups=None):
+        self.lane_count = max(1, lane_count if lane_count is not None else config.PROMPT_SCHEDULER_LANES)
+        self.max_tracked_groups = max_tracked_groups or self.lane_count * 16
+        self.groups_seen = 0
+        self.warmup_waits = 0
+        self._lane_in_flight = [0] * self.lane_count
+        self._lane_groups = [0] * self.lane_count
+        self._groups = collections.OrderedDict() # digest -> _PromptGroup, least recently used first
+        self._condition = threading.Condition()
+
+    def _get_group(self, digest):
+        """Returns the group for `digest`, creating and pinning it to the least busy lane. Caller holds the lock."""
+        group = self._groups.get(digest)
+        if group is not None:
+            self._groups.move_to_end(digest)
+            return group
+        # Least busy lane; among equally busy lanes, the one with the fewest pinned groups
+        lane = min(range(self.lane_count), key=lambda i: (self._lane_in_flight[i], self._lane_groups[i], i))
+        group = self._groups[digest] = _PromptGroup(lane)
+        self._lane_groups[lane] += 1
+        self.groups_seen += 1
+        # Forget idle groups beyond the table size; their prefixes have most likely been evicted by now.
+        for stale_digest in [d for d, g in self._groups.items() if g.in_flight == 0 and d != digest]:
+            if len(self._groups) <= self.max_tracked_groups:
+                break
+            self._lane_groups[self._groups.pop(stale_digest).lane] -= 1
+        return group
+
+    @contextlib.contextmanager
+    def slot(self, system_prompt):
+        """
+        Waits until a request with this system prompt may be sent, then yields its lane index.
+        Leaving the block marks the request finished.
+        """
+        digest = prompt_digest(system_prompt)
+        with self._condition:
+            group = self._get_group(digest)
+            waited = False
+            while not group.warm and group.leader_in_flight:
+                waited = True
+                self._condition.wait()
+            is_leader = not group.warm
+            if is_leader:
+                group.leader_in_flight = True
+            if waited:
+                self.warmup_waits += 1
+            group.in_flight += 1
+            self._lane_in_flight[group.lane] += 1
+            lane = group.lane
+        try:
+            yield lane
+        finally:
+            with self._condition:
+                group.in_flight -= 1
+                self._lane_in_flight[lane] -= 1
+                if is_leader:
+                    group.leader_in_flight = False
+                    group.warm = True
+                    self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"lanes": self.lane_count, "prompt_groups": self.groups_seen, "warmup_waits": self.warmup_waits}
+
+
+class JobCostModel:
+    """
+    Estimates how long a job will take, for longest-first ordering.
+
+    A job is described by a cost class (e.g. its task type) and its expected output tokens, estimated
+    by the driver from the task. The estimate is expected tokens times the seconds per expected token
+    observed for the class so far: an exponentially smoothed average over finished jobs, falling back
+    to the average over all classes, and to 1.0 before anything was observed. Observations thus correct
+    expected-token tables that are off for a given model or provider.
+
+    Thread-safe.
+    """
+
+    def __init__(self, smoothing=COST_MODEL_SMOOTHING):
+        self.smoothing = smoothing
+        self.observations = 0
+        self._seconds_per_token = {} # cost class -> smoothed seconds per expected token
+        self._overall_seconds_per_token = None
+        self._lock = threading.Lock()
+
+    def estimate(self, cost_class, expected_tokens) -> float:
+        with self._lock:
+            rate = self._seconds_per_token.get(cost_class, self._overall_seconds_per_token or 1.0)
+        return expected_tokens * rate
+
+    def observe(self, cost_class, expected_tokens, seconds):
+        """Records the latency of a finished job. Ignored without a positive latency and token estimate."""
+        if not seconds or seconds <= 0 or expected_tokens <= 0:
+            return
+        rate = seconds / expected_tokens
+        with self._lock:
+            self.observations += 1
+            previous = self._seconds_per_token.get(cost_class)
+            self._seconds_per_token[cost_class] = rate if previous is None else previous + self.smoothing * (rate - previous)
+            overall = self._overall_seconds_per_token
+            self._overall_seconds_per_token = rate if overall is None else overall + self.smoothing * (rate - overall)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"observations": self.observations,
+                    "seconds_per_token": {cost_class: round(rate, 5) for cost_class, rate in self._seconds_per_token.items()}}
+
+def order_longest_first(items, estimate_cost, window_size=None):
+    """
+    Re-orders a stream of jobs (or units of work) so the most expensive ones are issued first.
+
+    Items are read in windows of `window_size`, so memory stays bounded for any grid size, and each
+    window is sorted by `estimate_cost(item)` at the time it is read, using whatever the cost model
+    has observed by then. Costs are compared in buckets of a factor of about 1.4, and items of the same
+    bucket keep their original (persona-major) order, which keeps a persona's requests together for
+    the provider's prefix cache.
+    """
+    window_size = window_size or config.LONGEST_FIRST_WINDOW_JOBS
+    items = iter(items)
+    while True:
+        window = list(itertools.islice(items, window_size))
+        if not window:
+            return
+        costs = [estimate_cost(item) for item in window]
+        buckets = [math.floor(math.log2(cost) * 2) if cost > 0 else -math.inf for cost in costs]
+        order = sorted(range(len(window)), key=lambda i: -buckets[i]) # Stable: ties keep their order
+        yield from (window[i] for i in order)
+
+
+if __name__ == '__main__':
+    import time
+    import concurrent.futures
+
+    print("Scheduling Module - Test Run")
+    scheduler = PromptGroupScheduler(lane_count=2)
+    order = []
+
+    def fake_request(prompt, index):
+        with scheduler.slot(prompt) as lane:
+            order.append((prompt, index, lane))
+            time.sleep(0.05)
+
+    jobs = [("persona A", i) for i in range(3)] + [("persona B", i) for i in range(3)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
+        list(executor.map(lambda job: fake_request(*job), jobs))
+    for prompt in ("persona A", "persona B"):
+        lanes = {lane for p, _, lane in order if p == prompt}
+        first = next(index for p, index, _ in order if p == prompt)
+        print(f"{prompt}: lanes used {lanes}, first request sent: #{first}")
+    print(f"Stats: {scheduler.stats()}")
+
+    cost_model = JobCostModel()
+    cost_model.observe("likert_scale", 10, 0.5) # Short answers take longer per token than expected
+    tasks = [("likert_scale", 10), ("open_ended", 400), ("likert_scale", 10), ("open_ended", 400)]
+    ordered = list(order_longest_first(enumerate(tasks), lambda item: cost_model.estimate(*item[1])))
+    print(f"Longest-first order: {[index for index, _ in ordered]}; cost model: {cost_model.stats()}")
+    print("Scheduling Module - Test Run Finished")
@@ -0,0 +1,165 @@
+# teacher_agent_generator/scripts/sharding.py
+import argparse
+import hashlib
+import heapq
+import json
+import logging
+import os
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of local modules from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import prompt_store
+import result_writer
+
+# Output kinds the merge command understands: record fields identifying a unit of work, and the error field
+OUTPUT_KINDS = {
+    "teacher": (result_writer.TEACHER_RECORD_KEY_FIELDS, "error"),
+    "mtpe": (result_writer.MTPE_RECORD_KEY_FIELDS, "generation_error"),
+}
+
+
+def parse_shard_spec(spec):
+    """
+    Parses a shard spec 'i/N' into (i, N), with 0 <= i < N.
+
+    Raises:
+        ValueError: If the spec is malformed or out of range.
+    """
+    try:
+        index_str, count_str = spec.split('/')
+        shard_index, shard_count = int(index_str), int(count_str)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid shard spec '{spec}'. Expected 'i/N', e.g. '0/4'.")
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard spec '{spec}'. Shard index must satisfy 0 <= i < N.")
+    return shard_index, shard_count
+
+def shard_for(persona_key, task_key, shard_count) -> int:
+    """
+    Returns the shard (0..shard_count-1) that owns the (persona, task) pair.
+
+    Uses SHA-256 rather than hash(), so the assignment is the same on every machine and run
+    regardless of PYTHONHASHSEED.
+    """
+    digest = hashlib.sha256(f"{persona_key}\x1f{task_key}".encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % shard_count
+
+def in_shard(persona_key, task_key, shard) -> bool:
+    """True if the pair belongs to `shard`, an (index, count) tuple from parse_shard_spec (None means unsharded)."""
+    if shard is None:
+        return True
+    shard_index, shard_count = shard
+    return shard_for(persona_key, task_key, shard_count) == shard_index
+
+def shard_filename_suffix(shard) -> str:
+    """Returns a filename suffix like '_shard0of4' for a shard tuple, or '' when unsharded."""
+    return f"_shard{shard[0]}of{shard[1]}" if shard else ""
+
+
+# --- Merging shard outputs ---
+
+def _grid_position(record):
+    position = record.get("grid_position")
+    return position if isinstance(position, int) else float('inf')
+
+def _iter_records_by_grid_position(path):
+    """
+    Yields the records of one shard output in grid_position order.
+    A shard written in a single pass is already sorted and is streamed; a shard extended
+    with --resume, written under --schedule longest_first or covering more than one block of
+    MTPE tasks (config.MTPE_TASK_BLOCK_SIZE) may be out of order, in which case it is loaded and sorted.
+    """
+    previous_position = float('-inf')
+    is_sorted = True
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            position = _grid_position(json.loads(line))
+            if position < previous_position:
+                is_sorted = False
+                break
+            previous_position = position
+
+    with open(path, 'r', encoding='utf-8') as f:
+        records = (json.loads(line) for line in f if line.strip())
+        if is_sorted:
+            yield from records
+        else:
+            logging.warning(f"Shard output {path} is not in grid order (resumed, longest_first or multi-block MTPE run?); sorting it in memory.")
+            yield from sorted(records, key=_grid_position)
+
+def merge_shard_outputs(input_paths, output_path, kind):
+    """
+    K-way merges shard output files into one file ordered like a single-node run.
+
+    Records are merged by 'grid_position'. When the same unit of work (see OUTPUT_KINDS) appears
+    more than once, e.g. a failure followed by a successful retry, the last successful record is kept,
+    or the last record if none succeeded. Side tables of normalized shard outputs (see prompt_store)
+    are unioned into side tables of the merged output.
+
+    Args:
+        input_paths (list): Shard JSONL outputs.
+        output_path (str): Merged output path (written atomically).
+        kind (str): 'teacher' or 'mtpe'.
+
+    Returns:
+        tuple: (records_written, duplicates_dropped)
+
+    Raises:
+        ValueError: If an input is a Parquet file.
+    """
+    key_fields, error_field = OUTPUT_KINDS[kind]
+    parquet_inputs = [path for path in input_paths if path.endswith(result_writer.PARQUET_EXTENSION)]
+    if parquet_inputs:
+        raise ValueError(f"Only JSONL shard outputs can be merged, got Parquet: {', '.join(parquet_inputs)}")
+    merged = heapq.merge(*(_iter_records_by_grid_position(path) for path in input_paths), key=_grid_position)
+
+    duplicates_dropped = 0
+    with result_writer.JsonlResultWriter(output_path) as writer:
+        current_position = None
+        group = {} # key -> chosen record, for records sharing the current grid_position
+        for record in merged:
+            position = _grid_position(record)
+            if position != current_position:
+                for chosen in group.values():
+                    writer.write(chosen)
+                group = {}
+                current_position = position
+            key = tuple(record.get(field) for field in key_fields)
+            existing = group.get(key)
+            if existing is not None:
+                duplicates_dropped += 1
+                if not existing.get(error_field) and record.get(error_field):
+                    continue # Keep the earlier success over a later failure
+            group[key] = record
+        for chosen in group.values():
+            writer.write(chosen)
+    prompt_store.merge_side_tables(input_paths, output_path)
+    return writer.records_written, duplicates_dropped
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(module)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description="Utilities for sharded generation runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    merge_parser = subparsers.add_parser("merge", help="K-way merge shard JSONL outputs into one deduplicated file.")
+    merge_parser.add_argument("inputs", nargs='+', help="Shard output JSONL files.")
+    merge_parser.add_argument("--output", required=True, help="Path of the merged JSONL file.")
+    merge_parser.add_argument("--kind", choices=sorted(OUTPUT_KINDS), required=True,
+                              help="Output type: 'teacher' (main_generator) or 'mtpe' (main_translator_mtpe).")
+    args = parser.parse_args()
+
+    if args.command == "merge":
+        try:
+            written, dropped = merge_shard_outputs(args.inputs, args.output, args.kind)
+        except ValueError as e:
+            parser.error(str(e))
+        print(f"Merged {len(args.inputs)} shard files into {args.output}: {written} records, {dropped} duplicates dropped.")
@@ -1,4 +1,6 @@
 # teacher_agent_generator/scripts/task_loader.py
+import gzip
+import io
 import json
 import logging
 import os
@@ -19,9 +21,22 @@ logging.basicConfig(level=config.LOG_LEVEL.upper() if hasattr(config, 'LOG_LEVEL
                     filename=config.LOG_FILE if hasattr(config, 'LOG_FILE') else None,
                     filemode='a')
 
+try:
+    import orjson # Optional; several times faster than json for large JSONL task files
+    _parse_json_line = orjson.loads
+    _JSON_DECODE_ERRORS = (orjson.JSONDecodeError, ValueError)
+except ImportError:
+    _parse_json_line = json.loads
+    _JSON_DECODE_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
 # Define required fields for MTPE tasks for basic validation
 MTPE_TASK_REQUIRED_FIELDS = ["task_id", "source_text_ch", "machine_translation_en"]
 
+_GZIP_MAGIC = b"\x1f\x8b"
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# Bad line numbers listed in the summary warning; the rest are only counted
+MAX_REPORTED_BAD_LINES = 5
+
 def _load_open_ended_questions(file_path=config.QUESTIONS_FILE):
     """Loads open-ended questions from a text file."""
     if not file_path: # Handle None path
@@ -74,38 +89,78 @@ def _load_questionnaire_items(file_path=config.QUESTIONNAIRE_FILE):
         logging.error(f"Error loading questionnaire items from {file_path}: {e}")
         return []
 
-def _load_mtpe_tasks(file_path: str) -> list[dict]:
-    """Loads MTPE tasks from a JSONL file."""
+def open_task_file(file_path: str):
+    """
+    Opens a task file for reading in binary mode, transparently decompressing gzip or zstd input.
+    The compression is detected from the file's first bytes, not its extension.
+    zstd input requires the optional 'zstandard' package.
+    """
+    with open(file_path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(file_path, 'rb')
+    if magic.startswith(_ZSTD_MAGIC):
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError(f"{file_path} is zstd-compressed; install the 'zstandard' package to read it.")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(file_path, 'rb'), closefd=True)
+        return io.BufferedReader(reader) # Adds line iteration
+    return open(file_path, 'rb')
+
+def iter_mtpe_tasks(file_path: str, stats: dict = None, report: bool = True):
+    """
+    Yields validated MTPE tasks from a (possibly gzip/zstd-compressed) JSONL file one at a time,
+    so arbitrarily large task files are read in bounded memory.
+
+    Malformed lines and tasks missing required fields are skipped and counted rather than logged
+    one by one; a single summary warning with the first few line numbers is logged at the end.
+
+    Args:
+        file_path (str): Path to the MTPE tasks JSONL file (.jsonl, .jsonl.gz or .jsonl.zst).
+        stats (dict, optional): Updated in place with 'loaded', 'invalid_json' and 'missing_fields' counts.
+        report (bool): Log the summary at the end. Pass False when re-reading a file already reported.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(loaded=0, invalid_json=0, missing_fields=0)
     if not file_path or not os.path.exists(file_path):
         logging.info(f"MTPE tasks file not found or path not configured: {file_path}. Skipping MTPE task loading.")
-        return []
+        return
+
+    bad_lines = []
+    with open_task_file(file_path) as f:
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                task = _parse_json_line(line)
+            except _JSON_DECODE_ERRORS:
+                stats["invalid_json"] += 1
+                if len(bad_lines) < MAX_REPORTED_BAD_LINES:
+                    bad_lines.append(line_num)
+                continue
+            if not isinstance(task, dict) or any(not task.get(field) for field in MTPE_TASK_REQUIRED_FIELDS):
+                stats["missing_fields"] += 1
+                if len(bad_lines) < MAX_REPORTED_BAD_LINES:
+                    bad_lines.append(line_num)
+                continue
+            task["type"] = "mtpe_task"
+            stats["loaded"] += 1
+            yield task
+
+    if not report:
+        return
+    if stats["invalid_json"] or stats["missing_fields"]:
+        logging.warning(f"Skipped {stats['invalid_json']} malformed JSON lines and {stats['missing_fields']} tasks missing "
+                        f"required fields ({', '.join(MTPE_TASK_REQUIRED_FIELDS)}) in {file_path}; "
+                        f"first bad lines: {', '.join(map(str, bad_lines))}.")
+    logging.info(f"Read {stats['loaded']} MTPE tasks from {file_path}.")
 
-    mtpe_tasks = []
+def _load_mtpe_tasks(file_path: str) -> list[dict]:
+    """Loads all MTPE tasks from a JSONL file into a list. Prefer iter_mtpe_tasks() for large files."""
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            for line_num, line in enumerate(f):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    task = json.loads(line)
-                    # Validate required fields
-                    missing_fields = [field for field in MTPE_TASK_REQUIRED_FIELDS if field not in task or not task[field]]
-                    if missing_fields:
-                        logging.warning(f"MTPE task on line {line_num+1} in {file_path} is missing required fields: {', '.join(missing_fields)}. Skipping task.")
-                        continue
-
-                    # Add a type field for consistency if desired, or handle in main_generator
-                    task["type"] = "mtpe_task"
-                    mtpe_tasks.append(task)
-                except json.JSONDecodeError:
-                    logging.error(f"Error decoding JSON from MTPE task file {file_path} on line {line_num+1}. Skipping line.")
-                    continue
-        logging.info(f"Successfully loaded {len(mtpe_tasks)} MTPE tasks from {file_path}.")
-        return mtpe_tasks
-    except FileNotFoundError: # Should be caught by os.path.exists, but as a safeguard
-        logging.error(f"MTPE tasks file not found: {file_path}")
-        return []
+        return list(iter_mtpe_tasks(file_path))
     except Exception as e:
         logging.error(f"Error loading MTPE tasks from {file_path}: {e}", exc_info=True)
         return []
@@ -0,0 +1,238 @@
+# teacher_agent_generator/scripts/token_budget.py
+import collections
+import functools
+import logging
+import math
+import os
+import threading
+
+# If this script is run directly, add its directory to sys.path
+# to allow direct import of 'config' from the same directory.
+if __name__ == '__main__':
+    import sys
+    _CURRENT_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+    if _CURRENT_SCRIPT_DIR not in sys.path:
+        sys.path.insert(0, _CURRENT_SCRIPT_DIR)
+
+import config
+import rate_limiter
+
+# 'fixed'    - every request reserves the run's max_tokens
+# 'adaptive' - each request reserves what outputs of its class have needed so far (see TokenBudget)
+MAX_TOKENS_MODES = ("fixed", "adaptive")
+
+_UNLOADED = object()
+_ENCODING = _UNLOADED
+_ENCODING_LOCK = threading.Lock()
+
+def _load_encoding():
+    """Returns the tiktoken encoding named by config.TOKENIZER_ENCODING, or None (not installed, disabled or unavailable)."""
+    global _ENCODING
+    if _ENCODING is _UNLOADED:
+        with _ENCODING_LOCK:
+            if _ENCODING is _UNLOADED:
+                encoding = None
+                if config.TOKENIZER_ENCODING:
+                    try:
+                        import tiktoken # Optional; imported on first use so startup never pays for it
+                        encoding = tiktoken.get_encoding(config.TOKENIZER_ENCODING)
+                    except ImportError:
+                        logging.info("tiktoken is not installed; token counts are estimated from characters.")
+                    except Exception as e: # E.g. the encoding file cannot be downloaded
+                        logging.warning(f"Could not load tokenizer '{config.TOKENIZER_ENCODING}': {e}. Token counts are estimated from characters.")
+                _ENCODING = encoding
+    return _ENCODING
+
+def tokenizer_name() -> str:
+    encoding = _load_encoding()
+    return f"tiktoken {encoding.name}" if encoding is not None else "character estimate"
+
+@functools.lru_cache(maxsize=4096) # System prompts repeat for every task of a persona
+def count_tokens(text) -> int:
+    """
+    Counts the tokens of `text` with the tiktoken encoding if available, else estimates them from characters
+    (rate_limiter.estimate_tokens). Provider tokenizers differ, so counts for non-OpenAI models are approximate;
+    CONTEXT_MARGIN_TOKENS absorbs the difference together with the chat template.
+    """
+    if not text:
+        return 0
+    encoding = _load_encoding()
+    if encoding is None:
+        return rate_limiter.estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def context_window(provider, override=None) -> int:
+    """Context window (prompt + output tokens) assumed for a provider, unless `override` is given."""
+    if override:
+        return override
+    return config.CONTEXT_WINDOW_TOKENS.get(provider, config.DEFAULT_CONTEXT_WINDOW_TOKENS)
+
+def _nearest_rank(values, percentile):
+    ordered = sorted(values)
+    return ordered[max(1, math.ceil(len(ordered) * percentile / 100)) - 1]
+
+
+class TokenBudget:
+    """
+    Pre-flight token accounting and max_tokens sizing for the requests of one run.
+
+    plan() counts a request's prompt tokens and picks its max_tokens:
+    - 'fixed' mode reserves `max_tokens` for every request.
+    - 'adaptive' mode reserves expected_tokens x the `percentile` of observed output/expected ratios for the
+      request's class (e.g. its task type) x `headroom`, rounded up to MAX_TOKENS_STEP and capped at
+      `max_tokens`. Until `min_samples` outputs of the class are known, the cap is used. A response that
+      fills a sized limit was probably cut off; generate() then repeats the request with the cap.
+    Either way, max_tokens is reduced to what is left of the context window after the prompt. A request
+    whose prompt leaves less than MIN_MAX_TOKENS is reported as an overflow and keeps the cap: token counts
+    are approximate, so the provider decides whether it fits.
+
+    Thread-safe.
+    """
+
+    def __init__(self, max_tokens, context_window_tokens, mode="fixed", percentile=None, headroom=None, min_samples=None, window=None):
+        if mode not in MAX_TOKENS_MODES:
+            raise ValueError(f"Invalid max_tokens mode '{mode}'. Expected one of: {', '.join(MAX_TOKENS_MODES)}")
+        self.max_tokens = max_tokens
+        self.context_window_tokens = context_window_tokens
+        self.mode = mode
+        self.percentile = percentile or config.MAX_TOKENS_PERCENTILE
+        self.headroom = headroom or config.MAX_TOKENS_HEADROOM
+        self.min_samples = min_samples or config.MAX_TOKENS_MIN_SAMPLES
+        self.window = window or config.MAX_TOKENS_WINDOW
+        self.requests = 0
+        self.sized_requests = 0
+        self.reserved_tokens = 0
+        self.escalations = 0
+        self.overflows = 0
+        self.splits = 0
+        self.clamped = 0
+        self._ratios = {} # class -> deque of recent output/expected token ratios
+        self._warned_classes = set()
+        self._lock = threading.Lock()
+
+    def _sized_limit(self, cost_class, expected_tokens):
+        """The adaptive max_tokens for a request, or None while too few outputs of its class are known."""
+        with self._lock:
+            ratios = self._ratios.get(cost_class)
+            if ratios is None or len(ratios) < self.min_samples:
+                return None
+            ratio = _nearest_rank(ratios, self.percentile)
+        step = config.MAX_TOKENS_STEP
+        limit = math.ceil(expected_tokens * ratio * self.headroom / step) * step
+        return max(config.MIN_MAX_TOKENS, limit)
+
+    def plan(self, cost_class, expected_tokens, system_prompt, user_prompt) -> dict:
+        """
+        Accounts for one request before it is sent.
+
+        Returns:
+            dict: {
+                "prompt_tokens": int - counted system and user prompt tokens,
+                "max_tokens": int - the limit to request,
+                "sized": bool - True if max_tokens was sized from observed outputs (a full response is then retried with the cap),
+                "overflow": bool - True if the prompt leaves less than MIN_MAX_TOKENS of the context window
+                            (max_tokens is then the cap),
+            }
+        """
+        prompt_tokens = count_tokens(system_prompt) + count_tokens(user_prompt)
+        limit, sized = self.max_tokens, False
+        if self.mode == "adaptive" and self.max_tokens > 0:
+            sized_limit = self._sized_limit(cost_class, expected_tokens)
+            if sized_limit is not None and sized_limit < self.max_tokens:
+                limit, sized = sized_limit, True
+        available = self.context_window_tokens - prompt_tokens - config.CONTEXT_MARGIN_TOKENS
+        overflow = available < config.MIN_MAX_TOKENS
+        clamped = not overflow and (limit <= 0 or limit > available) # limit <= 0 means no limit
+        if overflow:
+            limit, sized = self.max_tokens, False # A near-empty limit would only cut the answer off; callers split or warn
+        elif clamped:
+            limit, sized = available, False
+        warn_expected = not sized and not overflow and expected_tokens > limit
+        with self._lock:
+            self.requests += 1
+            self.sized_requests += sized
+            self.overflows += overflow
+            self.clamped += clamped
+            self.reserved_tokens += prompt_tokens + max(limit, 0)
+            warn_expected = warn_expected and cost_class not in self._warned_classes
+            if warn_expected:
+                self._warned_classes.add(cost_class)
+        if warn_expected:
+            logging.warning(f"Requests of class '{cost_class}' are expected to produce ~{expected_tokens:.0f} tokens but may only "
+                            f"produce {limit}; responses may be cut off (raise --max_tokens or --context_window).")
+        return {"prompt_tokens": prompt_tokens, "max_tokens": limit, "sized": sized, "overflow": overflow}
+
+    def observe(self, cost_class, expected_tokens, output_tokens):
+        """Records the output length of a finished request. Ignored without positive counts."""
+        if not output_tokens or not expected_tokens or expected_tokens <= 0:
+            return
+        with self._lock:
+            ratios = self._ratios.get(cost_class)
+            if ratios is None:
+                ratios = self._ratios[cost_class] = collections.deque(maxlen=self.window)
+            ratios.append(output_tokens / expected_tokens)
+
+    def generate(self, call, cost_class, expected_tokens, request_plan):
+        """
+        Runs `call(max_tokens)` (returning a generation result, see llm_interface.generate_response_detailed)
+        with the planned limit, repeats it with the cap if a sized limit was filled, and observes the output.
+        Cache hits are not repeated: callers key the cache on the cap (see generate_response_detailed's
+        cache_max_tokens), and an escalated response overwrites the cut-off one.
+
+        Returns:
+            dict: The generation result, with "max_tokens" set to the limit it was generated with.
+        """
+        limit = request_plan["max_tokens"]
+        generation = call(limit)
+        output_tokens = _output_tokens(generation)
+        if request_plan["sized"] and not generation.get("cache_hit") and output_tokens is not None and output_tokens >= limit:
+            logging.info(f"Response of class '{cost_class}' filled its sized limit of {limit} tokens; repeating with {self.max_tokens}.")
+            with self._lock:
+                self.escalations += 1
+            attempts = generation.get("attempts", 0)
+            limit = self.max_tokens
+            generation = call(limit)
+            generation["attempts"] = generation.get("attempts", 0) + attempts
+            output_tokens = _output_tokens(generation)
+        self.observe(cost_class, expected_tokens, output_tokens)
+        generation["max_tokens"] = limit
+        return generation
+
+    def record_split(self):
+        """Counts an overflowing request that the caller split into smaller ones instead of sending it."""
+        with self._lock:
+            self.splits += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"mode": self.mode, "tokenizer": tokenizer_name(), "context_window": self.context_window_tokens,
+                    "requests": self.requests, "sized_requests": self.sized_requests, "escalations": self.escalations,
+                    "overflows": self.overflows, "splits": self.splits, "clamped": self.clamped,
+                    "mean_reserved_tokens": round(self.reserved_tokens / self.requests, 1) if self.requests else None}
+
+def _output_tokens(generation):
+    """Output tokens of a generation result: provider-reported (or estimated) from its timings, else counted. None without content."""
+    if not generation.get("content"):
+        return None
+    output_tokens = (generation.get("timings") or {}).get("output_tokens")
+    return output_tokens if output_tokens is not None else count_tokens(generation["content"])
+
+
+if __name__ == '__main__':
+    import random
+
+    print("Token Budget Module - Test Run")
+    print(f"Tokenizer: {tokenizer_name()}; 'Ich bin ein Lehrer.' -> {count_tokens('Ich bin ein Lehrer.')} tokens")
+    random.seed(5)
+    for mode in MAX_TOKENS_MODES:
+        budget = TokenBudget(max_tokens=1500, context_window_tokens=4096, mode=mode, min_samples=10)
+        for i in range(300):
+            task_type, expected = ("open_ended", 400) if i % 3 == 0 else ("likert_scale", 10)
+            true_length = int(expected * (3.0 if i % 50 == 48 else random.uniform(0.4, 1.3))) + 2 # A few outliers
+            request_plan = budget.plan(task_type, expected, "You are a teacher. " * 40, "Rate the statement.")
+            budget.generate(lambda max_tokens: {"content": "x", "attempts": 1, "timings": {"output_tokens": min(true_length, max_tokens)}},
+                            task_type, expected, request_plan)
+        print(f"{mode}: {budget.stats()}")
+    overflow = TokenBudget(max_tokens=1500, context_window_tokens=512).plan("essay", 400, "word " * 600, "Discuss.")
+    print(f"Prompt of {overflow['prompt_tokens']} tokens in a 512-token window: {overflow}")
+    print("Token Budget Module - Test Run Finished")